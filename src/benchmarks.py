@@ -0,0 +1,213 @@
+import numpy as np
+import time
+import shutil
+import main
+from experience import ExperienceBuffer
+from qapproximations import QPolicy
+from features import PolynomialEngine
+from copy import deepcopy
+from defs import Car, Obstacle, ParkPlace, Scene
+
+# BENCHMARKS CONSTANTS
+BENCHMARK_SWEPT_SCENE_FUNCTION_NAMES = ["pp_middle_obstacles_oppdist_1_side_10_angle_pi", "obstacles_and_pole_angle_halfpi", "pp_random_car_random_side_20"]
+BENCHMARK_SWEPT_N_EPISODES = 60
+BENCHMARK_SWEPT_DTS = [0.025, 0.05, 0.1]
+BENCHMARK_SWEPT_SUBSTEP = 0.025
+BENCHMARK_SWEPT_DECISION_GAP = 0.1 # [s], as for main.QL_DT * main.QL_STEERING_GAP_STEPS
+BENCHMARK_SWEPT_POLE_DTS = [0.025, 0.05, 0.1, 0.2]
+BENCHMARK_SWEPT_TURN_V = 4.0 # [m / s], initial velocity of car turning right (no acceleration ahead, slowing down due to friction hence turning tighter)
+BENCHMARK_SWEPT_TURN_HIT_TIME = 0.9 # [s], pole put where front right corner of turning car is at this time (reference motion, small dt)
+BENCHMARK_SWEPT_TURN_POLE_HALF = 0.25
+BENCHMARK_EXPERIENCE_SIZE = 2 * 10**6
+BENCHMARK_EXPERIENCE_EPISODE_LENGTH = 250
+BENCHMARK_EXPERIENCE_BATCH_SIZE = main.QL_FIT_BATCH_SIZE
+BENCHMARK_EXPERIENCE_REPETITIONS = 5
+BENCHMARK_EXPERIENCE_FOLDER = "../experience/benchmark/"
+BENCHMARK_ACT_APPROXIMATOR_NAMES = ["qmlp_small", "qmlp_large", "qmlp_shared_small", "qridge_1e2_095"]
+BENCHMARK_ACT_TRANSFORMER_NAMES = ["poly_1", "poly_2", "poly_3"]
+BENCHMARK_ACT_FIT_SIZE = 2048
+BENCHMARK_ACT_N_CALLS = 200
+BENCHMARK_FEATURES_TRANSFORMER_NAMES = ["poly_1", "poly_2", "poly_3"]
+BENCHMARK_FEATURES_BATCH_SIZE = 16384
+
+def impose_action(car, action_pair): # accelerations for first frame of macro-step (as in main episode loop)
+    if action_pair[0] > 0:
+        car.accelerate_ahead(main.ACCELERATION_MAGNITUDES_AHEAD[action_pair[0]])
+    elif action_pair[0] < 0:
+        car.accelerate_back(main.ACCELERATION_MAGNITUDES_BACK[-action_pair[0]])
+    if action_pair[1] > 0:
+        car.accelerate_right(main.ACCELERATION_MAGNITUDES_SIDE[action_pair[1]])
+    elif action_pair[1] < 0:
+        car.accelerate_left(main.ACCELERATION_MAGNITUDES_SIDE[-action_pair[1]])
+
+def run_random_episode(scene, dt, swept, substep, seed, decision_gap=BENCHMARK_SWEPT_DECISION_GAP, time_limit=main.QL_EPISODE_TIME_LIMIT): # episode with random actions (same for all dts), returns (frames, outcome)
+    car = scene.car_
+    car.swept_collisions_ = swept
+    car.physics_substep_ = substep
+    car.reset_history(corners=False)
+    rng = np.random.RandomState(seed)
+    gap_steps = max(int(round(decision_gap / dt)), 1)
+    frame = 0
+    while not (car.collided_ or car.parked_ or frame * dt >= time_limit):
+        action_pair = main.ACTION_PAIRS[rng.randint(len(main.ACTION_PAIRS))]
+        impose_action(car, action_pair)
+        n_performed, _, _, _, _ = car.advance(action_pair, gap_steps, frame, dt, decision_gap, time_limit, scene.obstacles_, scene.park_place_)
+        frame += n_performed
+    outcome = "collision" if car.collided_ else ("parked" if car.parked_ else "time_exceeded")
+    return frame, outcome
+
+def benchmark_swept(): # frames per episode and time per episode for larger dts (with swept collisions and physics substeps) against reference dt
+    print(f"BENCHMARK SWEPT COLLISIONS AND PHYSICS SUBSTEPS... [episodes: {BENCHMARK_SWEPT_N_EPISODES}, scenes: {BENCHMARK_SWEPT_SCENE_FUNCTION_NAMES}]")
+    scene_functions = [getattr(main, "scene_" + name) for name in BENCHMARK_SWEPT_SCENE_FUNCTION_NAMES]
+    def scene(e):
+        np.random.seed(e)
+        return scene_functions[e % len(scene_functions)]()
+    for e in range(len(scene_functions)): # warm-up (compilations)
+        for swept, substep in [(False, 0.0), (True, BENCHMARK_SWEPT_SUBSTEP)]:
+            run_random_episode(scene(e), BENCHMARK_SWEPT_DTS[-1], swept, substep, e)
+    for dt in BENCHMARK_SWEPT_DTS:
+        for swept, substep in [(False, 0.0), (True, BENCHMARK_SWEPT_SUBSTEP)]:
+            if dt <= substep and swept:
+                continue
+            frames_total = 0
+            outcomes = {"collision": 0, "parked": 0, "time_exceeded": 0}
+            t1 = time.time()
+            for e in range(BENCHMARK_SWEPT_N_EPISODES):
+                frames, outcome = run_random_episode(scene(e), dt, swept, substep, e)
+                frames_total += frames
+                outcomes[outcome] += 1
+            t2 = time.time()
+            print(f"[dt: {dt} s, swept: {swept}, substep: {substep} s -> frames per episode: {frames_total / BENCHMARK_SWEPT_N_EPISODES:.1f}, time per episode: {(t2 - t1) / BENCHMARK_SWEPT_N_EPISODES * 1e3:.2f} ms, outcomes: {outcomes}]")
+    print("BENCHMARK SWEPT COLLISIONS AND PHYSICS SUBSTEPS DONE.")
+
+def pole_obstacle(pole_x, pole_y, pole_half):
+    return Obstacle([np.array([pole_x - pole_half, pole_y - pole_half]), np.array([pole_x - pole_half, pole_y + pole_half]),
+                     np.array([pole_x + pole_half, pole_y + pole_half]), np.array([pole_x + pole_half, pole_y - pole_half])])
+
+def distance_to_outline(car, x): # distance of point x to car rectangle sides (zero if on them), for collision point of car put back to time of impact
+    corners = [car.x_fl_, car.x_fr_, car.x_br_, car.x_bl_]
+    distances = []
+    for i in range(4):
+        a, b = corners[i], corners[(i + 1) % 4]
+        t = np.clip(np.dot(x - a, b - a) / np.dot(b - a, b - a), 0.0, 1.0)
+        distances.append(np.linalg.norm(x - (a + t * (b - a))))
+    return min(distances)
+
+def benchmark_swept_pole(): # car accelerating ahead (or turning) towards small pole (fitting inside car rectangle), collision detected or tunneled through
+    print("BENCHMARK SWEPT COLLISIONS, TUNNELING THROUGH POLE...")
+    pole_half = 0.05
+    pole = pole_obstacle(0.3, 15.0, pole_half)
+    ppfl = np.array([-10.0, 40.0])
+    park_place = ParkPlace(ppfl, ppfl + np.array([main.PARK_PLACE_WIDTH, 0.0]), ppfl + np.array([0.0, -main.PARK_PLACE_LENGTH]), ppfl + np.array([main.PARK_PLACE_WIDTH, -main.PARK_PLACE_LENGTH]))
+    for dt in BENCHMARK_SWEPT_POLE_DTS:
+        for swept in [False, True]:
+            car = Car(x=np.array([0.0, 0.0]), angle=0.0, swept_collisions=swept)
+            scene = Scene(car, park_place, [pole])
+            impose_action(car, (1, 0))
+            n_performed, _, _, _, _ = car.advance((1, 0), int(round(4.0 / dt)), 0, dt, dt, main.QL_EPISODE_TIME_LIMIT, scene.obstacles_, scene.park_place_)
+            print(f"[dt: {dt} s, swept: {swept} -> collided: {car.collided_}, frames: {n_performed}, car position: {car.x_}, collision point: {car.collision_x_}]")
+    # turning car (direction vectors rotating within steps): pose at time of impact checked against collision point
+    def turning_car(swept):
+        car = Car(x=np.array([0.0, 0.0]), angle=0.0, swept_collisions=swept)
+        car.v_ = np.array([0.0, BENCHMARK_SWEPT_TURN_V])
+        car.v_magnitude_ = BENCHMARK_SWEPT_TURN_V
+        return car
+    dt_reference = 0.005
+    car = turning_car(False)
+    car.advance((0, 1), int(round(BENCHMARK_SWEPT_TURN_HIT_TIME / dt_reference)), 0, dt_reference, dt_reference, main.QL_EPISODE_TIME_LIMIT, [], park_place)
+    pole = pole_obstacle(car.x_fr_[0], car.x_fr_[1], BENCHMARK_SWEPT_TURN_POLE_HALF)
+    angle_reference = car.angle_ahead_
+    for dt in BENCHMARK_SWEPT_POLE_DTS:
+        for swept in [False, True]:
+            car = turning_car(swept)
+            scene = Scene(car, park_place, [pole])
+            n_performed, _, _, _, _ = car.advance((0, 1), int(round(2.0 / dt)), 0, dt, dt, main.QL_EPISODE_TIME_LIMIT, scene.obstacles_, scene.park_place_)
+            outline = distance_to_outline(car, car.collision_x_) if car.collided_ else np.nan
+            print(f"[turning, dt: {dt} s, swept: {swept} -> collided: {car.collided_}, frames: {n_performed}, car angle: {car.angle_ahead_:.4f} (at {BENCHMARK_SWEPT_TURN_HIT_TIME} s: {angle_reference:.4f}), collision point off car outline: {outline:.4f} m]")
+    print("BENCHMARK SWEPT COLLISIONS, TUNNELING THROUGH POLE DONE.")
+
+def benchmark_experience_sampling(): # uniform batch sampling from in-memory and memory-mapped experience buffers (filled with random transitions, episode by episode)
+    print(f"BENCHMARK EXPERIENCE SAMPLING... [size: {BENCHMARK_EXPERIENCE_SIZE}, batch size: {BENCHMARK_EXPERIENCE_BATCH_SIZE}]")
+    state_size = main.scene_pp_middle_obstacles_oppdist_1_side_10_angle_pi().car_.get_state().size
+    rng = np.random.RandomState(0)
+    n = BENCHMARK_EXPERIENCE_EPISODE_LENGTH
+    states = rng.randn(n + 1, state_size) # episode trajectory: n transitions along n + 1 states
+    state_idxs = np.arange(n)
+    next_state_idxs = np.arange(1, n + 1)
+    actions = rng.randint(len(main.ACTION_PAIRS), size=n).astype(np.int8)
+    rewards = rng.randn(n)
+    terminals = np.zeros(n, dtype=bool)
+    for backend, folder in [("memory", None), ("memmap", BENCHMARK_EXPERIENCE_FOLDER)]:
+        t1 = time.time()
+        eb = ExperienceBuffer(BENCHMARK_EXPERIENCE_SIZE, state_size, folder=folder)
+        for _ in range(BENCHMARK_EXPERIENCE_SIZE // n):
+            eb.append(states, state_idxs, next_state_idxs, actions, rewards, terminals)
+        eb.flush()
+        t2 = time.time()
+        print(f"[backend: {backend} -> states stored: {min(eb.states_count_, eb.states_capacity_)}, states memory: {eb.states_.nbytes / 2**20:.1f} MB (states and next states per transition: {2 * eb.size_ * state_size * 8 / 2**20:.1f} MB)]")
+        batch = eb.empty_batch(BENCHMARK_EXPERIENCE_BATCH_SIZE)
+        times = []
+        for _ in range(BENCHMARK_EXPERIENCE_REPETITIONS):
+            indexes = rng.choice(eb.size_, BENCHMARK_EXPERIENCE_BATCH_SIZE)
+            t1_sample = time.time()
+            eb.sample(indexes, batch)
+            times.append(time.time() - t1_sample)
+        print(f"[backend: {backend} -> filling time: {t2 - t1:.2f} s, sampling time (first / mean of rest): {times[0] * 1e3:.1f} ms / {np.mean(times[1:]) * 1e3:.1f} ms]")
+        if folder is not None:
+            eb_shared = ExperienceBuffer.open(folder, mode="r") # as another process would see it
+            t1_sample = time.time()
+            eb_shared.sample(indexes, batch)
+            print(f"[backend: memmap reopened read-only -> sampling time: {(time.time() - t1_sample) * 1e3:.1f} ms]")
+            del eb, eb_shared
+            shutil.rmtree(folder)
+    print("BENCHMARK EXPERIENCE SAMPLING DONE.")
+
+def benchmark_act(): # latency of single-state greedy policy (as in steering loop): fit_transform and predict against QPolicy.act
+    print(f"BENCHMARK ACT... [approximators: {BENCHMARK_ACT_APPROXIMATOR_NAMES}, transformers: {BENCHMARK_ACT_TRANSFORMER_NAMES}, calls: {BENCHMARK_ACT_N_CALLS}]")
+    state_size = main.scene_pp_middle_obstacles_oppdist_1_side_10_angle_pi().car_.get_state().size
+    rng = np.random.RandomState(0)
+    states = rng.randn(BENCHMARK_ACT_N_CALLS, state_size)
+    for transformer_name in BENCHMARK_ACT_TRANSFORMER_NAMES:
+        transformer = main.TRANSFORMERS[transformer_name]
+        X = transformer.fit_transform(rng.randn(BENCHMARK_ACT_FIT_SIZE, state_size))
+        for approximator_name in BENCHMARK_ACT_APPROXIMATOR_NAMES:
+            Q = deepcopy(main.APPROXIMATORS[approximator_name])
+            Q.fit(X, rng.randn(BENCHMARK_ACT_FIT_SIZE, len(main.ACTION_PAIRS)), rng.randint(len(main.ACTION_PAIRS), size=BENCHMARK_ACT_FIT_SIZE).astype(np.int32))
+            policy = QPolicy(Q, transformer, state_size)
+            policy.act(states[0]) # warm-up (compilation)
+            t1 = time.time()
+            for state in states:
+                q_values = Q.predict(transformer.fit_transform(np.array([state])))[0]
+                action_index = np.argmax(q_values)
+            t2 = time.time()
+            for state in states:
+                q_values_act, action_index_act = policy.act(state)
+            t3 = time.time()
+            same = np.array_equal(q_values, q_values_act) and action_index == action_index_act
+            print(f"[transformer: {transformer_name}, approximator: {approximator_name} -> fit_transform and predict: {(t2 - t1) / BENCHMARK_ACT_N_CALLS * 1e6:.1f} us, act: {(t3 - t2) / BENCHMARK_ACT_N_CALLS * 1e6:.1f} us, same result: {same}]")
+    print("BENCHMARK ACT DONE.")
+
+def benchmark_features(): # batch polynomial features: PolynomialFeatures.fit_transform against PolynomialEngine.transform (into preallocated output)
+    print(f"BENCHMARK FEATURES... [transformers: {BENCHMARK_FEATURES_TRANSFORMER_NAMES}, batch size: {BENCHMARK_FEATURES_BATCH_SIZE}]")
+    state_size = main.scene_pp_middle_obstacles_oppdist_1_side_10_angle_pi().car_.get_state().size
+    rng = np.random.RandomState(0)
+    X = rng.randn(BENCHMARK_FEATURES_BATCH_SIZE, state_size)
+    for transformer_name in BENCHMARK_FEATURES_TRANSFORMER_NAMES:
+        transformer = main.TRANSFORMERS[transformer_name]
+        engine = PolynomialEngine(transformer, state_size)
+        out = np.empty((BENCHMARK_FEATURES_BATCH_SIZE, engine.n_output_features_))
+        engine.transform(X[:1], out[:1]) # warm-up (compilation)
+        t1 = time.time()
+        X_sklearn = transformer.fit_transform(X)
+        t2 = time.time()
+        engine.transform(X, out)
+        t3 = time.time()
+        print(f"[transformer: {transformer_name}, features: {engine.n_output_features_} -> fit_transform: {(t2 - t1) * 1e3:.1f} ms, engine transform: {(t3 - t2) * 1e3:.1f} ms, same result: {np.array_equal(X_sklearn, out)}]")
+    print("BENCHMARK FEATURES DONE.")
+
+if __name__ == "__main__":
+    benchmark_swept_pole()
+    benchmark_swept()
+    benchmark_experience_sampling()
+    benchmark_act()
+    benchmark_features()
@@ -26,6 +26,18 @@ CAR_ANTISTUCK_CHECK_RADIUS = 0.25
 CAR_ANTISTUCK_CHECK_SECONDS_BACK = 3.0
 CAR_STATE_REPR_FUNCTION_NAME = "dv_flfrblbr2s_dag_invariant_sensors"
 
+# OBSTACLES SPATIAL INDEX CONSTANTS (uniform grid over obstacles edges, built for scenes with many edges only)
+OBSTACLES_GRID_MIN_EDGES = 64
+OBSTACLES_GRID_CELL_SIZE = 2.0
+
+# SIMULATION MODES CONSTANTS (allowing larger time steps, off by default)
+SIMULATION_SWEPT_COLLISIONS = False # collisions checked along car motion within step (no tunneling through thin obstacles at larger dt)
+SIMULATION_PHYSICS_SUBSTEP = 0.0 # if positive: motion (with friction and accelerations imposed) integrated within step in substeps not longer than this [s], as for sequence of short steps
+SWEPT_MAX_PIECE_ROTATION = np.pi / 36 # swept collisions: motion with rotation checked in linear pieces, car rotating by at most this angle [rad] along each piece
+
+# TRAJECTORY HISTORY CONSTANTS
+HISTORY_CAPACITY = 1024 # number of most recent frames memorized by car (ring buffer)
+
 # PARK PLACE CONSTANTS
 PARK_PLACE_LENGTH = 6.10
 PARK_PLACE_WIDTH = 2.74
@@ -53,421 +65,1057 @@ def solve_lines_intersection(x11, x12, x21, x22):
         t2 = np.inf # parallel lines
     return t1, t2
 
-class Car:
+@jit(nopython=True)
+def sensors_values_numba(x, sensors_xs, edges, max_value, values): # rays from car position x through sensors points against packed obstacles edges (E, 2, 2), written to values (in place)
+    n_sensors = sensors_xs.shape[0]
+    values[:] = max_value
+    for si in range(n_sensors):
+        sx = sensors_xs[si]
+        for ei in range(edges.shape[0]):
+            ox1 = edges[ei, 0]
+            ox2 = edges[ei, 1]
+            ts, to = solve_lines_intersection(x, sx, ox1, ox2)
+            if ts >= 0.0 and to >= 0.0 and to <= 1.0:
+                dx = ox1[0] + to * (ox2[0] - ox1[0]) - sx[0]
+                dy = ox1[1] + to * (ox2[1] - ox1[1]) - sx[1]
+                value = np.sqrt(dx * dx + dy * dy)
+                if ts <= 1.0:
+                    value = -value # how deep collision
+                if value < values[si]:
+                    values[si] = value
+
+@jit(nopython=True)
+def sensors_values_batch_numba(xs, sensors_xs, edges, n_edges, max_value, values): # batch variant: xs (N, 2), sensors_xs (N, S, 2), edges (N, E, 2, 2) of which first n_edges[i] used for i-th car, written to values (N, S)
+    # (sensors queries for many cars at once, e.g. padded per-car obstacles as in CarBatch, whose stepping goes through car_batch_step_numba)
+    for i in range(xs.shape[0]):
+        sensors_values_numba(xs[i], sensors_xs[i], edges[i, :n_edges[i]], max_value, values[i])
+
+@jit(nopython=True)
+def check_collisions_numba(x, radius, x_fl, x_fr, x_bl, x_br, edges, ranges, aabbs): # returns (index of edge hit, its intersection parameter) or (-1, 0.0)
+    # broadphase: car bounding circle (center x) against axis-aligned bounding boxes of obstacles
+    n_obstacles = ranges.shape[0]
+    near = np.zeros(n_obstacles, dtype=np.bool_)
+    any_near = False
+    for o in range(n_obstacles):
+        dx = max(aabbs[o, 0] - x[0], 0.0, x[0] - aabbs[o, 2])
+        dy = max(aabbs[o, 1] - x[1], 0.0, x[1] - aabbs[o, 3])
+        if dx * dx + dy * dy <= radius * radius:
+            near[o] = True
+            any_near = True
+    if not any_near:
+        return -1, 0.0
+    # narrowphase: car segments against edges of near obstacles (in order as in former Car._check_collisions)
+    for s in range(4):
+        if s == 0:
+            cs1, cs2 = x_fl, x_fr
+        elif s == 1:
+            cs1, cs2 = x_bl, x_br
+        elif s == 2:
+            cs1, cs2 = x_bl, x_fl
+        else:
+            cs1, cs2 = x_br, x_fr
+        for o in range(n_obstacles):
+            if near[o]:
+                for ei in range(ranges[o, 0], ranges[o, 1]):
+                    tcs, to = solve_lines_intersection(cs1, cs2, edges[ei, 0], edges[ei, 1])
+                    if tcs >= 0.0 and tcs <= 1.0 and to >= 0.0 and to <= 1.0:
+                        return ei, to
+    return -1, 0.0
+
+@jit(nopython=True)
+def check_collisions_batch_numba(xs, radius, xs_fl, xs_fr, xs_bl, xs_br, edges, ranges, aabbs, n_obstacles, edges_hit, tos): # batch variant: ranges (N, O, 2), aabbs (N, O, 4) of which first n_obstacles[i] used for i-th car, written to edges_hit (N,) and tos (N,)
+    for i in range(xs.shape[0]):
+        no = n_obstacles[i]
+        edges_hit[i], tos[i] = check_collisions_numba(xs[i], radius, xs_fl[i], xs_fr[i], xs_bl[i], xs_br[i], edges[i], ranges[i, :no], aabbs[i, :no])
+
+@jit(nopython=True)
+def build_grid_numba(edges, origin, cell_size, nx, ny): # uniform grid over edges: each edge registered in cells covered by its bounding box, returns cells' starts (nx * ny + 1,) and edges' indexes (CSR format)
+    n_edges = edges.shape[0]
+    cells_ranges = np.empty((n_edges, 4), dtype=np.int64)
+    counts = np.zeros(nx * ny + 1, dtype=np.int64)
+    for ei in range(n_edges):
+        ix1 = min(max(int(np.floor((min(edges[ei, 0, 0], edges[ei, 1, 0]) - origin[0]) / cell_size)), 0), nx - 1)
+        ix2 = min(max(int(np.floor((max(edges[ei, 0, 0], edges[ei, 1, 0]) - origin[0]) / cell_size)), 0), nx - 1)
+        iy1 = min(max(int(np.floor((min(edges[ei, 0, 1], edges[ei, 1, 1]) - origin[1]) / cell_size)), 0), ny - 1)
+        iy2 = min(max(int(np.floor((max(edges[ei, 0, 1], edges[ei, 1, 1]) - origin[1]) / cell_size)), 0), ny - 1)
+        cells_ranges[ei, 0], cells_ranges[ei, 1], cells_ranges[ei, 2], cells_ranges[ei, 3] = ix1, ix2, iy1, iy2
+        for ix in range(ix1, ix2 + 1):
+            for iy in range(iy1, iy2 + 1):
+                counts[ix * ny + iy + 1] += 1
+    starts = np.cumsum(counts)
+    cells_edges = np.empty(starts[-1], dtype=np.int64)
+    filled = np.zeros(nx * ny, dtype=np.int64)
+    for ei in range(n_edges): # edges' indexes ascending within each cell
+        for ix in range(cells_ranges[ei, 0], cells_ranges[ei, 1] + 1):
+            for iy in range(cells_ranges[ei, 2], cells_ranges[ei, 3] + 1):
+                c = ix * ny + iy
+                cells_edges[starts[c] + filled[c]] = ei
+                filled[c] += 1
+    return starts, cells_edges
+
+@jit(nopython=True)
+def sensors_values_grid_numba(x, sensors_xs, edges, origin, cell_size, nx, ny, starts, cells_edges, stamps, stamp, max_value, values): # as sensors_values_numba but visiting only grid cells along rays (front to back)
+    n_sensors = sensors_xs.shape[0]
+    values[:] = max_value
+    x_max = origin[0] + nx * cell_size
+    y_max = origin[1] + ny * cell_size
+    for si in range(n_sensors):
+        sx = sensors_xs[si]
+        dx = sx[0] - x[0]
+        dy = sx[1] - x[1]
+        t_enter = 0.0 
+        t_exit = 1.0 + max_value / np.sqrt(dx * dx + dy * dy) # farther hits do not change sensor value
+        # clipping ray to grid box
+        if dx != 0.0:
+            t1 = (origin[0] - x[0]) / dx
+            t2 = (x_max - x[0]) / dx
+            t_enter = max(t_enter, min(t1, t2))
+            t_exit = min(t_exit, max(t1, t2))
+        elif x[0] < origin[0] or x[0] > x_max:
+            continue
+        if dy != 0.0:
+            t1 = (origin[1] - x[1]) / dy
+            t2 = (y_max - x[1]) / dy
+            t_enter = max(t_enter, min(t1, t2))
+            t_exit = min(t_exit, max(t1, t2))
+        elif x[1] < origin[1] or x[1] > y_max:
+            continue
+        if t_enter > t_exit:
+            continue
+        # traversal of grid cells (Amanatides-Woo)
+        stamp[0] += 1        
+        ix = min(max(int(np.floor((x[0] + t_enter * dx - origin[0]) / cell_size)), 0), nx - 1)
+        iy = min(max(int(np.floor((x[1] + t_enter * dy - origin[1]) / cell_size)), 0), ny - 1)
+        step_x = 1 if dx > 0.0 else -1
+        step_y = 1 if dy > 0.0 else -1
+        t_max_x = ((origin[0] + (ix + (1 if dx > 0.0 else 0)) * cell_size) - x[0]) / dx if dx != 0.0 else np.inf
+        t_max_y = ((origin[1] + (iy + (1 if dy > 0.0 else 0)) * cell_size) - x[1]) / dy if dy != 0.0 else np.inf
+        t_delta_x = cell_size / abs(dx) if dx != 0.0 else np.inf
+        t_delta_y = cell_size / abs(dy) if dy != 0.0 else np.inf
+        best_ts = np.inf
+        while True:
+            c = ix * ny + iy
+            for k in range(starts[c], starts[c + 1]):
+                ei = cells_edges[k]
+                if stamps[ei] == stamp[0]:
+                    continue
+                stamps[ei] = stamp[0]
+                ox1 = edges[ei, 0]
+                ox2 = edges[ei, 1]
+                ts, to = solve_lines_intersection(x, sx, ox1, ox2)
+                if ts >= 0.0 and to >= 0.0 and to <= 1.0:
+                    ex = ox1[0] + to * (ox2[0] - ox1[0]) - sx[0]
+                    ey = ox1[1] + to * (ox2[1] - ox1[1]) - sx[1]
+                    value = np.sqrt(ex * ex + ey * ey)
+                    if ts <= 1.0:
+                        value = -value # how deep collision
+                    if value < values[si]:
+                        values[si] = value
+                    best_ts = min(best_ts, ts)
+            t_cell_exit = min(t_max_x, t_max_y)
+            if best_ts < t_cell_exit - 1e-9 or t_cell_exit > t_exit: # sensor value monotonic along ray, hits in further cells cannot be closer
+                break
+            if t_max_x < t_max_y:
+                ix += step_x
+                t_max_x += t_delta_x
+            else:
+                iy += step_y
+                t_max_y += t_delta_y
+            if ix < 0 or ix >= nx or iy < 0 or iy >= ny:
+                break
+
+@jit(nopython=True)
+def check_collisions_grid_numba(x, radius, x_fl, x_fr, x_bl, x_br, edges, origin, cell_size, nx, ny, starts, cells_edges, stamps, stamp, candidates): # as check_collisions_numba but with candidate edges from grid cells covered by car bounding circle
+    ix1 = int(np.floor((x[0] - radius - origin[0]) / cell_size))
+    ix2 = int(np.floor((x[0] + radius - origin[0]) / cell_size))
+    iy1 = int(np.floor((x[1] - radius - origin[1]) / cell_size))
+    iy2 = int(np.floor((x[1] + radius - origin[1]) / cell_size))
+    if ix2 < 0 or ix1 >= nx or iy2 < 0 or iy1 >= ny:
+        return -1, 0.0
+    stamp[0] += 1
+    n_candidates = 0
+    for ix in range(max(ix1, 0), min(ix2, nx - 1) + 1):
+        for iy in range(max(iy1, 0), min(iy2, ny - 1) + 1):
+            c = ix * ny + iy
+            for k in range(starts[c], starts[c + 1]):
+                ei = cells_edges[k]
+                if stamps[ei] != stamp[0]:
+                    stamps[ei] = stamp[0]
+                    candidates[n_candidates] = ei
+                    n_candidates += 1
+    if n_candidates == 0:
+        return -1, 0.0
+    candidates_sorted = np.sort(candidates[:n_candidates]) # order of edges as in obstacles
+    for s in range(4):
+        if s == 0:
+            cs1, cs2 = x_fl, x_fr
+        elif s == 1:
+            cs1, cs2 = x_bl, x_br
+        elif s == 2:
+            cs1, cs2 = x_bl, x_fl
+        else:
+            cs1, cs2 = x_br, x_fr
+        for ei in candidates_sorted:
+            tcs, to = solve_lines_intersection(cs1, cs2, edges[ei, 0], edges[ei, 1])
+            if tcs >= 0.0 and tcs <= 1.0 and to >= 0.0 and to <= 1.0:
+                return ei, to
+    return -1, 0.0
+
+@jit(nopython=True)
+def check_collisions_swept_numba(corners_before, corners_after, edges, ranges, aabbs): # car corners (4, 2) in cyclic order moving linearly within step against obstacles edges
+    # returns (index of edge hit, time of impact in [0, 1], point of impact x, y) or (-1, 0.0, 0.0, 0.0)
+    # broadphase: bounding box of swept car against axis-aligned bounding boxes of obstacles
+    x_min = min(np.min(corners_before[:, 0]), np.min(corners_after[:, 0]))
+    y_min = min(np.min(corners_before[:, 1]), np.min(corners_after[:, 1]))
+    x_max = max(np.max(corners_before[:, 0]), np.max(corners_after[:, 0]))
+    y_max = max(np.max(corners_before[:, 1]), np.max(corners_after[:, 1]))
+    ei_hit = -1
+    t_hit = np.inf
+    x_hit, y_hit = 0.0, 0.0
+    for o in range(ranges.shape[0]):
+        if aabbs[o, 0] > x_max or aabbs[o, 2] < x_min or aabbs[o, 1] > y_max or aabbs[o, 3] < y_min:
+            continue
+        for ei in range(ranges[o, 0], ranges[o, 1]):
+            ox1 = edges[ei, 0]
+            ox2 = edges[ei, 1]
+            for i in range(4):
+                # path of car corner against obstacle edge
+                tc, to = solve_lines_intersection(corners_before[i], corners_after[i], ox1, ox2)
+                if tc >= 0.0 and tc <= 1.0 and to >= 0.0 and to <= 1.0 and tc < t_hit:
+                    ei_hit, t_hit = ei, tc
+                    x_hit = corners_before[i, 0] + tc * (corners_after[i, 0] - corners_before[i, 0])
+                    y_hit = corners_before[i, 1] + tc * (corners_after[i, 1] - corners_before[i, 1])
+                # obstacle vertex (first one of edge) against car side, along their relative motion
+                j = (i + 1) % 4
+                mx = 0.5 * (corners_after[i, 0] + corners_after[j, 0]) - 0.5 * (corners_before[i, 0] + corners_before[j, 0])
+                my = 0.5 * (corners_after[i, 1] + corners_after[j, 1]) - 0.5 * (corners_before[i, 1] + corners_before[j, 1])
+                tv, tc = solve_lines_intersection(ox1, (ox1[0] - mx, ox1[1] - my), corners_before[i], corners_before[j])
+                if tv >= 0.0 and tv <= 1.0 and tc >= 0.0 and tc <= 1.0 and tv < t_hit:
+                    ei_hit, t_hit = ei, tv
+                    x_hit, y_hit = ox1[0], ox1[1]
+    if ei_hit < 0:
+        return -1, 0.0, 0.0, 0.0
+    return ei_hit, t_hit, x_hit, y_hit
+
+class ObstaclesPack: # obstacles (polygons) packed into contiguous arrays, with uniform grid over edges for scenes with many of them 
+    def __init__(self, obstacles, grid_min_edges=OBSTACLES_GRID_MIN_EDGES, grid_cell_size=OBSTACLES_GRID_CELL_SIZE):
+        edges = [(obstacle.xs_[oxi], obstacle.xs_[(oxi + 1) % len(obstacle.xs_)]) for obstacle in obstacles for oxi in range(len(obstacle.xs_))]
+        self.edges_ = np.array(edges, dtype=np.float64).reshape(-1, 2, 2) # (E, 2, 2)
+        self.ranges_ = np.zeros((len(obstacles), 2), dtype=np.int64) # (O, 2): ranges of edges' indexes per obstacle
+        self.aabbs_ = np.zeros((len(obstacles), 4)) # (O, 4): axis-aligned bounding boxes per obstacle (x min, y min, x max, y max)
+        start = 0
+        for o, obstacle in enumerate(obstacles):
+            xs = np.array(obstacle.xs_, dtype=np.float64).reshape(-1, 2)
+            self.ranges_[o] = [start, start + xs.shape[0]]
+            if xs.shape[0] > 0:
+                self.aabbs_[o, :2] = np.min(xs, axis=0)
+                self.aabbs_[o, 2:] = np.max(xs, axis=0)
+            start += xs.shape[0]
+        self.grid_on_ = self.edges_.shape[0] >= grid_min_edges
+        self.grid_cell_size_ = grid_cell_size
+        self.grid_origin_ = np.zeros(2)
+        self.grid_nx_, self.grid_ny_ = 0, 0 # zero-sized grid when off
+        self.grid_starts_, self.grid_cells_edges_ = np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        if self.grid_on_:
+            self.grid_origin_ = np.min(self.edges_.reshape(-1, 2), axis=0) - grid_cell_size
+            self.grid_nx_, self.grid_ny_ = (np.floor((np.max(self.edges_.reshape(-1, 2), axis=0) + grid_cell_size - self.grid_origin_) / grid_cell_size).astype(np.int64) + 1).tolist()
+            self.grid_starts_, self.grid_cells_edges_ = build_grid_numba(self.edges_, self.grid_origin_, grid_cell_size, self.grid_nx_, self.grid_ny_)
+        self.grid_stamps_ = np.zeros(self.edges_.shape[0], dtype=np.int64) # query marks (each edge tested at most once per query)
+        self.grid_stamp_ = np.zeros(1, dtype=np.int64)
+        self.grid_candidates_ = np.empty(self.edges_.shape[0], dtype=np.int64)
+        self.arrays_ = (self.edges_, self.ranges_, self.aabbs_, self.grid_origin_, self.grid_cell_size_, self.grid_nx_, self.grid_ny_, 
+                        self.grid_starts_, self.grid_cells_edges_, self.grid_stamps_, self.grid_stamp_, self.grid_candidates_) # as passed to car_step_numba
+            
+    def sensors_values(self, x, sensors_xs, max_value, values):
+        if self.grid_on_:
+            sensors_values_grid_numba(x, sensors_xs, self.edges_, self.grid_origin_, self.grid_cell_size_, self.grid_nx_, self.grid_ny_, 
+                                      self.grid_starts_, self.grid_cells_edges_, self.grid_stamps_, self.grid_stamp_, max_value, values)
+        else:
+            sensors_values_numba(x, sensors_xs, self.edges_, max_value, values)
+    
+    def check_collisions(self, x, radius, x_fl, x_fr, x_bl, x_br):
+        if self.grid_on_:
+            return check_collisions_grid_numba(x, radius, x_fl, x_fr, x_bl, x_br, self.edges_, self.grid_origin_, self.grid_cell_size_, self.grid_nx_, self.grid_ny_, 
+                                               self.grid_starts_, self.grid_cells_edges_, self.grid_stamps_, self.grid_stamp_, self.grid_candidates_)
+        return check_collisions_numba(x, radius, x_fl, x_fr, x_bl, x_br, self.edges_, self.ranges_, self.aabbs_)
+
+# CAR STATE BLOCK LAYOUT (indexes within single contiguous float64 array holding car state, sensors points and values at its end)
+_X, _V, _A, _D_AHEAD, _D_RIGHT = 0, 2, 4, 6, 8
+_X_FL, _X_FR, _X_F, _X_BL, _X_BR, _X_B, _X_R, _X_L = 10, 12, 14, 16, 18, 20, 22, 24
+_COLLISION_X = 26
+_TPP_F, _TPP_B, _TPP, _TPP_FL, _TPP_FR, _TPP_BL, _TPP_BR, _TPP_FL2, _TPP_FR2, _TPP_BL2, _TPP_BR2, _TPP_D_AHEAD = 28, 30, 32, 34, 36, 38, 40, 42, 44, 46, 48, 50
+_V_MAGNITUDE, _A_MAGNITUDE, _ANGLE_AHEAD, _DISTANCE, _ANGLE_DISTANCE, _GUTTER_DISTANCE, _REWARD = 52, 53, 54, 55, 56, 57, 58
+_TPP_F_NORM, _TPP_B_NORM, _TPP_NORM, _TPP_FL2_NORM, _TPP_FR2_NORM, _TPP_BL2_NORM, _TPP_BR2_NORM = 59, 60, 61, 62, 63, 64, 65
+_SENSORS = 66 # sensors points (n_sensors, 2), then sensors values (n_sensors,); order of sensors: front, back, left, right
+# CAR PARAMETERS ARRAY LAYOUT
+_P_L, _P_W, _P_MU_STATIC, _P_MU_KINETIC, _P_MAX_VELOCITY, _P_MIN_VELOCITY_TO_TURN, _P_BOUNDING_RADIUS = 0, 1, 2, 3, 4, 5, 6
+# PARK PLACE ARRAY LAYOUT
+_PP_X, _PP_D_AHEAD, _PP_D_RIGHT, _PP_D_RIGHT_0, _PP_WIDTH = 0, 2, 4, 6, 7
+
+@jit(nopython=True)
+def car_accelerate_numba(b, d_index, sign, magnitude): # imposes acceleration along (signed) direction vector at d_index of state block b
+    b[_A] += sign * b[d_index] * magnitude
+    b[_A + 1] += sign * b[d_index + 1] * magnitude
+    b[_A_MAGNITUDE] = np.sqrt(b[_A] * b[_A] + b[_A + 1] * b[_A + 1])
+
+@jit(nopython=True)
+def car_physics_numba(b, dt, params, static_friction): # friction, motion and direction vectors update of state block b (in place)
+    # static friction        
+    if static_friction and b[_V_MAGNITUDE] == 0.0 and b[_A_MAGNITUDE] > 0.0:
+        friction_factor_static = min(params[_P_MU_STATIC] * CONST_G / b[_A_MAGNITUDE], 1.0)
+        b[_A] -= friction_factor_static * b[_A]
+        b[_A + 1] -= friction_factor_static * b[_A + 1]
+        b[_A_MAGNITUDE] *= 1.0 - friction_factor_static
+    # kinetic friction
+    friction_factor_kinetic = 0.0
+    if b[_V_MAGNITUDE] > 0.0:
+        mu_kinetic_g_dt = params[_P_MU_KINETIC] * CONST_G * dt
+        v_mean_x = b[_V] + 0.5 * b[_A] * dt
+        v_mean_y = b[_V + 1] + 0.5 * b[_A + 1] * dt
+        v_mean_magnitude = np.sqrt(v_mean_x * v_mean_x + v_mean_y * v_mean_y)
+        friction_factor_kinetic = min(mu_kinetic_g_dt / v_mean_magnitude, 1.0) if v_mean_magnitude > 0.0 else 1.0
+    # update position and velocity
+    for k in range(2):
+        b[_X + k] += (1.0 - friction_factor_kinetic) * (b[_V + k] * dt + 0.5 * b[_A + k] * dt**2)
+        b[_V + k] = (1.0 - friction_factor_kinetic) * (b[_V + k] + b[_A + k] * dt)
+    v_magnitude = np.sqrt(b[_V] * b[_V] + b[_V + 1] * b[_V + 1])
+    if v_magnitude > params[_P_MAX_VELOCITY]:
+        b[_V] = params[_P_MAX_VELOCITY] * b[_V] / v_magnitude
+        b[_V + 1] = params[_P_MAX_VELOCITY] * b[_V + 1] / v_magnitude
+        v_magnitude = params[_P_MAX_VELOCITY]
+    b[_V_MAGNITUDE] = v_magnitude
+    # update direction vectors
+    if v_magnitude > 0.0:
+        d_ahead_x = b[_V] / v_magnitude
+        d_ahead_y = b[_V + 1] / v_magnitude
+        if d_ahead_x * b[_D_AHEAD] + d_ahead_y * b[_D_AHEAD + 1] < 0.0:
+            d_ahead_x *= -1.0 # prevents unrealistic front-back 'flips'
+            d_ahead_y *= -1.0
+        b[_D_AHEAD] = d_ahead_x
+        b[_D_AHEAD + 1] = d_ahead_y
+        b[_D_RIGHT] = d_ahead_y # rotation by -pi/2
+        b[_D_RIGHT + 1] = -d_ahead_x
+        angle_ahead = np.arctan2(d_ahead_y, d_ahead_x)
+        if angle_ahead < 0.0:
+            angle_ahead += 2 * np.pi
+        b[_ANGLE_AHEAD] = angle_ahead
+    # accelerations for current step are now consumed
+    b[_A] = 0.0
+    b[_A + 1] = 0.0
+    b[_A_MAGNITUDE] = 0.0
+
+@jit(nopython=True)
+def car_geometry_numba(b, params, n_sensors_front, n_sensors_back, n_sensors_sides): # corners and sensors points of state block b (in place)
+    l = params[_P_L]
+    w = params[_P_W]
+    for k in range(2):
+        b[_X_FL + k] = b[_X + k] + b[_D_AHEAD + k] * 0.5 * l - b[_D_RIGHT + k] * 0.5 * w
+        b[_X_FR + k] = b[_X_FL + k] + b[_D_RIGHT + k] * w
+        b[_X_F + k] = 0.5 * (b[_X_FL + k] + b[_X_FR + k])
+        b[_X_BL + k] = b[_X_FL + k] - b[_D_AHEAD + k] * l
+        b[_X_BR + k] = b[_X_BL + k] + b[_D_RIGHT + k] * w
+        b[_X_B + k] = 0.5 * (b[_X_BL + k] + b[_X_BR + k])
+        b[_X_R + k] = 0.5 * (b[_X_FR + k] + b[_X_BR + k])
+        b[_X_L + k] = 0.5 * (b[_X_FL + k] + b[_X_BL + k])
+        s = _SENSORS + k
+        gap = w / (n_sensors_front - 1)
+        for i in range(n_sensors_front):
+            b[s] = b[_X_FL + k] + i * gap * b[_D_RIGHT + k]
+            s += 2
+        gap = w / (n_sensors_back - 1)
+        for i in range(n_sensors_back):
+            b[s] = b[_X_BL + k] + i * gap * b[_D_RIGHT + k]
+            s += 2
+        gap = l / (n_sensors_sides + 1)
+        for i in range(n_sensors_sides):
+            b[s] = b[_X_BL + k] + (i + 1) * gap * b[_D_AHEAD + k]
+            b[s + 2 * n_sensors_sides] = b[_X_BR + k] + (i + 1) * gap * b[_D_AHEAD + k]
+            s += 2
+
+@jit(nopython=True)
+def car_pose_corners_numba(x, y, d_ahead_x, d_ahead_y, d_right_x, d_right_y, params, out): # corners of car at pose (position, direction vectors) in cyclic order (front left, front right, back right, back left) written into out (4, 2)
+    l = params[_P_L]
+    w = params[_P_W]
+    out[0, 0] = x + d_ahead_x * 0.5 * l - d_right_x * 0.5 * w
+    out[0, 1] = y + d_ahead_y * 0.5 * l - d_right_y * 0.5 * w
+    out[1, 0] = out[0, 0] + d_right_x * w
+    out[1, 1] = out[0, 1] + d_right_y * w
+    out[3, 0] = out[0, 0] - d_ahead_x * l
+    out[3, 1] = out[0, 1] - d_ahead_y * l
+    out[2, 0] = out[3, 0] + d_right_x * w
+    out[2, 1] = out[3, 1] + d_right_y * w
+
+@jit(nopython=True)
+def car_corners_numba(b, params, out): # corners of state block b (see car_pose_corners_numba)
+    car_pose_corners_numba(b[_X], b[_X + 1], b[_D_AHEAD], b[_D_AHEAD + 1], b[_D_RIGHT], b[_D_RIGHT + 1], params, out)
+
+@jit(nopython=True)
+def car_pose_at_numba(before, b, rotation, t): # pose (position, direction vectors) at fraction t of motion from pose before (x, y, d ahead, d right) to pose of state block b: position linear, direction vectors rotated by t * rotation
+    c = np.cos(t * rotation)
+    s = np.sin(t * rotation)
+    return (before[0] + t * (b[_X] - before[0]), before[1] + t * (b[_X + 1] - before[1]), 
+            c * before[2] - s * before[3], s * before[2] + c * before[3], c * before[4] - s * before[5], s * before[4] + c * before[5])
+
+@jit(nopython=True)
+def car_motion_numba(b, collided, dt, params, static_friction, swept, substep, edges, ranges, aabbs): # motion of state block b within step (in substeps if substep > 0), with collisions checked along it (if swept); returns collided flag
+    n_substeps = 1
+    if substep > 0.0 and dt > substep:
+        n_substeps = int(np.ceil(dt / substep))
+    h = dt / n_substeps
+    # imposed acceleration decomposed along direction vectors (imposed again in each substep, as if in each of short steps)
+    ahead = b[_A] * b[_D_AHEAD] + b[_A + 1] * b[_D_AHEAD + 1]
+    side = b[_A] * b[_D_RIGHT] + b[_A + 1] * b[_D_RIGHT + 1]
+    corners_before = np.empty((4, 2))
+    corners_after = np.empty((4, 2))
+    before = np.empty(6) # pose before substep: position, direction vectors
+    v_before = np.empty(2)
+    for i in range(n_substeps):
+        if i > 0:
+            if ahead != 0.0:
+                car_accelerate_numba(b, _D_AHEAD, 1.0, ahead)
+            if side != 0.0 and b[_V_MAGNITUDE] >= params[_P_MIN_VELOCITY_TO_TURN]:
+                car_accelerate_numba(b, _D_RIGHT, 1.0, side)
+        if swept:
+            for k in range(2):
+                before[k] = b[_X + k]
+                before[2 + k] = b[_D_AHEAD + k]
+                before[4 + k] = b[_D_RIGHT + k]
+                v_before[k] = b[_V + k]
+            car_corners_numba(b, params, corners_before)
+        car_physics_numba(b, h, params, static_friction)
+        if swept:
+            # rotation of car within substep (signed angle from direction ahead before to direction ahead after), motion checked in pieces along which corners move (nearly) linearly
+            rotation = np.arctan2(before[2] * b[_D_AHEAD + 1] - before[3] * b[_D_AHEAD], before[2] * b[_D_AHEAD] + before[3] * b[_D_AHEAD + 1])
+            n_pieces = max(int(np.ceil(np.abs(rotation) / SWEPT_MAX_PIECE_ROTATION)), 1)
+            ei = -1
+            for p in range(n_pieces):
+                if p > 0:
+                    corners_before[:] = corners_after
+                if p == n_pieces - 1:
+                    car_corners_numba(b, params, corners_after)
+                else:
+                    x, y, d_ahead_x, d_ahead_y, d_right_x, d_right_y = car_pose_at_numba(before, b, rotation, (p + 1) / n_pieces)
+                    car_pose_corners_numba(x, y, d_ahead_x, d_ahead_y, d_right_x, d_right_y, params, corners_after)
+                ei, t, x_hit, y_hit = check_collisions_swept_numba(corners_before, corners_after, edges, ranges, aabbs)
+                if ei >= 0:
+                    t = (p + t) / n_pieces
+                    break
+            if ei >= 0: # car put back to time of impact: position, direction vectors and velocity (corners and sensors then refreshed from consistent pose)
+                x, y, d_ahead_x, d_ahead_y, d_right_x, d_right_y = car_pose_at_numba(before, b, rotation, t)
+                b[_X], b[_X + 1] = x, y
+                b[_D_AHEAD], b[_D_AHEAD + 1] = d_ahead_x, d_ahead_y
+                b[_D_RIGHT], b[_D_RIGHT + 1] = d_right_x, d_right_y
+                angle_ahead = np.arctan2(d_ahead_y, d_ahead_x)
+                if angle_ahead < 0.0:
+                    angle_ahead += 2 * np.pi
+                b[_ANGLE_AHEAD] = angle_ahead
+                for k in range(2):
+                    b[_V + k] = v_before[k] + t * (b[_V + k] - v_before[k])
+                b[_V_MAGNITUDE] = np.sqrt(b[_V] * b[_V] + b[_V + 1] * b[_V + 1])
+                b[_COLLISION_X] = x_hit
+                b[_COLLISION_X + 1] = y_hit
+                collided = True
+                break
+    return collided
+
+@jit(nopython=True)
+def car_to_park_place_numba(b, params, pp): # distances to park place (pp: packed park place) of state block b (in place), returns True if car parked
+    b[_TPP_D_AHEAD] = pp[_PP_D_AHEAD]
+    b[_TPP_D_AHEAD + 1] = pp[_PP_D_AHEAD + 1]
+    arg_arccos = max(min(b[_D_AHEAD] * pp[_PP_D_AHEAD] + b[_D_AHEAD + 1] * pp[_PP_D_AHEAD + 1], 1.0), -1.0)
+    b[_ANGLE_DISTANCE] = np.arccos(arg_arccos)
+    dx = b[_X] - pp[_PP_X]
+    dy = b[_X + 1] - pp[_PP_X + 1]
+    b[_DISTANCE] = np.sqrt(dx * dx + dy * dy)
+    b[_GUTTER_DISTANCE] = np.abs(pp[_PP_D_RIGHT_0] + (pp[_PP_D_RIGHT] * b[_X] + pp[_PP_D_RIGHT + 1] * b[_X + 1]))
+    return b[_V_MAGNITUDE] == 0.0 and b[_DISTANCE] <= CONST_PARKED_MAX_RELATIVE_DISTANCE_DEVIATION * pp[_PP_WIDTH] and b[_ANGLE_DISTANCE] <= CONST_PARKED_MAX_ANGLE_DEVIATION
+
+@jit(nopython=True)
+def car_to_park_place_vectors_numba(b, params, pp): # all vectors (and their norms) to park place of state block b (in place), not needed for stepping (computed on demand)
+    l = params[_P_L]
+    w = params[_P_W]
+    for k in range(2):
+        ppf = pp[_PP_X + k] + pp[_PP_D_AHEAD + k] * 0.5 * l
+        ppb = pp[_PP_X + k] - pp[_PP_D_AHEAD + k] * 0.5 * l
+        b[_TPP_F + k] = ppf - b[_X_F + k]
+        b[_TPP_B + k] = ppb - b[_X_B + k]
+        b[_TPP + k] = 0.5 * (b[_TPP_F + k] + b[_TPP_B + k])
+        ppfr = pp[_PP_X + k] + pp[_PP_D_AHEAD + k] * 0.5 * l + pp[_PP_D_RIGHT + k] * 0.5 * w
+        ppfl = ppfr - pp[_PP_D_RIGHT + k] * w
+        ppbr = pp[_PP_X + k] - pp[_PP_D_AHEAD + k] * 0.5 * l + pp[_PP_D_RIGHT + k] * 0.5 * w
+        ppbl = ppbr - pp[_PP_D_RIGHT + k] * w
+        b[_TPP_FR + k] = ppfr - b[_X_FR + k]
+        b[_TPP_FL + k] = ppfl - b[_X_FL + k]
+        b[_TPP_BR + k] = ppbr - b[_X_BR + k]
+        b[_TPP_BL + k] = ppbl - b[_X_BL + k]
+        b[_TPP_FR2 + k] = ppfr - b[_X_F + k]
+        b[_TPP_FL2 + k] = ppfl - b[_X_F + k]
+        b[_TPP_BR2 + k] = ppbr - b[_X_B + k]
+        b[_TPP_BL2 + k] = ppbl - b[_X_B + k]
+    b[_TPP_F_NORM] = np.sqrt(b[_TPP_F] * b[_TPP_F] + b[_TPP_F + 1] * b[_TPP_F + 1])
+    b[_TPP_B_NORM] = np.sqrt(b[_TPP_B] * b[_TPP_B] + b[_TPP_B + 1] * b[_TPP_B + 1])
+    b[_TPP_NORM] = np.sqrt(b[_TPP] * b[_TPP] + b[_TPP + 1] * b[_TPP + 1])
+    b[_TPP_FR2_NORM] = np.sqrt(b[_TPP_FR2] * b[_TPP_FR2] + b[_TPP_FR2 + 1] * b[_TPP_FR2 + 1])
+    b[_TPP_FL2_NORM] = np.sqrt(b[_TPP_FL2] * b[_TPP_FL2] + b[_TPP_FL2 + 1] * b[_TPP_FL2 + 1])
+    b[_TPP_BR2_NORM] = np.sqrt(b[_TPP_BR2] * b[_TPP_BR2] + b[_TPP_BR2 + 1] * b[_TPP_BR2 + 1])
+    b[_TPP_BL2_NORM] = np.sqrt(b[_TPP_BL2] * b[_TPP_BL2] + b[_TPP_BL2 + 1] * b[_TPP_BL2 + 1])
+
+@jit(nopython=True)
+def car_reward_numba(b, collided, parked, dt_since_action):
+    if collided:
+        reward = REWARD_COLLIDED
+    elif parked:
+        reward = REWARD_PARKED 
+    else:
+        reward = -dt_since_action            
+        reward += -REWARD_PENALTY_COEF_DISTANCE * b[_DISTANCE]
+        reward += -REWARD_PENALTY_COEF_ANGLE * b[_ANGLE_DISTANCE] / np.pi      
+        reward += -REWARD_PENALTY_COEF_GUTTER_DISTANCE * b[_GUTTER_DISTANCE]
+    b[_REWARD] = reward
+
+@jit(nopython=True)
+def car_sensors_collisions_numba(b, collided, params, n_sensors, 
+                                 edges, ranges, aabbs, grid_origin, grid_cell_size, grid_nx, grid_ny, grid_starts, grid_cells_edges, grid_stamps, grid_stamp, grid_candidates): # sensors values and collision check of state block b (in place), returns collided flag
+    sensors_xs = b[_SENSORS : _SENSORS + 2 * n_sensors].reshape((n_sensors, 2))
+    values = b[_SENSORS + 2 * n_sensors : _SENSORS + 3 * n_sensors]
+    x = b[_X : _X + 2]
+    x_fl = b[_X_FL : _X_FL + 2]
+    x_fr = b[_X_FR : _X_FR + 2]
+    x_bl = b[_X_BL : _X_BL + 2]
+    x_br = b[_X_BR : _X_BR + 2]
+    if grid_nx > 0:
+        sensors_values_grid_numba(x, sensors_xs, edges, grid_origin, grid_cell_size, grid_nx, grid_ny, grid_starts, grid_cells_edges, grid_stamps, grid_stamp, CAR_MAX_SENSOR_VALUE, values)
+        ei, to = check_collisions_grid_numba(x, params[_P_BOUNDING_RADIUS], x_fl, x_fr, x_bl, x_br, edges, grid_origin, grid_cell_size, grid_nx, grid_ny, grid_starts, grid_cells_edges, grid_stamps, grid_stamp, grid_candidates)
+    else:
+        sensors_values_numba(x, sensors_xs, edges, CAR_MAX_SENSOR_VALUE, values)
+        ei, to = check_collisions_numba(x, params[_P_BOUNDING_RADIUS], x_fl, x_fr, x_bl, x_br, edges, ranges, aabbs)
+    if ei >= 0 and not collided: # point of first collision kept
+        collided = True
+        for k in range(2):
+            b[_COLLISION_X + k] = edges[ei, 0, k] + to * (edges[ei, 1, k] - edges[ei, 0, k])
+    return collided
+
+@jit(nopython=True)
+def car_step_numba(b, collided, parked, time_exceeded, dt, dt_since_action, time_remaining, params, n_sensors_front, n_sensors_back, n_sensors_sides, static_friction, swept, substep, pp, 
+                   edges, ranges, aabbs, grid_origin, grid_cell_size, grid_nx, grid_ny, grid_starts, grid_cells_edges, grid_stamps, grid_stamp, grid_candidates): # whole simulation step of state block b, returns updated flags: collided, parked, time exceeded
+    if swept or substep > 0.0:
+        collided = car_motion_numba(b, collided, dt, params, static_friction, swept, substep, edges, ranges, aabbs)
+    else:
+        car_physics_numba(b, dt, params, static_friction)
+    car_geometry_numba(b, params, n_sensors_front, n_sensors_back, n_sensors_sides)
+    collided = car_sensors_collisions_numba(b, collided, params, n_sensors_front + n_sensors_back + 2 * n_sensors_sides, 
+                                            edges, ranges, aabbs, grid_origin, grid_cell_size, grid_nx, grid_ny, grid_starts, grid_cells_edges, grid_stamps, grid_stamp, grid_candidates)
+    if collided:
+        b[_V] = 0.0 # stop due to collision
+        b[_V + 1] = 0.0
+        b[_V_MAGNITUDE] = 0.0
+    if time_remaining - dt <= 0.0:
+        time_exceeded = True
+    if car_to_park_place_numba(b, params, pp):
+        parked = True
+    car_reward_numba(b, collided, parked, dt_since_action)
+    return collided, parked, time_exceeded
+
+@jit(nopython=True)
+def history_append_numba(buffer, head, b): # appends position (and corners, if memorized) of state block b to trajectory history buffer (capacity, 5 or 1, 2), returns new head
+    for k in range(2):
+        buffer[head, 0, k] = b[_X + k]
+        if buffer.shape[1] > 1:
+            buffer[head, 1, k] = b[_X_FL + k]
+            buffer[head, 2, k] = b[_X_FR + k]
+            buffer[head, 3, k] = b[_X_BL + k]
+            buffer[head, 4, k] = b[_X_BR + k]
+    return (head + 1) % buffer.shape[0]
+
+@jit(nopython=True)
+def car_advance_numba(b, collided, parked, time_exceeded, ahead, side, n_frames, frame, dt, dt_since_action, time_limit, params, n_sensors_front, n_sensors_back, n_sensors_sides, swept, substep, pp, history_buffer, history_head, 
+                      edges, ranges, aabbs, grid_origin, grid_cell_size, grid_nx, grid_ny, grid_starts, grid_cells_edges, grid_stamps, grid_stamp, grid_candidates): # up to n_frames steps of state block b (ahead, side: signed accelerations magnitudes imposed from second frame on)
+    # returns: frames performed, sum of distances to park place after them, updated flags (collided, parked, time exceeded), new head of history
+    distances = 0.0
+    j = 0
+    while j < n_frames:
+        time_elapsed = (frame + j) * dt
+        if collided or parked or time_elapsed >= time_limit:
+            break
+        if j > 0: # first frame consumes accelerations imposed beforehand
+            if ahead != 0.0:
+                car_accelerate_numba(b, _D_AHEAD, 1.0 if ahead > 0.0 else -1.0, abs(ahead))
+            if side != 0.0 and b[_V_MAGNITUDE] >= params[_P_MIN_VELOCITY_TO_TURN]:
+                car_accelerate_numba(b, _D_RIGHT, 1.0 if side > 0.0 else -1.0, abs(side))
+        collided, parked, time_exceeded = car_step_numba(b, collided, parked, time_exceeded, dt, dt_since_action, time_limit - time_elapsed, params, n_sensors_front, n_sensors_back, n_sensors_sides, True, swept, substep, pp, 
+                                                         edges, ranges, aabbs, grid_origin, grid_cell_size, grid_nx, grid_ny, grid_starts, grid_cells_edges, grid_stamps, grid_stamp, grid_candidates)
+        distances += b[_DISTANCE]
+        history_head = history_append_numba(history_buffer, history_head, b)
+        j += 1
+    return j, distances, collided, parked, time_exceeded, history_head
+
+@jit(nopython=True)
+def car_batch_step_numba(bs, collided, parked, time_exceeded, dt, dt_since_action, time_remaining, params, n_sensors_front, n_sensors_back, n_sensors_sides, swept, substep, pps, 
+                         edges, n_edges, ranges, aabbs, n_obstacles): # car_step_numba for N state blocks (rows of bs) and flags (N,), per-car park places pps (N, 8) and obstacles edges (N, E, 2, 2), ranges (N, O, 2), aabbs (N, O, 4) of which first n_edges[i], n_obstacles[i] used for i-th car
+    grid_origin = np.zeros(2) # no grid (off for padded obstacles)
+    grid_starts = np.zeros(1, dtype=np.int64)
+    grid_empty = np.zeros(0, dtype=np.int64)
+    grid_stamp = np.zeros(1, dtype=np.int64)
+    for i in range(bs.shape[0]):
+        collided[i], parked[i], time_exceeded[i] = car_step_numba(bs[i], collided[i], parked[i], time_exceeded[i], dt, dt_since_action, time_remaining[i], params, n_sensors_front, n_sensors_back, n_sensors_sides, True, swept, substep, pps[i], 
+                                                                  edges[i, :n_edges[i]], ranges[i, :n_obstacles[i]], aabbs[i, :n_obstacles[i]], grid_origin, 1.0, 0, 0, grid_starts, grid_empty, grid_empty, grid_stamp, grid_empty)
+
+@jit(nopython=True)
+def car_batch_advance_numba(bs, collided, parked, time_exceeded, active, aheads, sides, n_frames, frames, dt, dt_since_action, time_limit, params, n_sensors_front, n_sensors_back, n_sensors_sides, swept, substep, pps, 
+                            history_buffers, history_heads, edges, n_edges, ranges, aabbs, n_obstacles, n_performed, distances): # car_advance_numba for active rows of bs (per-car signed accelerations, frames and history buffers), obstacles as in car_batch_step_numba
+    # written to: n_performed (N,), distances (N,), flags and history heads (N,)
+    grid_origin = np.zeros(2) # no grid (off for padded obstacles)
+    grid_starts = np.zeros(1, dtype=np.int64)
+    grid_empty = np.zeros(0, dtype=np.int64)
+    grid_stamp = np.zeros(1, dtype=np.int64)
+    for i in range(bs.shape[0]):
+        if not active[i]:
+            continue
+        n_performed[i], distances[i], collided[i], parked[i], time_exceeded[i], history_heads[i] = car_advance_numba(
+            bs[i], collided[i], parked[i], time_exceeded[i], aheads[i], sides[i], n_frames[i], frames[i], dt, dt_since_action, time_limit, params, n_sensors_front, n_sensors_back, n_sensors_sides, swept, substep, pps[i], 
+            history_buffers[i], history_heads[i], edges[i, :n_edges[i]], ranges[i, :n_obstacles[i]], aabbs[i, :n_obstacles[i]], grid_origin, 1.0, 0, 0, grid_starts, grid_empty, grid_empty, grid_stamp, grid_empty)
+
+@jit(nopython=True)
+def state_repr_vector_numba(x, y, c, s, out, j): # writes vector (x, y) rotated by angle of cosine c and sine s into out[j : j + 2]
+    out[j] = c * x - s * y
+    out[j + 1] = s * x + c * y
+
+def _make_state_repr_builders(avms, corners, n_extras, invariant, sensors): # compiled builders (single row, batch) of one state representation, computing only quantities it needs
+    # avms: angle ahead and signed velocity magnitude instead of d_ahead and v; corners: 0 - fb, 1 - flfrblbr, 2 - flfrblbr2s; n_extras: distance, angle distance, gutter distance (that many first ones)
+    @jit(nopython=True)
+    def build(b, params, pp, out): # state representation of state block b (pp: packed park place) written into row out
+        c, s = 1.0, 0.0
+        if invariant: # invariant w.r.t. park place rotation (assuming models trained on reference park place direction [-1.0, 0.0]) 
+            angle = -np.arctan2(-pp[_PP_D_AHEAD + 1], -pp[_PP_D_AHEAD])
+            c, s = np.cos(angle), np.sin(angle)
+        if avms:
+            out[0] = b[_ANGLE_AHEAD]
+            out[1] = np.sign(b[_D_AHEAD] * b[_V] + b[_D_AHEAD + 1] * b[_V + 1]) * b[_V_MAGNITUDE]
+            j = 2
+        else:
+            state_repr_vector_numba(b[_D_AHEAD], b[_D_AHEAD + 1], c, s, out, 0)
+            state_repr_vector_numba(b[_V], b[_V + 1], c, s, out, 2)
+            j = 4
+        l = params[_P_L]
+        w = params[_P_W]
+        ppf_x = pp[_PP_X] + pp[_PP_D_AHEAD] * 0.5 * l
+        ppf_y = pp[_PP_X + 1] + pp[_PP_D_AHEAD + 1] * 0.5 * l
+        ppb_x = pp[_PP_X] - pp[_PP_D_AHEAD] * 0.5 * l
+        ppb_y = pp[_PP_X + 1] - pp[_PP_D_AHEAD + 1] * 0.5 * l
+        if corners == 0:
+            state_repr_vector_numba(ppf_x - b[_X_F], ppf_y - b[_X_F + 1], c, s, out, j)
+            state_repr_vector_numba(ppb_x - b[_X_B], ppb_y - b[_X_B + 1], c, s, out, j + 2)
+            j += 4
+        else:
+            ppfr_x = ppf_x + pp[_PP_D_RIGHT] * 0.5 * w
+            ppfr_y = ppf_y + pp[_PP_D_RIGHT + 1] * 0.5 * w
+            ppfl_x = ppfr_x - pp[_PP_D_RIGHT] * w
+            ppfl_y = ppfr_y - pp[_PP_D_RIGHT + 1] * w
+            ppbr_x = ppb_x + pp[_PP_D_RIGHT] * 0.5 * w
+            ppbr_y = ppb_y + pp[_PP_D_RIGHT + 1] * 0.5 * w
+            ppbl_x = ppbr_x - pp[_PP_D_RIGHT] * w
+            ppbl_y = ppbr_y - pp[_PP_D_RIGHT + 1] * w
+            fl, fr, bl, br = (_X_FL, _X_FR, _X_BL, _X_BR) if corners == 1 else (_X_F, _X_F, _X_B, _X_B) # car points at which vectors start
+            state_repr_vector_numba(ppfl_x - b[fl], ppfl_y - b[fl + 1], c, s, out, j)
+            state_repr_vector_numba(ppfr_x - b[fr], ppfr_y - b[fr + 1], c, s, out, j + 2)
+            state_repr_vector_numba(ppbl_x - b[bl], ppbl_y - b[bl + 1], c, s, out, j + 4)
+            state_repr_vector_numba(ppbr_x - b[br], ppbr_y - b[br + 1], c, s, out, j + 6)
+            j += 8
+        for e in range(n_extras):
+            out[j + e] = b[_DISTANCE + e] # distance, angle distance, gutter distance laid out consecutively in state block
+        j += n_extras
+        if sensors:
+            n_sensors = (b.shape[0] - _SENSORS) // 3
+            for si in range(n_sensors):
+                out[j + si] = b[_SENSORS + 2 * n_sensors + si]
+        
+    @jit(nopython=True)
+    def build_batch(bs, params, pps, out): # rows of out for N state blocks (rows of bs) with per-car park places pps (N, 8)
+        for i in range(bs.shape[0]):
+            build(bs[i], params, pps[i], out[i])
+            
+    return build, build_batch
+
+class StateReprBuilder: # entry of state representations registry
+    def __init__(self, avms, corners, n_extras, invariant, sensors):
+        self.avms_ = avms
+        self.corners_ = corners
+        self.n_extras_ = n_extras
+        self.invariant_ = invariant
+        self.sensors_ = sensors
+        self.build_, self.build_batch_ = _make_state_repr_builders(avms, corners, n_extras, invariant, sensors) # compiled lazily (on first use)
+        
+    def size(self, n_sensors):
+        return (2 if self.avms_ else 4) + (4 if self.corners_ == 0 else 8) + self.n_extras_ + (n_sensors if self.sensors_ else 0)
+
+STATE_REPR_BUILDERS = {"avms_fb": StateReprBuilder(True, 0, 0, False, False)} # state representation function name -> its builder
+for corners, corners_name in enumerate(["fb", "flfrblbr", "flfrblbr2s"]):
+    for n_extras, extras_name in enumerate(["", "_d", "_da", "_dag"]):
+        STATE_REPR_BUILDERS["dv_" + corners_name + extras_name] = StateReprBuilder(False, corners, n_extras, False, False)
+for extras_name, n_extras in [("_da", 2), ("_dag", 3)]:
+    for sensors_name, sensors in [("", False), ("_sensors", True)]:
+        STATE_REPR_BUILDERS["dv_flfrblbr2s" + extras_name + "_invariant" + sensors_name] = StateReprBuilder(False, 2, n_extras, True, sensors)
+
+class TrajectoryHistory: # fixed-capacity ring buffer of car positions and (optionally) corners: (capacity, 5, 2) array, O(1) append and lookback
+    def __init__(self, capacity=HISTORY_CAPACITY, corners=True):
+        self.capacity_ = capacity
+        self.corners_ = corners
+        self.buffer_ = np.zeros((capacity, 5 if corners else 1, 2)) # kinds of points: position, front left, front right, back left, back right
+        self.head_ = 0 # row for next append
+        self.size_ = 0
+        
+    def append(self, x, x_fl, x_fr, x_bl, x_br):
+        row = self.buffer_[self.head_]
+        row[0] = x
+        if self.corners_:
+            row[1] = x_fl
+            row[2] = x_fr
+            row[3] = x_bl
+            row[4] = x_br
+        self.head_ = (self.head_ + 1) % self.capacity_
+        self.size_ = min(self.size_ + 1, self.capacity_)
+        
+    def get(self, i, kind=0): # i-th memorized point of given kind (negative i counting back from the most recent one)
+        if i < 0:
+            i += self.size_
+        if i < 0 or i >= self.size_ or kind >= self.buffer_.shape[1]:
+            raise IndexError("trajectory history index out of range")
+        return self.buffer_[(self.head_ - self.size_ + i) % self.capacity_, kind]
+    
+class TrajectoryHistoryView: # list-style (read-only) access to points of one kind in trajectory history
+    def __init__(self, history, kind):
+        self.history_ = history
+        self.kind_ = kind
+        
+    def __len__(self):
+        return self.history_.size_ if self.kind_ < self.history_.buffer_.shape[1] else 0
+    
+    def __getitem__(self, i):
+        return self.history_.get(i, self.kind_)
+
+def _state_vector(index): # property exposing 2D vector of car state block (view, assignment written in place)
+    def fset(self, value):
+        self.state_[index : index + 2] = value
+    return property(lambda self: self.state_[index : index + 2], fset)
+
+def _state_scalar(index): # property exposing scalar of car state block
+    def fset(self, value):
+        self.state_[index] = value
+    return property(lambda self: self.state_[index], fset)
+
+def _to_park_place_property(index, size): # property exposing vector (size 2) or norm (size 1) to park place, computed on demand
+    def fget(self):
+        if self.park_place_pack_ is not None:
+            car_to_park_place_vectors_numba(self.state_, self.params_, self.park_place_pack_)
+        return self.state_[index : index + 2] if size == 2 else self.state_[index]
+    def fset(self, value):
+        self.state_[index : index + size] = value
+    return property(fget, fset)
+
+def _params_scalar(index): # property exposing car parameter
+    def fset(self, value):
+        self.params_[index] = value
+    return property(lambda self: self.params_[index], fset)
+
+class Car: # whole state in single preallocated block (state_), vectors exposed as views into it, updated in place by compiled kernels
+    
+    __slots__ = ("state_", "params_", "n_sensors_front_", "n_sensors_back_", "n_sensors_sides_", "n_sensors_", 
+                 "antistuck_check_radius_", "antistuck_check_seconds_back_", "state_repr_function_name", 
+                 "swept_collisions_", "physics_substep_", "collided_", "parked_", "time_exceeded_", "history_", "obstacles_", "obstacles_pack_", "park_place_", "park_place_pack_")
+
+    x_ = _state_vector(_X) # position
+    v_ = _state_vector(_V) # velocity
+    a_ = _state_vector(_A) # acceleration
+    d_ahead_ = _state_vector(_D_AHEAD) # unit direction vector (looking ahead)
+    d_right_ = _state_vector(_D_RIGHT) # unit direction vector (looking right)
+    x_fl_ = _state_vector(_X_FL)
+    x_fr_ = _state_vector(_X_FR)
+    x_f_ = _state_vector(_X_F)
+    x_bl_ = _state_vector(_X_BL)
+    x_br_ = _state_vector(_X_BR)
+    x_b_ = _state_vector(_X_B)
+    x_r_ = _state_vector(_X_R)
+    x_l_ = _state_vector(_X_L)
+    to_park_place_f_ = _to_park_place_property(_TPP_F, 2) # vector: car front to target park place front
+    to_park_place_b_ = _to_park_place_property(_TPP_B, 2) # vector: car back to target park place back
+    to_park_place_ = _to_park_place_property(_TPP, 2)
+    to_park_place_fl_ = _to_park_place_property(_TPP_FL, 2) # vector: car front left to target park place front left
+    to_park_place_fr_ = _to_park_place_property(_TPP_FR, 2) # vector: car front right to target park place front right
+    to_park_place_bl_ = _to_park_place_property(_TPP_BL, 2) # vector: car back left to target park place back left
+    to_park_place_br_ = _to_park_place_property(_TPP_BR, 2) # vector: car back right to target park place back right
+    to_park_place_fl2_ = _to_park_place_property(_TPP_FL2, 2) # vector: car front to target park place front left
+    to_park_place_fr2_ = _to_park_place_property(_TPP_FR2, 2) # vector: car front to target park place front right
+    to_park_place_bl2_ = _to_park_place_property(_TPP_BL2, 2) # vector: car back to target park place back left
+    to_park_place_br2_ = _to_park_place_property(_TPP_BR2, 2) # vector: car back to target park place back right
+    to_park_place_d_ahead_ = _state_vector(_TPP_D_AHEAD)
+    v_magnitude_ = _state_scalar(_V_MAGNITUDE)
+    a_magnitude_ = _state_scalar(_A_MAGNITUDE)
+    angle_ahead_ = _state_scalar(_ANGLE_AHEAD)
+    distance_ = _state_scalar(_DISTANCE) # distance between car position (central) and park place position (central)
+    angle_distance_ = _state_scalar(_ANGLE_DISTANCE) # angle between car ahead vector and park place ahead vector: [0, pi]
+    gutter_distance_ = _state_scalar(_GUTTER_DISTANCE)
+    reward_ = _state_scalar(_REWARD)
+    to_park_place_f_norm_ = _to_park_place_property(_TPP_F_NORM, 1)
+    to_park_place_b_norm_ = _to_park_place_property(_TPP_B_NORM, 1)
+    to_park_place_norm_ = _to_park_place_property(_TPP_NORM, 1)
+    to_park_place_fl2_norm_ = _to_park_place_property(_TPP_FL2_NORM, 1)
+    to_park_place_fr2_norm_ = _to_park_place_property(_TPP_FR2_NORM, 1)
+    to_park_place_bl2_norm_ = _to_park_place_property(_TPP_BL2_NORM, 1)
+    to_park_place_br2_norm_ = _to_park_place_property(_TPP_BR2_NORM, 1)
+    l_ = _params_scalar(_P_L)
+    w_ = _params_scalar(_P_W)
+    mu_static_ = _params_scalar(_P_MU_STATIC)
+    mu_kinetic_ = _params_scalar(_P_MU_KINETIC)
+    max_velocity_ = _params_scalar(_P_MAX_VELOCITY)
+    min_velocity_to_turn_ = _params_scalar(_P_MIN_VELOCITY_TO_TURN)
+    bounding_radius_ = _params_scalar(_P_BOUNDING_RADIUS) # radius of circle (centered at x) containing car rectangle, for broadphase of collisions
 
     def __init__(self, x=np.array([0.0, 0.0]), angle=0.0,
                  l=CAR_LENGTH, w=CAR_WIDTH, mu_static=CAR_MU_STATIC, mu_kinetic=CAR_MU_KINETIC, 
                  max_velocity=CAR_MAX_VELOCITY, min_velocity_to_turn=CAR_MIN_VELOCITY_TO_TURN, 
                  n_sensors_front=CAR_N_SENSORS_FRONT, n_sensors_back=CAR_N_SENSORS_BACK, n_sensors_sides=CAR_N_SENSORS_SIDES,
                  antistuck_check_radius=CAR_ANTISTUCK_CHECK_RADIUS, antistuck_check_seconds_back=CAR_ANTISTUCK_CHECK_SECONDS_BACK,
-                 state_repr_function_name=CAR_STATE_REPR_FUNCTION_NAME):
-        self.x_ = x # position        
-        self.d_ahead_ = np.array([0.0, 1.0]) # unit direction vector (looking ahead)
-        self.d_right_ = np.array([1.0, 0.0]) # unit direction vector (looking right)
+                 state_repr_function_name=CAR_STATE_REPR_FUNCTION_NAME, history_capacity=HISTORY_CAPACITY, history_corners=True,
+                 swept_collisions=SIMULATION_SWEPT_COLLISIONS, physics_substep=SIMULATION_PHYSICS_SUBSTEP):
+        self.n_sensors_front_ = n_sensors_front # at least 2
+        self.n_sensors_back_ = n_sensors_back # at least 2
+        self.n_sensors_sides_ = n_sensors_sides # at least 1
+        self.n_sensors_ = n_sensors_front + n_sensors_back + 2 * n_sensors_sides
+        self.state_ = np.zeros(_SENSORS + 3 * self.n_sensors_)
+        self.state_[_COLLISION_X : _COLLISION_X + 2] = np.nan
+        self.params_ = np.array([l, w, mu_static, mu_kinetic, max_velocity, min_velocity_to_turn, 0.5 * np.sqrt(l**2 + w**2) + 1e-6], dtype=np.float64)
+        self.x_ = x
+        d_ahead = np.array([0.0, 1.0])
+        d_right = np.array([1.0, 0.0])
         if angle != 0.0:
             rotation_matrix = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
-            self.d_ahead_ = rotation_matrix.dot(self.d_ahead_)
-            self.d_right_ = rotation_matrix.dot(self.d_right_)
-        self.angle_ahead_ = np.arctan2(self.d_ahead_[1], self.d_ahead_[0])
+            d_ahead = rotation_matrix.dot(d_ahead)
+            d_right = rotation_matrix.dot(d_right)
+        self.d_ahead_ = d_ahead
+        self.d_right_ = d_right
+        self.angle_ahead_ = np.arctan2(d_ahead[1], d_ahead[0])
         if self.angle_ahead_ < 0.0:
             self.angle_ahead_ += 2 * np.pi
-        self.l_ = l
-        self.w_ = w
-        self.mu_static_ = mu_static
-        self.mu_kinetic_ = mu_kinetic
-        self.max_velocity_ = max_velocity
-        self.min_velocity_to_turn_ = min_velocity_to_turn
-        self.x_fl_ = None
-        self.x_fr_ = None
-        self.x_f_ = None
-        self.x_bl_ = None
-        self.x_br_ = None
-        self.x_b_ = None
-        self._refresh_corners()
-        self.v_ = np.array([0.0, 0.0]) # velocity
-        self.v_magnitude_ = 0.0
-        self.a_ = np.array([0.0, 0.0]) # acceleration
-        self.a_magnitude_ = 0.0
-        self.accelerations_imposed_ = []
-        self.n_sensors_front_ = n_sensors_front # at least 2
-        self.n_sensors_back_ = n_sensors_back # at least 2
-        self.n_sensors_sides_ = n_sensors_sides # at least 1
+        self._refresh_geometry()
         self.antistuck_check_radius_ = antistuck_check_radius
         self.antistuck_check_seconds_back_ = antistuck_check_seconds_back
         self.state_repr_function_name = state_repr_function_name
-        self.state_repr_function = getattr(self, "_state_repr_" + self.state_repr_function_name)        
-        self.sensors_front_xs_ = None
-        self.sensors_back_xs_ = None
-        self.sensors_left_xs_ = None
-        self.sensors_right_xs_ = None   
-        self._refresh_sensors_xs()
-        self.sensors_front_values_ = None
-        self.sensors_back_values_ = None
-        self.sensors_left_values_ = None
-        self.sensors_right_values_ = None
+        self.swept_collisions_ = swept_collisions
+        self.physics_substep_ = physics_substep
         self.collided_ = False     
-        self.collision_x_ = None
-        self.to_park_place_f_ = None # vector: car front to target park place front       
-        self.to_park_place_b_ = None # vector: car back to target park place back
-        self.to_park_place_fl_ = None # vector: car front left to target park place front left        
-        self.to_park_place_fr_ = None # vector: car front right to target park place front right       
-        self.to_park_place_b_ = None # vector: car back to target park place back
-        self.to_park_place_bl_ = None # vector: car back left to target park place back left          
-        self.to_park_place_br_ = None # vector: car back right to target park place back right
-        self.to_park_place_fl2_ = None # vector: car front to target park place front left                          
-        self.to_park_place_fr2_ = None # vector: car front to target park place front right
-        self.to_park_place_bl2_ = None # vector: car back to target park place back left           
-        self.to_park_place_br2_ = None # vector: car back to target park place back right
-        self.distance_ = None # distance between car position (central) and park place position (central)
-        self.angle_distance_ = None # angle between car ahead vector and park place ahead vector: [0, pi]       
-        self.gutter_distance_ = None
         self.parked_ = False
         self.time_exceeded_ = False
-        self.reward_ = None
-        self.x_history_ = [] 
-        self.x_fl_history_ = []
-        self.x_fr_history_ = []
-        self.x_bl_history_ = []         
-        self.x_br_history_ = []
-        self.x_history_.append(np.copy(self.x_))
-        self.x_fl_history_.append(np.copy(self.x_fl_))
-        self.x_fr_history_.append(np.copy(self.x_fr_))
-        self.x_bl_history_.append(np.copy(self.x_bl_))        
-        self.x_br_history_.append(np.copy(self.x_br_))        
-        self.to_park_place_d_ahead_ = None        
-        
-    def _refresh_corners(self):
-        self.x_fl_ = self.x_ + self.d_ahead_ * 0.5 * self.l_ -  self.d_right_ * 0.5 * self.w_
-        self.x_fr_ = self.x_fl_ + self.d_right_ * self.w_
-        self.x_f_ = 0.5 * (self.x_fl_ + self.x_fr_)
-        self.x_bl_ = self.x_fl_ - self.d_ahead_ * self.l_
-        self.x_br_ = self.x_bl_ + self.d_right_ * self.w_
-        self.x_b_ = 0.5 * (self.x_bl_ + self.x_br_)
-        self.x_r_ = 0.5 * (self.x_fr_ + self.x_br_)
-        self.x_l_ = 0.5 * (self.x_fl_ + self.x_bl_)        
+        self.history_ = None
+        self.reset_history(history_capacity, history_corners)
+        self.obstacles_ = None # obstacles (list) for which pack below is cached
+        self.obstacles_pack_ = None
+        self.park_place_ = None # park place for which pack below is cached
+        self.park_place_pack_ = None
         
-    def _refresh_sensors_xs(self):
-        gap = self.w_ / (self.n_sensors_front_ - 1)   
-        self.sensors_front_xs_ = [self.x_fl_ + i * gap * self.d_right_ for i in range(self.n_sensors_front_)]
-        gap = self.w_ / (self.n_sensors_back_ - 1)   
-        self.sensors_back_xs_ = [self.x_bl_ + i * gap * self.d_right_ for i in range(self.n_sensors_back_)]
-        gap = self.l_ / (self.n_sensors_sides_ + 1)   
-        self.sensors_left_xs_ = [self.x_bl_ + (i + 1) * gap * self.d_ahead_ for i in range(self.n_sensors_sides_)]
-        self.sensors_right_xs_ = [self.x_br_ + (i + 1) * gap * self.d_ahead_ for i in range(self.n_sensors_sides_)]
-        
-    def _refresh_sensors_values(self, obstacles):
-        self.sensors_front_values_ = np.ones(self.n_sensors_front_) * CAR_MAX_SENSOR_VALUE
-        self.sensors_back_values_ = np.ones(self.n_sensors_back_) * CAR_MAX_SENSOR_VALUE
-        self.sensors_left_values_ = np.ones(self.n_sensors_sides_) * CAR_MAX_SENSOR_VALUE
-        self.sensors_right_values_ = np.ones(self.n_sensors_sides_) * CAR_MAX_SENSOR_VALUE
-        sensors_info = [(self.sensors_front_xs_, self.sensors_front_values_), 
-                        (self.sensors_back_xs_, self.sensors_back_values_),
-                        (self.sensors_left_xs_, self.sensors_left_values_),
-                        (self.sensors_right_xs_, self.sensors_right_values_)]
-        for sensor_xs, sensor_values in sensors_info: 
-            for si, sx in enumerate(sensor_xs): 
-                for obstacle in obstacles:
-                    for oxi in range(len(obstacle.xs_)):
-                        ox1 = obstacle.xs_[oxi]
-                        ox2 = obstacle.xs_[(oxi + 1) % len(obstacle.xs_)]
-                        ts, to = solve_lines_intersection(self.x_, sx, ox1, ox2)
-                        if ts >= 0.0 and to >= 0.0 and to <= 1.0:
-                            value = np.linalg.norm(ox1 + to * (ox2 - ox1) - sx)
-                            if ts <= 1.0:
-                                value = -value # how deep collision
-                            if value < sensor_values[si]:
-                                sensor_values[si] = value
-                                                                
-    def _refresh_to_park_place_vectors(self, park_place):              
-        ppf = park_place.x_ + park_place.d_ahead_ * 0.5 * self.l_
-        ppb = park_place.x_ - park_place.d_ahead_ * 0.5 * self.l_                
-        self.to_park_place_f_ = ppf - self.x_f_
-        self.to_park_place_b_ = ppb - self.x_b_
-        self.to_park_place_ = 0.5 * (self.to_park_place_f_ + self.to_park_place_b_)        
-        self.to_park_place_f_norm_ = np.linalg.norm(self.to_park_place_f_)
-        self.to_park_place_b_norm_ = np.linalg.norm(self.to_park_place_b_)
-        self.to_park_place_norm_ = np.linalg.norm(self.to_park_place_)
-        ppfr = park_place.x_ + park_place.d_ahead_ * 0.5 * self.l_ + park_place.d_right_ * 0.5 * self.w_
-        ppfl = ppfr - park_place.d_right_ * self.w_
-        ppbr = park_place.x_ - park_place.d_ahead_ * 0.5 * self.l_ + park_place.d_right_ * 0.5 * self.w_
-        ppbl = ppbr - park_place.d_right_ * self.w_        
-        self.to_park_place_fr_ = ppfr - self.x_fr_
-        self.to_park_place_fl_ = ppfl - self.x_fl_
-        self.to_park_place_br_ = ppbr - self.x_br_
-        self.to_park_place_bl_ = ppbl - self.x_bl_
-        self.to_park_place_fr2_ = ppfr - self.x_f_
-        self.to_park_place_fl2_ = ppfl - self.x_f_
-        self.to_park_place_br2_ = ppbr - self.x_b_
-        self.to_park_place_bl2_ = ppbl - self.x_b_
-        self.to_park_place_fr2_norm_ = np.linalg.norm(self.to_park_place_fr2_)
-        self.to_park_place_fl2_norm_ = np.linalg.norm(self.to_park_place_fl2_)
-        self.to_park_place_br2_norm_ = np.linalg.norm(self.to_park_place_br2_)
-        self.to_park_place_bl2_norm_ = np.linalg.norm(self.to_park_place_bl2_)
-        self.to_park_place_d_ahead_ = park_place.d_ahead_
-        arg_arccos = max(min(self.d_ahead_.dot(park_place.d_ahead_), 1.0), -1.0)
-        self.angle_distance_ = np.arccos(arg_arccos)
-        self.distance_ = np.linalg.norm(self.x_ - park_place.x_)
-        self.gutter_distance_ = np.abs(park_place.d_right_0_ + park_place.d_right_.dot(self.x_))
-        if self.v_magnitude_ == 0.0:
-            if self.distance_ <= CONST_PARKED_MAX_RELATIVE_DISTANCE_DEVIATION * park_place.width_ and self.angle_distance_ <= CONST_PARKED_MAX_ANGLE_DEVIATION:
-                self.parked_ = True
-                
-    def _check_collisions(self, obstacles):
-        car_segments = [(self.x_fl_, self.x_fr_), (self.x_bl_, self.x_br_), (self.x_bl_, self.x_fl_), (self.x_br_, self.x_fr_)]
-        for cs1, cs2 in car_segments:  
-            for obstacle in obstacles:
-                for oxi in range(len(obstacle.xs_)):
-                    ox1 = obstacle.xs_[oxi]
-                    ox2 = obstacle.xs_[(oxi + 1) % len(obstacle.xs_)]
-                    tcs, to = solve_lines_intersection(cs1, cs2, ox1, ox2)
-                    if tcs >= 0.0 and tcs <= 1.0 and to >= 0.0 and to <= 1.0:
-                        self.collided_ = True
-                        self.collision_x_= ox1 + to * (ox2 - ox1)
-                        return                
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in self.__slots__}
     
-    def _refresh_reward(self, dt_since_action):                                            
-        if self.collided_:
-            self.reward_ = REWARD_COLLIDED
-        elif self.parked_:
-            self.reward_ = REWARD_PARKED 
+    def __setstate__(self, state):
+        if "state_" not in state:
+            state = Car._from_legacy_state(state).__getstate__()
+        self.swept_collisions_ = SIMULATION_SWEPT_COLLISIONS # for cars pickled before simulation modes
+        self.physics_substep_ = SIMULATION_PHYSICS_SUBSTEP
+        for name, value in state.items():
+            setattr(self, name, value)
+            
+    @staticmethod
+    def _from_legacy_state(state): # car pickled before the state block was introduced (plain instance dictionary)
+        car = Car(x=state["x_"], l=state["l_"], w=state["w_"], mu_static=state["mu_static_"], mu_kinetic=state["mu_kinetic_"], 
+                  max_velocity=state["max_velocity_"], min_velocity_to_turn=state["min_velocity_to_turn_"], 
+                  n_sensors_front=state["n_sensors_front_"], n_sensors_back=state["n_sensors_back_"], n_sensors_sides=state["n_sensors_sides_"],
+                  antistuck_check_radius=state["antistuck_check_radius_"], antistuck_check_seconds_back=state["antistuck_check_seconds_back_"], 
+                  state_repr_function_name=state["state_repr_function_name"])
+        names = ["v_", "a_", "d_ahead_", "d_right_", "v_magnitude_", "a_magnitude_", "angle_ahead_", "collided_", "parked_", "time_exceeded_", 
+                 "collision_x_", "distance_", "angle_distance_", "gutter_distance_", "reward_"] + [name for name in state if name.startswith("to_park_place_") and hasattr(Car, name)]
+        for name in names:
+            if state.get(name) is not None:
+                setattr(car, name, state[name])
+        car._refresh_geometry()
+        if state.get("sensors_front_values_") is not None:
+            car.sensors_values_[:] = np.concatenate((state["sensors_front_values_"], state["sensors_back_values_"], state["sensors_left_values_"], state["sensors_right_values_"]))
+        if state.get("history_") is not None:
+            car.history_ = state["history_"]
         else:
-            self.reward_ = -dt_since_action            
-            self.reward_ += -REWARD_PENALTY_COEF_DISTANCE * self.distance_
-            self.reward_ += -REWARD_PENALTY_COEF_ANGLE * self.angle_distance_ / np.pi      
-            self.reward_ += -REWARD_PENALTY_COEF_GUTTER_DISTANCE * self.gutter_distance_                
-
-    def _state_repr_avms_fb(self):
-        v_magnitude_signed = np.sign(self.d_ahead_.dot(self.v_)) * self.v_magnitude_
-        return np.concatenate((np.array([self.angle_ahead_, v_magnitude_signed]), self.to_park_place_f_, self.to_park_place_b_))
+            car.reset_history()
+        return car
+        
+    @property
+    def collision_x_(self): # None until collision
+        return self.state_[_COLLISION_X : _COLLISION_X + 2] if self.collided_ else None
+    
+    @collision_x_.setter
+    def collision_x_(self, value):
+        self.state_[_COLLISION_X : _COLLISION_X + 2] = np.nan if value is None else value
+    
+    @property
+    def sensors_xs_(self): # (n_sensors, 2), order of sensors: front, back, left, right
+        return self.state_[_SENSORS : _SENSORS + 2 * self.n_sensors_].reshape(self.n_sensors_, 2)
+    
+    @property
+    def sensors_values_(self):
+        return self.state_[_SENSORS + 2 * self.n_sensors_ : _SENSORS + 3 * self.n_sensors_]
+    
+    @property
+    def sensors_front_xs_(self):
+        return self.sensors_xs_[:self.n_sensors_front_]
 
-    def _state_repr_dv_fb(self):
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_f_, self.to_park_place_b_))
+    @property
+    def sensors_back_xs_(self):
+        return self.sensors_xs_[self.n_sensors_front_ : self.n_sensors_front_ + self.n_sensors_back_]
 
-    def _state_repr_dv_fb_d(self):
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_f_, self.to_park_place_b_, np.array([self.distance_])))
+    @property
+    def sensors_left_xs_(self):
+        return self.sensors_xs_[self.n_sensors_front_ + self.n_sensors_back_ : self.n_sensors_ - self.n_sensors_sides_]
 
-    def _state_repr_dv_fb_da(self):
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_f_, self.to_park_place_b_, np.array([self.distance_, self.angle_distance_])))
+    @property
+    def sensors_right_xs_(self):
+        return self.sensors_xs_[self.n_sensors_ - self.n_sensors_sides_:]
 
-    def _state_repr_dv_fb_dag(self):
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_f_, self.to_park_place_b_, np.array([self.distance_, self.angle_distance_, self.gutter_distance_])))
+    @property
+    def sensors_front_values_(self):
+        return self.sensors_values_[:self.n_sensors_front_]
 
-    def _state_repr_dv_flfrblbr(self):
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_fl_, self.to_park_place_fr_, self.to_park_place_bl_, self.to_park_place_br_))
+    @property
+    def sensors_back_values_(self):
+        return self.sensors_values_[self.n_sensors_front_ : self.n_sensors_front_ + self.n_sensors_back_]
 
-    def _state_repr_dv_flfrblbr_d(self):
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_fl_, self.to_park_place_fr_, self.to_park_place_bl_, self.to_park_place_br_, np.array([self.distance_])))
+    @property
+    def sensors_left_values_(self):
+        return self.sensors_values_[self.n_sensors_front_ + self.n_sensors_back_ : self.n_sensors_ - self.n_sensors_sides_]
 
-    def _state_repr_dv_flfrblbr_da(self):
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_fl_, self.to_park_place_fr_, self.to_park_place_bl_, self.to_park_place_br_, np.array([self.distance_, self.angle_distance_])))
+    @property
+    def sensors_right_values_(self):
+        return self.sensors_values_[self.n_sensors_ - self.n_sensors_sides_:]
     
-    def _state_repr_dv_flfrblbr_dag(self):
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_fl_, self.to_park_place_fr_, self.to_park_place_bl_, self.to_park_place_br_, np.array([self.distance_, self.angle_distance_, self.gutter_distance_])))
+    @property
+    def state_repr_function(self):
+        return self.get_state
+        
+    def reset_history(self, capacity=None, corners=None): # memorized trajectory restarted from current position (corners=False: positions only, e.g. when not animating)
+        capacity = self.history_.capacity_ if capacity is None else capacity
+        corners = self.history_.corners_ if corners is None else corners
+        self.history_ = TrajectoryHistory(capacity, corners)
+        self.history_.append(self.x_, self.x_fl_, self.x_fr_, self.x_bl_, self.x_br_)
+        
+    @property
+    def x_history_(self):
+        return TrajectoryHistoryView(self.history_, 0)
 
-    def _state_repr_dv_flfrblbr2s(self):        
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_fl2_, self.to_park_place_fr2_, self.to_park_place_bl2_, self.to_park_place_br2_))
-    
-    def _state_repr_dv_flfrblbr2s_d(self):        
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_fl2_, self.to_park_place_fr2_, self.to_park_place_bl2_, self.to_park_place_br2_, np.array([self.distance_])))
+    @property
+    def x_fl_history_(self):
+        return TrajectoryHistoryView(self.history_, 1)
 
-    def _state_repr_dv_flfrblbr2s_da(self):        
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_fl2_, self.to_park_place_fr2_, self.to_park_place_bl2_, self.to_park_place_br2_, np.array([self.distance_, self.angle_distance_])))
+    @property
+    def x_fr_history_(self):
+        return TrajectoryHistoryView(self.history_, 2)
 
-    def _state_repr_dv_flfrblbr2s_dag(self):        
-        return np.concatenate((self.d_ahead_, self.v_, self.to_park_place_fl2_, self.to_park_place_fr2_, self.to_park_place_bl2_, self.to_park_place_br2_, np.array([self.distance_, self.angle_distance_, self.gutter_distance_])))
+    @property
+    def x_bl_history_(self):
+        return TrajectoryHistoryView(self.history_, 3)
+
+    @property
+    def x_br_history_(self):
+        return TrajectoryHistoryView(self.history_, 4)
+        
+    def _obstacles_pack(self, obstacles):
+        if obstacles is not self.obstacles_:
+            self.obstacles_ = obstacles
+            self.obstacles_pack_ = ObstaclesPack(obstacles)
+        return self.obstacles_pack_
     
-    def _state_repr_dv_flfrblbr2s_da_invariant(self): # invariant w.r.t. park place rotation (assuming models trained on reference park place direction [-1.0, 0.0]) 
-        d_main = -self.to_park_place_d_ahead_ # minus due to models trained on fixed park place with reference d_ahead = [-1.0, 0.0] (should correspond to angle 0.0, hence the minus to convert it to [1.0, 0.0] before arctan2) 
-        angle = -np.arctan2(d_main[1], d_main[0])
-        rotation_matrix = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
-        d_ahead_invariant = rotation_matrix.dot(self.d_ahead_)
-        v_invariant = rotation_matrix.dot(self.v_)
-        tpp_fl2_invariant = rotation_matrix.dot(self.to_park_place_fl2_)
-        tpp_fr2_invariant = rotation_matrix.dot(self.to_park_place_fr2_)
-        tpp_bl2_invariant = rotation_matrix.dot(self.to_park_place_bl2_)
-        tpp_br2_invariant = rotation_matrix.dot(self.to_park_place_br2_)
-        return np.concatenate((d_ahead_invariant, v_invariant, tpp_fl2_invariant, tpp_fr2_invariant, tpp_bl2_invariant, tpp_br2_invariant, np.array([self.distance_, self.angle_distance_])))
-
-    def _state_repr_dv_flfrblbr2s_da_invariant_sensors(self): # invariant w.r.t. park place rotation (assuming models trained on reference park place direction [-1.0, 0.0]) 
-        d_main = -self.to_park_place_d_ahead_ # minus due to models trained on fixed park place with reference d_ahead = [-1.0, 0.0] (should correspond to angle 0.0, hence the minus to convert it to [1.0, 0.0] before arctan2) 
-        angle = -np.arctan2(d_main[1], d_main[0])
-        rotation_matrix = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
-        d_ahead_invariant = rotation_matrix.dot(self.d_ahead_)
-        v_invariant = rotation_matrix.dot(self.v_)
-        tpp_fl2_invariant = rotation_matrix.dot(self.to_park_place_fl2_)
-        tpp_fr2_invariant = rotation_matrix.dot(self.to_park_place_fr2_)
-        tpp_bl2_invariant = rotation_matrix.dot(self.to_park_place_bl2_)
-        tpp_br2_invariant = rotation_matrix.dot(self.to_park_place_br2_)
-        return np.concatenate((d_ahead_invariant, v_invariant, tpp_fl2_invariant, tpp_fr2_invariant, tpp_bl2_invariant, tpp_br2_invariant, np.array([self.distance_, self.angle_distance_]), 
-                               self.sensors_front_values_, self.sensors_back_values_, self.sensors_left_values_, self.sensors_right_values_))
+    def _park_place_pack(self, park_place): # park place packed into (8,) array (see PARK PLACE ARRAY LAYOUT)
+        if park_place is not self.park_place_:
+            self.park_place_ = park_place
+            self.park_place_pack_ = np.concatenate((park_place.x_, park_place.d_ahead_, park_place.d_right_, [park_place.d_right_0_, park_place.width_])).astype(np.float64)
+        return self.park_place_pack_
+
+    def _refresh_geometry(self): # corners and sensors points
+        car_geometry_numba(self.state_, self.params_, self.n_sensors_front_, self.n_sensors_back_, self.n_sensors_sides_)
         
-    def _state_repr_dv_flfrblbr2s_dag_invariant(self): # invariant w.r.t. park place rotation (assuming models trained on reference park place direction [-1.0, 0.0]) 
-        d_main = -self.to_park_place_d_ahead_ # minus due to models trained on fixed park place with reference d_ahead = [-1.0, 0.0] (should correspond to angle 0.0, hence the minus to convert it to [1.0, 0.0] before arctan2) 
-        angle = -np.arctan2(d_main[1], d_main[0])
-        rotation_matrix = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
-        d_ahead_invariant = rotation_matrix.dot(self.d_ahead_)
-        v_invariant = rotation_matrix.dot(self.v_)
-        tpp_fl2_invariant = rotation_matrix.dot(self.to_park_place_fl2_)
-        tpp_fr2_invariant = rotation_matrix.dot(self.to_park_place_fr2_)
-        tpp_bl2_invariant = rotation_matrix.dot(self.to_park_place_bl2_)
-        tpp_br2_invariant = rotation_matrix.dot(self.to_park_place_br2_)
-        return np.concatenate((d_ahead_invariant, v_invariant, tpp_fl2_invariant, tpp_fr2_invariant, tpp_bl2_invariant, tpp_br2_invariant, np.array([self.distance_, self.angle_distance_, self.gutter_distance_])))                   
-       
-    def _state_repr_dv_flfrblbr2s_dag_invariant_sensors(self): # invariant w.r.t. park place rotation (assuming models trained on reference park place direction [-1.0, 0.0]) 
-        d_main = -self.to_park_place_d_ahead_ # minus due to models trained on fixed park place with reference d_ahead = [-1.0, 0.0] (should correspond to angle 0.0, hence the minus to convert it to [1.0, 0.0] before arctan2) 
-        angle = -np.arctan2(d_main[1], d_main[0])
-        rotation_matrix = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
-        d_ahead_invariant = rotation_matrix.dot(self.d_ahead_)
-        v_invariant = rotation_matrix.dot(self.v_)
-        tpp_fl2_invariant = rotation_matrix.dot(self.to_park_place_fl2_)
-        tpp_fr2_invariant = rotation_matrix.dot(self.to_park_place_fr2_)
-        tpp_bl2_invariant = rotation_matrix.dot(self.to_park_place_bl2_)
-        tpp_br2_invariant = rotation_matrix.dot(self.to_park_place_br2_)
-        return np.concatenate((d_ahead_invariant, v_invariant, tpp_fl2_invariant, tpp_fr2_invariant, tpp_bl2_invariant, tpp_br2_invariant, np.array([self.distance_, self.angle_distance_, self.gutter_distance_]), 
-                               self.sensors_front_values_, self.sensors_back_values_, self.sensors_left_values_, self.sensors_right_values_))       
-       
-    def get_state(self):
-        return self.state_repr_function()
+    def _refresh_sensors_values(self, obstacles):
+        self._obstacles_pack(obstacles).sensors_values(self.x_, self.sensors_xs_, CAR_MAX_SENSOR_VALUE, self.sensors_values_)
+                                                                
+    def _refresh_to_park_place_vectors(self, park_place):              
+        if car_to_park_place_numba(self.state_, self.params_, self._park_place_pack(park_place)):
+            self.parked_ = True
+                
+    def _check_collisions(self, obstacles):
+        pack = self._obstacles_pack(obstacles)
+        ei, to = pack.check_collisions(self.x_, self.bounding_radius_, self.x_fl_, self.x_fr_, self.x_bl_, self.x_br_)
+        if ei >= 0:
+            ox1 = pack.edges_[ei, 0]
+            ox2 = pack.edges_[ei, 1]
+            self.collided_ = True
+            self.collision_x_= ox1 + to * (ox2 - ox1)
+    
+    def _refresh_reward(self, dt_since_action):                                            
+        car_reward_numba(self.state_, self.collided_, self.parked_, dt_since_action)
+
+    def get_state(self, out=None): # state representation (see STATE_REPR_BUILDERS) written into out (e.g. row of preallocated matrix) or new array
+        builder = STATE_REPR_BUILDERS[self.state_repr_function_name]
+        if out is None:
+            out = np.empty(builder.size(self.n_sensors_))
+        builder.build_(self.state_, self.params_, self.park_place_pack_, out)
+        return out
                         
     def accelerate_ahead(self, magnitude):
         if not self.collided_ and not self.parked_:
-            self.accelerations_imposed_.append(np.copy(self.d_ahead_) * magnitude)
-            self.a_ = np.sum(np.array(self.accelerations_imposed_), axis=0)
-            self.a_magnitude_ = np.linalg.norm(self.a_)
+            car_accelerate_numba(self.state_, _D_AHEAD, 1.0, magnitude)
         
     def accelerate_back(self, magnitude):
         if not self.collided_ and not self.parked_:
-            self.accelerations_imposed_.append(-np.copy(self.d_ahead_) * magnitude)        
-            self.a_ = np.sum(np.array(self.accelerations_imposed_), axis=0)
-            self.a_magnitude_ = np.linalg.norm(self.a_)
+            car_accelerate_numba(self.state_, _D_AHEAD, -1.0, magnitude)
 
     def accelerate_right(self, magnitude):
         if not self.collided_ and not self.parked_:
             if self.v_magnitude_ >= self.min_velocity_to_turn_: 
-                self.accelerations_imposed_.append(np.copy(self.d_right_) * magnitude)
-                self.a_ = np.sum(np.array(self.accelerations_imposed_), axis=0)
-                self.a_magnitude_ = np.linalg.norm(self.a_)
+                car_accelerate_numba(self.state_, _D_RIGHT, 1.0, magnitude)
         
     def accelerate_left(self, magnitude):
         if not self.collided_ and not self.parked_:
             if self.v_magnitude_ >= self.min_velocity_to_turn_: 
-                self.accelerations_imposed_.append(-np.copy(self.d_right_) * magnitude)
-                self.a_ = np.sum(np.array(self.accelerations_imposed_), axis=0)
-                self.a_magnitude_ = np.linalg.norm(self.a_)
+                car_accelerate_numba(self.state_, _D_RIGHT, -1.0, magnitude)
         
-    def step(self, dt, dt_since_action, time_remaining, obstacles, park_place):                     
-        # static friction        
-        if self.v_magnitude_ == 0.0 and self.a_magnitude_ > 0.0:
-            friction_factor_static = min(self.mu_static_ * CONST_G / self.a_magnitude_, 1.0)
-            self.a_ -= friction_factor_static * self.a_   
-            self.a_magnitude_ *= 1.0 - friction_factor_static            
-        # kinetic friction
-        friction_factor_kinetic = 0.0            
-        if self.v_magnitude_ > 0.0:            
-            mu_kinetic_g_dt = self.mu_kinetic_ * CONST_G * dt
-            v_mean_magnitude = np.linalg.norm(self.v_ + 0.5 * self.a_ * dt)            
-            friction_factor_kinetic = min(mu_kinetic_g_dt / v_mean_magnitude, 1.0)                                                
-        # update position
-        self.x_ += (1.0 - friction_factor_kinetic) * (self.v_ * dt + 0.5 * self.a_ * dt**2)
-        # update velocity
-        self.v_ = (1.0 - friction_factor_kinetic) * (self.v_ + self.a_ * dt)
-        self.v_magnitude_ = np.linalg.norm(self.v_)        
-        if self.v_magnitude_ > self.max_velocity_:
-            self.v_ = self.max_velocity_ * self.v_ / self.v_magnitude_
-            self.v_magnitude_ = self.max_velocity_                
-        # update direction vectors                                 
-        if self.v_magnitude_ > 0.0:
-            d_ahead_old = self.d_ahead_              
-            self.d_ahead_ = self.v_ / self.v_magnitude_
-            if self.d_ahead_.dot(d_ahead_old) < 0.0:
-                self.d_ahead_ *= -1.0 # prevents unrealistic front-back 'flips'
-            rotation_matrix = np.array([[0.0, 1.0], [-1.0, 0.0]]) # for -pi/2
-            self.d_right_ = rotation_matrix.dot(self.d_ahead_)
-            self.angle_ahead_ = np.arctan2(self.d_ahead_[1], self.d_ahead_[0])
-            if self.angle_ahead_ < 0.0:
-                self.angle_ahead_ += 2 * np.pi                            
-        # refresh additional information
-        self.accelerations_imposed_ = [] # accelerations for current step are now consumed -> empty list for accelerations fo next step
-        self.a_ = np.array([0.0, 0.0])
-        self.a_magnitude_ = 0.0
-        self._refresh_corners()
-        self._refresh_sensors_xs()
-        self._refresh_sensors_values(obstacles)
-        self._check_collisions(obstacles)
-        if self.collided_:
-            self.v_ = np.array([0.0, 0.0]) # stop due to collision
-            self.v_magnitude_ = 0.0
-        if time_remaining - dt <= 0.0:
-            self.time_exceeded_ = True         
-        self._refresh_to_park_place_vectors(park_place)      
-        self._refresh_reward(dt_since_action)
+    def step(self, dt, dt_since_action, time_remaining, obstacles, park_place, static_friction=True): # physics, sensors, collisions, park place vectors and reward in one compiled call (accelerations consumed)
+        self.collided_, self.parked_, self.time_exceeded_ = car_step_numba(self.state_, self.collided_, self.parked_, self.time_exceeded_, dt, dt_since_action, time_remaining, 
+                                                                           self.params_, self.n_sensors_front_, self.n_sensors_back_, self.n_sensors_sides_, static_friction, self.swept_collisions_, self.physics_substep_, 
+                                                                           self._park_place_pack(park_place), *self._obstacles_pack(obstacles).arrays_)
         # memorize some history
-        self.x_history_.append(np.copy(self.x_))
-        self.x_fl_history_.append(np.copy(self.x_fl_))
-        self.x_fr_history_.append(np.copy(self.x_fr_))
-        self.x_bl_history_.append(np.copy(self.x_bl_))        
-        self.x_br_history_.append(np.copy(self.x_br_))            
+        self.history_.append(self.x_, self.x_fl_, self.x_fr_, self.x_bl_, self.x_br_)            
+        
+    def advance(self, action_pair, n_frames, frame, dt, dt_since_action, time_limit, obstacles, park_place): # macro-step: up to n_frames steps in one compiled call, stopping early once collided, parked or time limit reached 
+        # first frame consumes accelerations imposed so far (as step does), action pair (ahead or back, right or left) imposed again for each further frame; time elapsed before given frame: frame * dt
+        # returns: number of frames performed, sum of distances to park place after each of them, flags: collided, parked, time exceeded
+        ahead = CAR_ACCELERATION_MAGNITUDES_AHEAD[action_pair[0]] if action_pair[0] > 0 else -CAR_ACCELERATION_MAGNITUDES_BACK[-action_pair[0]] 
+        side = CAR_ACCELERATION_MAGNITUDES_SIDE[abs(action_pair[1])] * np.sign(action_pair[1])
+        history = self.history_
+        n_performed, distances, self.collided_, self.parked_, self.time_exceeded_, history.head_ = car_advance_numba(
+            self.state_, self.collided_, self.parked_, self.time_exceeded_, float(ahead), float(side), n_frames, frame, dt, dt_since_action, time_limit, 
+            self.params_, self.n_sensors_front_, self.n_sensors_back_, self.n_sensors_sides_, self.swept_collisions_, self.physics_substep_, self._park_place_pack(park_place), history.buffer_, history.head_, *self._obstacles_pack(obstacles).arrays_)
+        history.size_ = min(history.size_ + n_performed, history.capacity_)
+        return n_performed, distances, self.collided_, self.parked_, self.time_exceeded_
         
     def step_bak(self, dt, dt_since_action, time_remaining, obstacles, park_place):                     
-        # static friction
+        # static friction (only when exceeding its limit)
         mu_static_g = self.mu_static_ * CONST_G
         if self.v_magnitude_ == 0.0 and self.a_magnitude_ > mu_static_g:
             friction_factor_static = mu_static_g / self.a_magnitude_
             self.a_ -= friction_factor_static * self.a_   
             self.a_magnitude_ *= 1.0 - friction_factor_static            
-        # kinetic friction
-        friction_factor_kinetic = 0.0            
-        if self.v_magnitude_ > 0.0:            
-            mu_kinetic_g_dt = self.mu_kinetic_ * CONST_G * dt
-            v_mean_magnitude = np.linalg.norm(self.v_ + 0.5 * self.a_ * dt)            
-            friction_factor_kinetic = min(mu_kinetic_g_dt / v_mean_magnitude, 1.0)                                                
-        # update position
-        self.x_ += (1.0 - friction_factor_kinetic) * (self.v_ * dt + 0.5 * self.a_ * dt**2)
-        # update velocity
-        self.v_ = (1.0 - friction_factor_kinetic) * (self.v_ + self.a_ * dt)
-        self.v_magnitude_ = np.linalg.norm(self.v_)        
-        if self.v_magnitude_ > self.max_velocity_:
-            self.v_ = self.max_velocity_ * self.v_ / self.v_magnitude_
-            self.v_magnitude_ = self.max_velocity_                
-        # update direction vectors                                 
-        if self.v_magnitude_ > 0.0:
-            d_ahead_old = self.d_ahead_              
-            self.d_ahead_ = self.v_ / self.v_magnitude_
-            if self.d_ahead_.dot(d_ahead_old) < 0.0:
-                self.d_ahead_ *= -1.0 # prevents unrealistic front-back 'flips'
-            rotation_matrix = np.array([[0.0, 1.0], [-1.0, 0.0]]) # for -pi/2
-            self.d_right_ = rotation_matrix.dot(self.d_ahead_)
-            self.angle_ahead_ = np.arctan2(self.d_ahead_[1], self.d_ahead_[0])
-            if self.angle_ahead_ < 0.0:
-                self.angle_ahead_ += 2 * np.pi                            
-        # refresh additional information
-        self.accelerations_imposed_ = [] # accelerations for current step are now consumed -> empty list for accelerations fo next step
-        self.a_ = np.array([0.0, 0.0])
-        self.a_magnitude_ = 0.0
-        self._refresh_corners()
-        self._refresh_sensors_xs()
-        self._refresh_sensors_values(obstacles)
-        self._check_collisions(obstacles)
-        if self.collided_:
-            self.v_ = np.array([0.0, 0.0]) # stop due to collision
-            self.v_magnitude_ = 0.0
-        if time_remaining - dt <= 0.0:
-            self.time_exceeded_ = True         
-        self._refresh_to_park_place_vectors(park_place)      
-        self._refresh_reward(dt_since_action)
-        # memorize some history
-        self.x_history_.append(np.copy(self.x_))
-        self.x_fl_history_.append(np.copy(self.x_fl_))
-        self.x_fr_history_.append(np.copy(self.x_fr_))
-        self.x_bl_history_.append(np.copy(self.x_bl_))        
-        self.x_br_history_.append(np.copy(self.x_br_))        
+        self.step(dt, dt_since_action, time_remaining, obstacles, park_place, static_friction=False)
         
     def is_stuck(self, dt):
         steps_back = int(self.antistuck_check_seconds_back_ / dt)
-        if len(self.x_history_) < steps_back:
+        if self.history_.size_ < steps_back:
             return False        
-        return np.linalg.norm(self.x_ - self.x_history_[-steps_back]) <= self.antistuck_check_radius_             
+        return np.linalg.norm(self.x_ - self.history_.get(-steps_back)) <= self.antistuck_check_radius_             
     
+
 class ParkPlace: # not necessarily rectangle (e.g.~parallelogram)
     def __init__(self, x_fl, x_fr, x_bl, x_br):
         self.x_fl_ = x_fl 
@@ -491,6 +1139,258 @@ class Scene:
         self.car_ = car
         self.park_place_ = park_place
         self.obstacles_ = obstacles
+        self.obstacles_pack_ = self.car_._obstacles_pack(obstacles) # built once per scene (cached by car)
         self.car_._refresh_sensors_values(obstacles)
         self.car_._refresh_to_park_place_vectors(park_place)
-        self.car_._refresh_reward(0.0)
\ No newline at end of file
+        self.car_._refresh_reward(0.0)
+
+class CarBatch: # struct-of-arrays counterpart of Car stepping N cars (each in its own scene) in lockstep, per-car trajectories same as for Car.step
+
+    def __init__(self, scenes):
+        cars = [scene.car_ for scene in scenes]
+        car = cars[0] # physical parameters and numbers of sensors common for all cars
+        self.n_ = len(cars)
+        self.params_ = np.copy(car.params_)
+        self.l_ = car.l_
+        self.w_ = car.w_
+        self.min_velocity_to_turn_ = car.min_velocity_to_turn_
+        self.state_repr_function_name = car.state_repr_function_name
+        self.swept_collisions_ = car.swept_collisions_
+        self.physics_substep_ = car.physics_substep_
+        self.n_sensors_front_ = car.n_sensors_front_
+        self.n_sensors_back_ = car.n_sensors_back_
+        self.n_sensors_sides_ = car.n_sensors_sides_
+        self.n_sensors_ = car.n_sensors_ # sensors order: front, back, left, right
+        self.states_ = np.array([c.state_ for c in cars], dtype=np.float64) # (N, K): rows are state blocks of cars (see CAR STATE BLOCK LAYOUT)
+        s = self.states_ # views of columns below: (N, 2) unless stated otherwise
+        self.x_ = s[:, _X : _X + 2]
+        self.v_ = s[:, _V : _V + 2]
+        self.a_ = s[:, _A : _A + 2]
+        self.d_ahead_ = s[:, _D_AHEAD : _D_AHEAD + 2]
+        self.d_right_ = s[:, _D_RIGHT : _D_RIGHT + 2]
+        self.x_fl_ = s[:, _X_FL : _X_FL + 2]
+        self.x_fr_ = s[:, _X_FR : _X_FR + 2]
+        self.x_f_ = s[:, _X_F : _X_F + 2]
+        self.x_bl_ = s[:, _X_BL : _X_BL + 2]
+        self.x_br_ = s[:, _X_BR : _X_BR + 2]
+        self.x_b_ = s[:, _X_B : _X_B + 2]
+        self.x_r_ = s[:, _X_R : _X_R + 2]
+        self.x_l_ = s[:, _X_L : _X_L + 2]
+        self.collision_x_ = s[:, _COLLISION_X : _COLLISION_X + 2] # nan until collision
+        self.angle_ahead_ = s[:, _ANGLE_AHEAD] # (N,)
+        self.v_magnitude_ = s[:, _V_MAGNITUDE] # (N,)
+        self.a_magnitude_ = s[:, _A_MAGNITUDE] # (N,)
+        self.distance_ = s[:, _DISTANCE] # (N,)
+        self.angle_distance_ = s[:, _ANGLE_DISTANCE] # (N,)
+        self.gutter_distance_ = s[:, _GUTTER_DISTANCE] # (N,)
+        self.reward_ = s[:, _REWARD] # (N,)
+        self.sensors_xs_ = s[:, _SENSORS : _SENSORS + 2 * self.n_sensors_].reshape(self.n_, self.n_sensors_, 2) # (N, n_sensors, 2)
+        self.sensors_values_ = s[:, _SENSORS + 2 * self.n_sensors_ : _SENSORS + 3 * self.n_sensors_] # (N, n_sensors)
+        self.collided_ = np.array([c.collided_ for c in cars], dtype=bool) # (N,)
+        self.parked_ = np.array([c.parked_ for c in cars], dtype=bool) # (N,)
+        self.time_exceeded_ = np.array([c.time_exceeded_ for c in cars], dtype=bool) # (N,)
+        # park places: (N, 8), see PARK PLACE ARRAY LAYOUT
+        self.park_places_ = np.array([c._park_place_pack(scene.park_place_) for c, scene in zip(cars, scenes)], dtype=np.float64)
+        # obstacles edges: (N, max number of edges, 2, 2), padded with nans (never intersecting)
+        packs = [scene.obstacles_pack_ for scene in scenes]
+        self.obstacles_n_edges_ = np.array([pack.edges_.shape[0] for pack in packs], dtype=np.int64) # (N,)
+        self.obstacles_n_ = np.array([pack.ranges_.shape[0] for pack in packs], dtype=np.int64) # (N,)
+        self.obstacles_edges_ = np.full((self.n_, max(1, np.max(self.obstacles_n_edges_)), 2, 2), np.nan)
+        self.obstacles_ranges_ = np.zeros((self.n_, max(1, np.max(self.obstacles_n_)), 2), dtype=np.int64)
+        self.obstacles_aabbs_ = np.zeros((self.n_, max(1, np.max(self.obstacles_n_)), 4))
+        for i, pack in enumerate(packs):
+            self.obstacles_edges_[i, :pack.edges_.shape[0]] = pack.edges_
+            self.obstacles_ranges_[i, :pack.ranges_.shape[0]] = pack.ranges_
+            self.obstacles_aabbs_[i, :pack.aabbs_.shape[0]] = pack.aabbs_
+
+    def set_car(self, i, scene): # car of given scene (same parameters as others) put into row i, obstacles padding grown if needed
+        car = scene.car_
+        self.states_[i] = car.state_
+        self.collided_[i], self.parked_[i], self.time_exceeded_[i] = car.collided_, car.parked_, car.time_exceeded_
+        self.park_places_[i] = car._park_place_pack(scene.park_place_)
+        pack = scene.obstacles_pack_
+        n_edges, n_obstacles = pack.edges_.shape[0], pack.ranges_.shape[0]
+        if n_edges > self.obstacles_edges_.shape[1]:
+            self.obstacles_edges_ = np.concatenate((self.obstacles_edges_, np.full((self.n_, n_edges - self.obstacles_edges_.shape[1], 2, 2), np.nan)), axis=1)
+        if n_obstacles > self.obstacles_ranges_.shape[1]:
+            self.obstacles_ranges_ = np.concatenate((self.obstacles_ranges_, np.zeros((self.n_, n_obstacles - self.obstacles_ranges_.shape[1], 2), dtype=np.int64)), axis=1)
+            self.obstacles_aabbs_ = np.concatenate((self.obstacles_aabbs_, np.zeros((self.n_, n_obstacles - self.obstacles_aabbs_.shape[1], 4))), axis=1)
+        self.obstacles_n_edges_[i] = n_edges
+        self.obstacles_n_[i] = n_obstacles
+        self.obstacles_edges_[i] = np.nan
+        self.obstacles_edges_[i, :n_edges] = pack.edges_
+        self.obstacles_ranges_[i, :n_obstacles] = pack.ranges_
+        self.obstacles_aabbs_[i, :n_obstacles] = pack.aabbs_
+
+    def _accelerate(self, d, sign, magnitudes, mask):
+        mask = mask & (magnitudes != 0.0) & ~self.collided_ & ~self.parked_
+        self.a_[mask] += sign * d[mask] * magnitudes[mask, np.newaxis]
+        self.a_magnitude_[mask] = np.sqrt(self.a_[mask, 0] * self.a_[mask, 0] + self.a_[mask, 1] * self.a_[mask, 1])
+
+    def accelerate_ahead(self, magnitudes): # magnitudes: (N,) array, zero meaning no acceleration for given car
+        self._accelerate(self.d_ahead_, 1.0, magnitudes, True)
+
+    def accelerate_back(self, magnitudes):
+        self._accelerate(self.d_ahead_, -1.0, magnitudes, True)
+
+    def accelerate_right(self, magnitudes):
+        self._accelerate(self.d_right_, 1.0, magnitudes, self.v_magnitude_ >= self.min_velocity_to_turn_)
+
+    def accelerate_left(self, magnitudes):
+        self._accelerate(self.d_right_, -1.0, magnitudes, self.v_magnitude_ >= self.min_velocity_to_turn_)
+
+    def step(self, dt, dt_since_action, time_remaining): # time_remaining: scalar or (N,) array
+        time_remaining = np.asarray(time_remaining, dtype=np.float64) * np.ones(self.n_)
+        car_batch_step_numba(self.states_, self.collided_, self.parked_, self.time_exceeded_, dt, dt_since_action, time_remaining, 
+                             self.params_, self.n_sensors_front_, self.n_sensors_back_, self.n_sensors_sides_, self.swept_collisions_, self.physics_substep_, self.park_places_, 
+                             self.obstacles_edges_, self.obstacles_n_edges_, self.obstacles_ranges_, self.obstacles_aabbs_, self.obstacles_n_)
+
+    def advance(self, active, aheads, sides, n_frames, frames, dt, dt_since_action, time_limit, history_buffers, history_heads): # macro-step of active cars (as Car.advance, ahead, sides: signed accelerations magnitudes), one compiled call
+        # history_buffers: (N, capacity, 5 or 1, 2), history_heads: (N,) updated in place; returns: numbers of frames performed and sums of distances to park places, (N,) each
+        n_performed = np.zeros(self.n_, dtype=np.int64)
+        distances = np.zeros(self.n_)
+        car_batch_advance_numba(self.states_, self.collided_, self.parked_, self.time_exceeded_, active, aheads, sides, n_frames, frames, dt, dt_since_action, time_limit, 
+                                self.params_, self.n_sensors_front_, self.n_sensors_back_, self.n_sensors_sides_, self.swept_collisions_, self.physics_substep_, self.park_places_, history_buffers, history_heads, 
+                                self.obstacles_edges_, self.obstacles_n_edges_, self.obstacles_ranges_, self.obstacles_aabbs_, self.obstacles_n_, n_performed, distances)
+        return n_performed, distances
+
+    def sensors_values(self, out=None): # sensors values of all cars at their current positions (as computed by step), one compiled call, written into out (N, n_sensors) or new matrix
+        if out is None:
+            out = np.empty((self.n_, self.n_sensors_))
+        sensors_values_batch_numba(self.x_, self.sensors_xs_, self.obstacles_edges_, self.obstacles_n_edges_, CAR_MAX_SENSOR_VALUE, out)
+        return out
+
+    def check_collisions(self): # collisions of all cars at their current positions, one compiled call, returns: indexes of edges hit (-1 if none) and their intersection parameters, (N,) each
+        edges_hit = np.empty(self.n_, dtype=np.int64)
+        tos = np.empty(self.n_)
+        check_collisions_batch_numba(self.x_, self.params_[_P_BOUNDING_RADIUS], self.x_fl_, self.x_fr_, self.x_bl_, self.x_br_, 
+                                     self.obstacles_edges_, self.obstacles_ranges_, self.obstacles_aabbs_, self.obstacles_n_, edges_hit, tos)
+        return edges_hit, tos
+
+    def get_states(self, out=None): # state representations of all cars in one call, written into out (N, state size) or new matrix
+        builder = STATE_REPR_BUILDERS[self.state_repr_function_name]
+        if out is None:
+            out = np.empty((self.n_, builder.size(self.n_sensors_)))
+        builder.build_batch_(self.states_, self.params_, self.park_places_, out)
+        return out
+
+class VectorizedEnv: # N episodes (each in its own scene, with its own random generator) advanced together from one steering decision to next, finished episodes recycled with fresh seeds (reset_env)
+    # cars stepped as rows of one CarBatch (their state blocks and history buffers rebound to views of its rows), their own flags and history counters synchronized once their episodes end
+
+    def __init__(self, scene_function, n_envs, action_pairs, dt, steering_gap_steps, time_limit, antistuck_nudge_steering_steps=0):
+        self.scene_function_ = scene_function # draws from np.random
+        self.n_ = n_envs
+        self.action_pairs_ = action_pairs # list of pairs: (ahead or back, right or left)
+        self.dt_ = dt
+        self.steering_gap_steps_ = steering_gap_steps
+        self.time_limit_ = time_limit
+        self.antistuck_nudge_steering_steps_ = antistuck_nudge_steering_steps # if 0 then no antistuck nudges
+        self.antistuck_nudge_indexes_ = np.array([action_pairs.index((-1, 0)), action_pairs.index((1, 0))]) # non-side accelerations (back or ahead)
+        # signed accelerations magnitudes per action index (as in Car.advance)
+        self.aheads_ = np.array([CAR_ACCELERATION_MAGNITUDES_AHEAD[ap[0]] if ap[0] > 0 else -CAR_ACCELERATION_MAGNITUDES_BACK[-ap[0]] for ap in action_pairs], dtype=np.float64)
+        self.sides_ = np.array([CAR_ACCELERATION_MAGNITUDES_SIDE[abs(ap[1])] * np.sign(ap[1]) for ap in action_pairs], dtype=np.float64)
+        self.scenes_ = [None] * n_envs
+        self.rngs_ = [None] * n_envs
+        self.seeds_ = np.zeros(n_envs, dtype=np.int64)
+        self.live_ = np.zeros(n_envs, dtype=bool)
+        self.dones_ = np.zeros(n_envs, dtype=bool)
+        self.frames_ = np.zeros(n_envs, dtype=np.int64)
+        self.distances_ = np.zeros(n_envs) # sums of distances to park places after each frame
+        self.rewards_ = np.zeros(n_envs)
+        self.actions_ = np.zeros(n_envs, dtype=np.int64) # indexes of action pairs performed since last steering
+        self.nudge_steps_ = np.zeros(n_envs, dtype=np.int64) # remaining steering steps of ongoing antistuck nudges (if positive then action indexes given to step are ignored)
+        self.batch_ = None # CarBatch (built by reset, once all scenes present)
+        self.histories_ = None # (N, capacity, 1, 2): trajectory history buffers of cars
+        self.history_heads_ = np.zeros(n_envs, dtype=np.int64)
+        self.history_sizes_ = np.zeros(n_envs, dtype=np.int64)
+        
+    def reset_env(self, i, seed): # new episode in environment i, its scene and random generator as for np.random.seed(seed) followed by scene function in single episode
+        np.random.seed(seed)
+        scene = self.scene_function_()
+        rng = np.random.RandomState()
+        rng.set_state(np.random.get_state())
+        scene.car_.reset_history(corners=False) # trace of corners needed only for drawing
+        self.scenes_[i] = scene
+        self.rngs_[i] = rng
+        self.seeds_[i] = seed
+        self.live_[i] = True
+        self.dones_[i] = False
+        self.frames_[i] = 0
+        self.distances_[i] = 0.0
+        self.rewards_[i] = scene.car_.reward_
+        self.actions_[i] = 0
+        self.nudge_steps_[i] = 0
+        if self.batch_ is not None:
+            self._bind(i)
+            
+    def _bind(self, i): # car of environment i put into batch row i, its state block and history buffer becoming views of batch rows
+        car = self.scenes_[i].car_
+        self.batch_.set_car(i, self.scenes_[i])
+        car.state_ = self.batch_.states_[i]
+        history = car.history_
+        self.histories_[i] = history.buffer_
+        history.buffer_ = self.histories_[i]
+        self.history_heads_[i] = history.head_
+        self.history_sizes_[i] = history.size_
+        
+    def _unbind(self, i): # car of environment i given back its own flags and history counters (state block stays a view of batch row until environment reset)
+        car = self.scenes_[i].car_
+        car.collided_, car.parked_, car.time_exceeded_ = bool(self.batch_.collided_[i]), bool(self.batch_.parked_[i]), bool(self.batch_.time_exceeded_[i])
+        car.history_.head_ = int(self.history_heads_[i])
+        car.history_.size_ = int(self.history_sizes_[i])
+        
+    def reset(self, seeds): # seeds: one per environment, returns states of all cars
+        self.batch_ = None
+        for i, seed in enumerate(seeds):
+            self.reset_env(i, seed)
+        self.batch_ = CarBatch(self.scenes_)
+        history = self.scenes_[0].car_.history_
+        self.histories_ = np.zeros((self.n_,) + history.buffer_.shape)
+        car = self.scenes_[0].car_ # antistuck parameters common for all cars
+        self.antistuck_steps_back_ = int(car.antistuck_check_seconds_back_ / self.dt_)
+        self.antistuck_check_radius_ = car.antistuck_check_radius_
+        for i in range(self.n_):
+            self._bind(i)
+        return self.get_states()
+        
+    def get_states(self, indexes=None): # state representations of cars in given environments (default: all), as rows of new matrix
+        if indexes is None:
+            indexes = range(self.n_)
+        return np.array([self.scenes_[i].car_.get_state() for i in indexes])
+
+    def step(self, action_indexes): # action indexes: (N,), performed by live unfinished episodes up to next steering, returns: rewards, dones
+        batch = self.batch_
+        dt_since_action = self.dt_ * self.steering_gap_steps_
+        active = self.live_ & ~self.dones_
+        nudged = active & (self.nudge_steps_ > 0) # ongoing antistuck nudges keep their actions
+        self.nudge_steps_[nudged] -= 1
+        steered = active & ~nudged
+        self.actions_[steered] = np.asarray(action_indexes)[steered]
+        # accelerations for first frame (as Car.accelerate_... per car)
+        aheads = np.where(active, self.aheads_[self.actions_], 0.0)
+        sides = np.where(active, self.sides_[self.actions_], 0.0)
+        batch.accelerate_ahead(np.where(aheads > 0.0, aheads, 0.0))
+        batch.accelerate_back(np.where(aheads < 0.0, -aheads, 0.0))
+        batch.accelerate_right(np.where(sides > 0.0, sides, 0.0))
+        batch.accelerate_left(np.where(sides < 0.0, -sides, 0.0))
+        if self.antistuck_nudge_steering_steps_ > 0: # random nudge (if not about to move or stuck, random acceleration ahead or back from next frame)
+            checked = active & (self.nudge_steps_ == 0)
+            idle = (batch.v_magnitude_ == 0.0) & (batch.a_magnitude_ == 0.0)
+            steps_back = self.antistuck_steps_back_
+            x_back = self.histories_[np.arange(self.n_), (self.history_heads_ - steps_back) % self.histories_.shape[1], 0] # as Car.is_stuck
+            stuck = (self.history_sizes_ >= steps_back) & (np.linalg.norm(batch.x_ - x_back, axis=1) <= self.antistuck_check_radius_)
+            for i in np.where(checked & (idle | stuck))[0]:
+                self.actions_[i] = self.rngs_[i].choice(self.antistuck_nudge_indexes_)
+                self.nudge_steps_[i] = self.antistuck_nudge_steering_steps_
+            aheads = np.where(active, self.aheads_[self.actions_], 0.0)
+            sides = np.where(active, self.sides_[self.actions_], 0.0)
+        n_frames = self.steering_gap_steps_ - self.frames_ % self.steering_gap_steps_
+        n_performed, distances = batch.advance(active, aheads, sides, n_frames, self.frames_, self.dt_, dt_since_action, self.time_limit_, self.histories_, self.history_heads_)
+        self.history_sizes_ = np.minimum(self.history_sizes_ + n_performed, self.histories_.shape[1])
+        self.frames_ += n_performed
+        self.distances_ += distances
+        self.rewards_[active] = batch.reward_[active]
+        self.dones_[active] = (batch.collided_ | batch.parked_ | (self.frames_ * self.dt_ >= self.time_limit_))[active]
+        for i in np.where(active & self.dones_)[0]:
+            self._unbind(i)
+        return self.rewards_, self.dones_
@@ -0,0 +1,465 @@
+import numpy as np
+from numba import jit
+import json
+import os
+import zipfile as zf
+
+# EXPERIENCE BUFFER CONSTANTS
+EXPERIENCE_BUFFER_INITIAL_ALLOCATION = 65536 # rows allocated at start, columns grown geometrically up to capacity (in-memory backend only)
+EXPERIENCE_BUFFER_STATES_PER_TRANSITION = 1.25 # initial capacity of states ring relative to capacity of transitions (about one state per transition plus first state of each episode)
+EXPERIENCE_BUFFER_MAX_STATES_PER_TRANSITION = 2 # worst case (each transition with its own state and next state, e.g. experience collected with probability below 1): capacity of states ring never evicting live transitions
+EXPERIENCE_BUFFER_STATES_GROWTH = 1.125 # states ring grown (with live states relocated) by at least this factor whenever appending would overwrite states of live transitions
+EXPERIENCE_BUFFER_COLUMNS = ["states", "state_ids", "next_state_ids", "actions", "rewards", "terminals", "priorities"]
+EXPERIENCE_BUFFER_HEADER_FNAME = "header.json"
+EXPERIENCE_SNAPSHOT_CHUNK_SIZE = 2**18 # rows per chunk (archive entry) of snapshot
+
+@jit(nopython=True)
+def sum_tree_update_numba(tree, n_leaves, slots, values): # leaves at slots set to values, sums along their paths to root recomputed (duplicates allowed)
+    for j in range(slots.size):
+        i = n_leaves + slots[j]
+        tree[i] = values[j]
+        i //= 2
+        while i >= 1:
+            tree[i] = tree[2 * i] + tree[2 * i + 1]
+            i //= 2
+
+@jit(nopython=True)
+def sum_tree_find_numba(tree, n_leaves, us, slots): # for each cumulative value u in [0, total): slot of leaf whose interval contains u
+    for j in range(us.size):
+        u = us[j]
+        i = 1
+        while i < n_leaves:
+            left = tree[2 * i]
+            if u < left or tree[2 * i + 1] <= 0.0: # (second condition against rounding errors near total)
+                i = 2 * i
+            else:
+                u -= left
+                i = 2 * i + 1
+        slots[j] = i - n_leaves
+
+class SumTree: # binary tree of sums over (power of two) leaves kept in one array (root at 1, children of i at 2i and 2i + 1), O(log n) updates and draws proportional to leaves
+
+    def __init__(self, capacity):
+        self.n_leaves_ = 1 << max(int(np.ceil(np.log2(max(capacity, 1)))), 0)
+        self.tree_ = np.zeros(2 * self.n_leaves_)
+
+    def total(self):
+        return self.tree_[1]
+
+    def leaves(self, slots):
+        return self.tree_[self.n_leaves_ + slots]
+
+    def update(self, slots, values):
+        sum_tree_update_numba(self.tree_, self.n_leaves_, np.asarray(slots, dtype=np.int64), np.asarray(values, dtype=np.float64))
+
+    def find(self, us):
+        slots = np.empty(us.size, dtype=np.int64)
+        sum_tree_find_numba(self.tree_, self.n_leaves_, us, slots)
+        return slots
+
+class EpisodeTrajectory: # experience of single episode collected along its trajectory: each state (frame) stored once, transitions as records of indexes of their states and next states
+
+    def __init__(self, max_size, state_size):
+        self.states_ = np.empty((max_size, state_size))
+        self.frames_ = np.empty(max_size, dtype=np.int64)
+        self.n_states_ = 0
+        self.state_idxs_ = np.empty(max_size, dtype=np.int64)
+        self.next_state_idxs_ = np.empty(max_size, dtype=np.int64)
+        self.actions_ = np.empty(max_size, dtype=np.int8)
+        self.rewards_ = np.empty(max_size)
+        self.terminals_ = np.empty(max_size, dtype=bool)
+        self.size_ = 0
+
+    def add_state(self, frame, state): # index of state observed at given frame (stored only if no state stored for this frame yet, e.g. next state of last transition)
+        if self.n_states_ > 0 and self.frames_[self.n_states_ - 1] == frame:
+            return self.n_states_ - 1
+        self.states_[self.n_states_] = state
+        self.frames_[self.n_states_] = frame
+        self.n_states_ += 1
+        return self.n_states_ - 1
+
+    def add(self, state_idx, action, reward, next_state_idx, terminal):
+        self.state_idxs_[self.size_] = state_idx
+        self.next_state_idxs_[self.size_] = next_state_idx
+        self.actions_[self.size_] = action
+        self.rewards_[self.size_] = reward
+        self.terminals_[self.size_] = terminal
+        self.size_ += 1
+
+    def experience(self): # trimmed copies (states, state indexes, next state indexes, actions, rewards, terminals), as for ExperienceBuffer.append
+        n, n_states = self.size_, self.n_states_
+        return (self.states_[:n_states].copy(), self.state_idxs_[:n].copy(), self.next_state_idxs_[:n].copy(), self.actions_[:n].copy(), self.rewards_[:n].copy(), 
+                self.terminals_[:n].copy())
+
+class ExperienceBuffer: # circular replay buffer with contiguous typed columns: ring of states (each stored once) and ring of transitions (row per transition: state id, action, reward, next state id, is next state terminal, priority)
+    # state ids absolute (slot in states ring: id % states capacity), oldest transitions overwritten once full or evicted when their states overwritten
+    
+    def __init__(self, capacity, state_size, folder=None, states_capacity=None): # if folder given then memory-mapped backend: one .npy file per column (full capacity, sparse on disk) and small header (capacities, heads, sizes)
+        # states ring grown from initial capacity along actual number of states per transition (up to worst case)
+        self.capacity_ = capacity
+        self.states_capacity_ = int(np.ceil(EXPERIENCE_BUFFER_STATES_PER_TRANSITION * capacity)) if states_capacity is None else states_capacity
+        self.state_size_ = state_size
+        self.size_ = 0
+        self.head_ = 0 # slot for next transition
+        self.states_count_ = 0 # id for next state
+        self.folder_ = folder
+        self.mode_ = "w+"
+        n = min(capacity, EXPERIENCE_BUFFER_INITIAL_ALLOCATION) if folder is None else capacity
+        n_states = min(self.states_capacity_, EXPERIENCE_BUFFER_INITIAL_ALLOCATION) if folder is None else self.states_capacity_
+        if folder is not None:
+            os.makedirs(folder, exist_ok=True)
+        self.states_ = self._column("states", (n_states, state_size), np.float64)
+        self.state_ids_ = self._column("state_ids", (n,), np.int64)
+        self.next_state_ids_ = self._column("next_state_ids", (n,), np.int64)
+        self.actions_ = self._column("actions", (n,), np.int8)
+        self.rewards_ = self._column("rewards", (n,), np.float64)
+        self.terminals_ = self._column("terminals", (n,), bool)
+        self.priorities_ = self._column("priorities", (n,), np.float64) # e.g. Bellman errors (for the case of prioritized experience replay, updateable after fits)
+        self.tree_ = None
+        self.transformer_ = None
+        self.oracle_values_ = None
+        self.flush()
+
+    @staticmethod
+    def open(folder, mode="r"): # memory-mapped buffer reopened (e.g. after restart with mode "r+", or shared read-only by several processes with mode "r")
+        with open(folder + EXPERIENCE_BUFFER_HEADER_FNAME, "r") as f:
+            header = json.load(f)
+        eb = ExperienceBuffer.__new__(ExperienceBuffer)
+        eb.capacity_ = header["capacity"]
+        eb.states_capacity_ = header["states_capacity"] # (updated below from states file, which tells actual capacity even if header not rewritten after growth)
+        eb.state_size_ = header["state_size"]
+        eb.size_ = header["size"]
+        eb.head_ = header["head"]
+        eb.states_count_ = header["states_count"]
+        eb.folder_ = folder
+        eb.mode_ = mode
+        eb.states_, eb.state_ids_, eb.next_state_ids_, eb.actions_, eb.rewards_, eb.terminals_, eb.priorities_ = [np.load(folder + name + ".npy", mmap_mode=mode) for name in EXPERIENCE_BUFFER_COLUMNS]
+        eb.states_capacity_ = eb.states_.shape[0]
+        eb.tree_ = None
+        eb.transformer_ = None
+        eb.oracle_values_ = None
+        return eb
+
+    def prioritize(self, alpha=0.6, eps=1e-6): # prioritized experience replay on: draws proportional to (priority + eps)**alpha kept in sum tree (built from priorities of live transitions), new transitions get max priority so far
+        self.alpha_ = alpha
+        self.eps_ = eps
+        self.tree_ = SumTree(self.capacity_)
+        slots = self.slots(np.arange(self.size_))
+        self.max_priority_ = max(np.max(self.priorities_[slots]), 1.0) if self.size_ > 0 else 1.0
+        self.tree_.update(slots, (self.priorities_[slots] + eps)**alpha)
+
+    def cache_features(self, transformer, engine=None): # transformed features (float32) of states computed at append and stored next to them, so that batch assembly is pure gather (see sample_features)
+        # rows computed by other transformer (different parameters) recomputed lazily when sampled, engine: compiled counterpart of transformer used for transforms if given (e.g. features.PolynomialEngine)
+        key = f"{transformer.__class__.__name__}({transformer.get_params()})"
+        n_features = transformer.fit_transform(np.zeros((1, self.state_size_))).shape[1]
+        if self.transformer_ is None or n_features != self.features_.shape[1]:
+            n_states = self.states_.shape[0]
+            self.features_ = self._column("features", (n_states, n_features), np.float32)
+            self.features_versions_ = self._column("features_versions", (n_states,), np.int32)
+            self.features_versions_[:] = -1
+            self.transformer_version_ = 0
+        elif key != self.transformer_key_:
+            self.transformer_version_ += 1
+        self.transformer_ = transformer
+        self.transformer_key_ = key
+        self.engine_ = engine
+
+    def cache_oracle_values(self, n_actions): # predictions of target model (oracle) for next states stored per transition and reused by fits until oracle changes (see invalidate_oracle_values)
+        n = self.actions_.shape[0]
+        self.oracle_values_ = self._column("oracle_values", (n, n_actions), np.float64)
+        self.oracle_versions_ = self._column("oracle_versions", (n,), np.int32)
+        self.oracle_versions_[:] = -1
+        self.oracle_version_ = 0
+
+    def invalidate_oracle_values(self): # to be called whenever oracle changes (switch or slow update), cached predictions recomputed lazily when sampled
+        if self.oracle_values_ is not None:
+            self.oracle_version_ += 1
+
+    def sample_oracle_values(self, indexes, X_next, predict): # oracle predictions (predict function) for next states (features X_next) of transitions at indexes of live window, returns them and number of rows not cached yet
+        # only transitions not predicted by current oracle yet passed to predict
+        slots = self.slots(indexes)
+        stale = np.where(self.oracle_versions_[slots] != self.oracle_version_)[0]
+        if stale.size > 0:
+            stale_slots, firsts = np.unique(slots[stale], return_index=True) # (transitions drawn more than once predicted once)
+            self.oracle_values_[stale_slots] = predict(X_next[stale[firsts]])
+            self.oracle_versions_[stale_slots] = self.oracle_version_
+        return self.oracle_values_[slots], stale.size
+
+    def _transform(self, states):
+        if self.engine_ is not None:
+            return self.engine_.transform(states, dtype=np.float32)
+        return self.transformer_.fit_transform(states).astype(np.float32)
+
+    def _column(self, name, shape, dtype):
+        if self.folder_ is None or self.mode_ == "r":
+            return np.empty(shape, dtype=dtype)
+        return np.lib.format.open_memmap(self.folder_ + name + ".npy", mode="w+", dtype=dtype, shape=shape)
+
+    def flush(self): # memory-mapped backend: columns flushed and header written (other processes see transitions appended so far after refresh)
+        if self.folder_ is None or self.mode_ == "r":
+            return
+        for column in self._columns():
+            column.flush()
+        self._write_header()
+
+    def _write_header(self): # header replaced atomically (written to temporary file first), so that reader or restart after crash never sees partial header
+        fname = self.folder_ + EXPERIENCE_BUFFER_HEADER_FNAME
+        with open(fname + ".tmp", "w") as f:
+            json.dump({"capacity": self.capacity_, "states_capacity": self.states_capacity_, "state_size": self.state_size_, "head": self.head_, "size": self.size_, "states_count": self.states_count_}, f)
+        os.replace(fname + ".tmp", fname)
+
+    def _drop_for_append(self, n_states, n_transitions): # memory-mapped backend: transitions whose slots or states are to be overwritten by append dropped from live window beforehand, header written
+        # (header on disk then never describing overwritten slots, e.g. when reopened after crash in the middle of append)
+        self._grow_states(n_states, n_transitions)
+        k = max(self.size_ + n_transitions - self.capacity_, 0)
+        if k > 0:
+            if self.tree_ is not None:
+                self.tree_.update(self.slots(np.arange(k)), np.zeros(k))
+            self.size_ -= k
+        self._evict(self.states_count_ + n_states - self.states_capacity_)
+        self._write_header()
+
+    def refresh(self): # memory-mapped backend: heads and sizes reread from header (for processes sharing buffer read-only)
+        with open(self.folder_ + EXPERIENCE_BUFFER_HEADER_FNAME, "r") as f:
+            header = json.load(f)
+        self.head_ = header["head"]
+        self.size_ = header["size"]
+        self.states_count_ = header["states_count"]
+
+    def save(self, fname, compressed=False, chunk_size=EXPERIENCE_SNAPSHOT_CHUNK_SIZE): # snapshot of live window streamed into zip archive chunk by chunk (one .npy entry per column and chunk, deflated if compressed)
+        # states from the one of oldest transition on, transitions from oldest (with state ids relative to first state saved)
+        first_id = int(self.state_ids_[self.slots(0)]) if self.size_ > 0 else self.states_count_
+        n_states = self.states_count_ - first_id
+        with zf.ZipFile(fname, mode="w", compression=zf.ZIP_DEFLATED if compressed else zf.ZIP_STORED, allowZip64=True) as archive:
+            archive.writestr(EXPERIENCE_BUFFER_HEADER_FNAME, json.dumps({"state_size": self.state_size_, "size": self.size_, "n_states": n_states, "chunk_size": chunk_size}))
+            for k, j in enumerate(range(0, n_states, chunk_size)):
+                ids = np.arange(first_id + j, min(first_id + j + chunk_size, self.states_count_))
+                self._save_entry(archive, f"states_{k}.npy", self.states_[self.state_slots(ids)])
+            for k, j in enumerate(range(0, self.size_, chunk_size)):
+                slots = self.slots(np.arange(j, min(j + chunk_size, self.size_)))
+                for name in EXPERIENCE_BUFFER_COLUMNS[1:]:
+                    values = getattr(self, name + "_")[slots]
+                    if name in ["state_ids", "next_state_ids"]:
+                        values -= first_id
+                    self._save_entry(archive, f"{name}_{k}.npy", values)
+
+    @staticmethod
+    def _save_entry(archive, name, array):
+        with archive.open(name, mode="w", force_zip64=True) as f:
+            np.lib.format.write_array(f, np.ascontiguousarray(array), allow_pickle=False)
+
+    @staticmethod
+    def _load_entry(archive, name):
+        with archive.open(name, mode="r") as f:
+            return np.lib.format.read_array(f, allow_pickle=False)
+
+    def load(self, fname): # snapshot (see save) streamed from archive chunk by chunk and appended (states chunks ahead of transitions chunks referring to them), oldest transitions dropped if capacities smaller
+        with zf.ZipFile(fname, mode="r") as archive:
+            header = json.loads(archive.read(EXPERIENCE_BUFFER_HEADER_FNAME))
+            if header["state_size"] != self.state_size_:
+                raise ValueError(f"state size in snapshot {fname}: {header['state_size']} does not match state size of experience buffer: {self.state_size_}")
+            first_id = self.states_count_
+            n_states_loaded = 0
+            k_states = 0
+            for k in range(int(np.ceil(header["size"] / header["chunk_size"]))):
+                state_ids, next_state_ids, actions, rewards, terminals, priorities = [self._load_entry(archive, f"{name}_{k}.npy") for name in EXPERIENCE_BUFFER_COLUMNS[1:]]
+                while n_states_loaded <= np.max(next_state_ids):
+                    states = self._load_entry(archive, f"states_{k_states}.npy")
+                    self._append_states(states)
+                    n_states_loaded += states.shape[0]
+                    k_states += 1
+                self._append_transitions(first_id + state_ids, first_id + next_state_ids, actions, rewards, terminals, priorities)
+        if self.tree_ is not None: # sum tree and max priority rebuilt with priorities loaded
+            self.prioritize(self.alpha_, self.eps_)
+        self.flush()
+
+    def _transitions_column_names(self):
+        names = ["state_ids_", "next_state_ids_", "actions_", "rewards_", "terminals_", "priorities_"]
+        if self.oracle_values_ is not None:
+            names += ["oracle_versions_", "oracle_values_"]
+        return names
+
+    def _states_column_names(self):
+        names = ["states_"]
+        if self.transformer_ is not None:
+            names += ["features_", "features_versions_"]
+        return names
+
+    def _columns(self):
+        return [getattr(self, name) for name in self._states_column_names() + self._transitions_column_names()]
+
+    def _reserve(self, names, capacity, n): # columns (of states or of transitions) grown (geometrically) to hold at least n rows
+        allocated = getattr(self, names[0]).shape[0]
+        if n <= allocated:
+            return
+        allocated = min(max(n, 2 * allocated), capacity)
+        for name in names:
+            column = getattr(self, name)
+            grown = np.empty((allocated,) + column.shape[1:], dtype=column.dtype)
+            grown[:column.shape[0]] = column
+            setattr(self, name, grown)
+
+    def slots(self, indexes): # slots of transitions at given indexes of live window (0 meaning oldest transition)
+        return (self.head_ - self.size_ + indexes) % self.capacity_
+
+    def state_slots(self, state_ids):
+        return state_ids % self.states_capacity_
+
+    def _evict(self, min_state_id): # oldest transitions referring to states with ids below min_state_id (overwritten) dropped from live window (ids nondecreasing along window)
+        if self.size_ == 0 or self.state_ids_[self.slots(0)] >= min_state_id:
+            return
+        tail = self.slots(0)
+        ids = self.state_ids_[tail : min(tail + self.size_, self.capacity_)]
+        k = int(np.searchsorted(ids, min_state_id))
+        if k == ids.size and self.size_ > ids.size: # (window wrapped around)
+            k += int(np.searchsorted(self.state_ids_[:self.size_ - ids.size], min_state_id))
+        if self.tree_ is not None:
+            self.tree_.update(self.slots(np.arange(k)), np.zeros(k))
+        self.size_ -= k
+
+    def _write(self, columns, columns_values, i, capacity): # rows written into ring columns from slot i on (with wraparound)
+        n = columns_values[0].shape[0]
+        k = min(n, capacity - i) # rows before wraparound
+        for column, values in zip(columns, columns_values):
+            column[i : i + k] = values[:k]
+            column[:n - k] = values[k:]
+
+    def _grow_states(self, n_states, n_transitions): # states ring grown (up to worst case capacity) if n_states appended would overwrite states of transitions remaining live after n_transitions appended
+        # memory-mapped backend: columns files replaced by grown ones
+        max_states_capacity = max(EXPERIENCE_BUFFER_MAX_STATES_PER_TRANSITION * self.capacity_, self.states_capacity_)
+        memmap = self.folder_ is not None
+        if (memmap and self.mode_ == "r") or self.states_capacity_ >= max_states_capacity:
+            return
+        n_dropped = max(self.size_ + n_transitions - self.capacity_, 0) # (oldest transitions overwritten anyway)
+        min_id = int(self.state_ids_[self.slots(n_dropped)]) if n_dropped < self.size_ else self.states_count_
+        n_needed = self.states_count_ + n_states - min_id
+        if n_needed <= self.states_capacity_:
+            return
+        states_capacity = min(max(n_needed, int(np.ceil(EXPERIENCE_BUFFER_STATES_GROWTH * self.states_capacity_))), max_states_capacity)
+        if memmap or self.states_count_ > self.states_capacity_: # full-size columns or ring wrapped around: live states relocated into new slots (id % new capacity), contiguous pieces copied
+            min_id = max(min_id, self.states_count_ - self.states_capacity_)
+            for name in self._states_column_names()[::-1]: # (states column replaced last, its file telling capacity of ring when reopened)
+                column = getattr(self, name)
+                shape = (states_capacity,) + column.shape[1:]
+                if memmap:
+                    fname = self.folder_ + name[:-1] + ".npy"
+                    grown = np.lib.format.open_memmap(fname + ".grown", mode="w+", dtype=column.dtype, shape=shape)
+                else:
+                    grown = np.empty(shape, dtype=column.dtype)
+                i = min_id
+                while i < self.states_count_:
+                    j, j_grown = i % self.states_capacity_, i % states_capacity
+                    k = min(self.states_count_ - i, self.states_capacity_ - j, states_capacity - j_grown)
+                    grown[j_grown : j_grown + k] = column[j : j + k]
+                    i += k
+                if memmap:
+                    grown.flush()
+                    del grown
+                    os.replace(fname + ".grown", fname)
+                    grown = np.load(fname, mmap_mode="r+")
+                setattr(self, name, grown)
+        self.states_capacity_ = states_capacity # (otherwise slots equal to ids, columns grown by _reserve)
+
+    def _append_states(self, states, n_transitions=0): # states (and their features if cached) written into states ring, returns id of first of them, transitions referring to overwritten states evicted
+        first_id = self.states_count_
+        n_states = states.shape[0]
+        self._grow_states(n_states, n_transitions)
+        if n_states > self.states_capacity_: # only most recent states fit
+            states = states[-self.states_capacity_:]
+            self.states_count_ += n_states - self.states_capacity_
+            n_states = self.states_capacity_
+        self._reserve(self._states_column_names(), self.states_capacity_, min(self.states_count_ % self.states_capacity_ + n_states, self.states_capacity_)) # growth only until first wraparound
+        states_values = [states]
+        if self.transformer_ is not None:
+            states_values += [self._transform(states), np.full(n_states, self.transformer_version_, dtype=np.int32)]
+        self._write([getattr(self, name) for name in self._states_column_names()], states_values, self.states_count_ % self.states_capacity_, self.states_capacity_)
+        self.states_count_ += n_states
+        self._evict(self.states_count_ - self.states_capacity_)
+        return first_id
+
+    def _append_transitions(self, state_ids, next_state_ids, actions, rewards, terminals, priorities=None): # transitions referring to states (already appended) by ids, those referring to overwritten states skipped
+        if priorities is None:
+            priorities = self.max_priority_ if self.tree_ is not None else 0.0
+        priorities = np.broadcast_to(priorities, actions.shape)
+        keep = state_ids >= self.states_count_ - self.states_capacity_
+        if not np.all(keep):
+            state_ids, next_state_ids, actions, rewards, terminals, priorities = state_ids[keep], next_state_ids[keep], actions[keep], rewards[keep], terminals[keep], priorities[keep]
+        n = actions.shape[0]
+        if n == 0:
+            return
+        if n > self.capacity_: # only most recent transitions fit
+            state_ids, next_state_ids, actions, rewards, terminals, priorities = state_ids[-self.capacity_:], next_state_ids[-self.capacity_:], actions[-self.capacity_:], rewards[-self.capacity_:], terminals[-self.capacity_:], priorities[-self.capacity_:]
+            n = self.capacity_
+        self._reserve(self._transitions_column_names(), self.capacity_, min(self.head_ + n, self.capacity_)) # growth only until first wraparound (head equal to number of transitions appended till then)
+        i = self.head_
+        transitions_values = [state_ids, next_state_ids, actions, rewards, terminals, priorities]
+        if self.oracle_values_ is not None:
+            transitions_values += [np.full(n, -1, dtype=np.int32), np.zeros((n, self.oracle_values_.shape[1]))] # (to be predicted when first sampled)
+        self._write([getattr(self, name) for name in self._transitions_column_names()], transitions_values, i, self.capacity_)
+        if self.tree_ is not None:
+            self.tree_.update((i + np.arange(n)) % self.capacity_, (priorities + self.eps_)**self.alpha_)
+        self.head_ = (i + n) % self.capacity_
+        self.size_ = min(self.size_ + n, self.capacity_)
+
+    def append(self, states, state_idxs, next_state_idxs, actions, rewards, terminals, priorities=None): # whole episode trajectory (states and transitions indexing them, see EpisodeTrajectory) at once in O(its length)
+        # oldest transitions overwritten if capacity exceeded, or evicted if their states overwritten
+        if actions.shape[0] == 0:
+            return
+        memmap = self.folder_ is not None and self.mode_ != "r"
+        if memmap:
+            self._drop_for_append(states.shape[0], actions.shape[0])
+        first_id = self._append_states(states, actions.shape[0])
+        self._append_transitions(first_id + state_idxs, first_id + next_state_idxs, actions, rewards, terminals, priorities)
+        if memmap: # (header describing appended transitions written together with them)
+            self._write_header()
+
+    def empty_features_batch(self, m): # preallocated arrays for sample_features: features of states and next states (float64 for computations)
+        n_features = self.features_.shape[1]
+        return np.empty((m, n_features)), np.empty((m, n_features))
+
+    def sample_features(self, indexes, out=None): # gathers cached features of states and next states of transitions at indexes of live window (stale rows recomputed first) into out (see empty_features_batch) or new arrays
+        if out is None:
+            out = self.empty_features_batch(indexes.size)
+        X, X_next = out
+        slots = self.slots(indexes)
+        state_slots = self.state_slots(self.state_ids_[slots])
+        next_state_slots = self.state_slots(self.next_state_ids_[slots])
+        both_slots = np.concatenate((state_slots, next_state_slots))
+        stale = np.unique(both_slots[self.features_versions_[both_slots] != self.transformer_version_])
+        if stale.size > 0:
+            self.features_[stale] = self._transform(self.states_[stale])
+            self.features_versions_[stale] = self.transformer_version_
+        X[:] = self.features_[state_slots]
+        X_next[:] = self.features_[next_state_slots]
+        return out
+
+    def sample_prioritized(self, m, beta=0.4): # prioritized experience replay: m indexes of live window (stratified draws from sum tree) and importance sampling weights (normalized by max)
+        total = self.tree_.total()
+        us = (np.arange(m) + np.random.rand(m)) * (total / m)
+        np.minimum(us, total * (1.0 - 1e-12), out=us)
+        slots = self.tree_.find(us)
+        weights = (self.size_ * self.tree_.leaves(slots) / total)**(-beta)
+        weights /= np.max(weights)
+        return (slots - (self.head_ - self.size_)) % self.capacity_, weights
+
+    def update_priorities(self, indexes, priorities): # e.g. Bellman errors after fit for transitions at indexes of live window
+        slots = self.slots(indexes)
+        self.priorities_[slots] = priorities
+        if self.tree_ is not None:
+            self.max_priority_ = max(self.max_priority_, np.max(priorities))
+            self.tree_.update(slots, (priorities + self.eps_)**self.alpha_)
+
+    def empty_batch(self, m): # preallocated arrays for sample: states, actions, rewards, next states, terminals
+        return np.empty((m, self.state_size_)), np.empty(m, dtype=np.int8), np.empty(m), np.empty((m, self.state_size_)), np.empty(m, dtype=bool)
+
+    def sample(self, indexes, out=None): # gathers transitions at indexes of live window (see slots), with their states and next states, into out (see empty_batch) or new arrays
+        if out is None:
+            out = self.empty_batch(indexes.size)
+        states, actions, rewards, next_states, terminals = out
+        slots = self.slots(indexes)
+        np.take(self.states_, self.state_slots(self.state_ids_[slots]), axis=0, out=states)
+        np.take(self.actions_, slots, out=actions)
+        np.take(self.rewards_, slots, out=rewards)
+        np.take(self.states_, self.state_slots(self.next_state_ids_[slots]), axis=0, out=next_states)
+        np.take(self.terminals_, slots, out=terminals)
+        return out
@@ -0,0 +1,68 @@
+import numpy as np
+from numba import jit
+from sklearn.base import clone
+
+# FEATURES CONSTANTS
+POLYNOMIAL_PLANS = {} # cache of plans (see polynomial_plan) per transformer parameters and input size
+
+@jit(nopython=True, cache=True)
+def polynomial_features_row_numba(x, parents, variables, out): # monomials of single row x along plan: out[k] = out[parents[k]] * x[variables[k]] (no parent: x[variables[k]], or 1 for bias)
+    for k in range(parents.size):
+        p = parents[k]
+        v = variables[k]
+        if p >= 0:
+            out[k] = out[p] * x[v]
+        elif v >= 0:
+            out[k] = x[v]
+        else:
+            out[k] = 1.0
+
+@jit(nopython=True, cache=True)
+def polynomial_features_numba(X, parents, variables, row, out): # monomials of rows of X along plan (each row computed in float64 buffer row, then written into out of any float type)
+    for i in range(X.shape[0]):
+        polynomial_features_row_numba(X[i], parents, variables, row)
+        for k in range(row.size):
+            out[i, k] = row[k]
+
+def polynomial_plan(transformer, n_features_in): # plan of monomials of sklearn PolynomialFeatures in its column order: for each output column its parent column and variable multiplied
+    # (parent: monomial without one power of its smallest variable, as computed by sklearn itself, hence identical products)
+    key = (str(transformer.get_params()), n_features_in)
+    if key in POLYNOMIAL_PLANS:
+        return POLYNOMIAL_PLANS[key]
+    powers = clone(transformer).fit(np.zeros((1, n_features_in))).powers_
+    columns = {tuple(row): k for k, row in enumerate(powers)}
+    parents = np.full(powers.shape[0], -1, dtype=np.int64)
+    variables = np.full(powers.shape[0], -1, dtype=np.int64)
+    for k, row in enumerate(powers):
+        nonzeros = np.nonzero(row)[0]
+        if nonzeros.size == 0:
+            continue
+        variables[k] = nonzeros[0]
+        if np.sum(row) > 1:
+            parent_row = row.copy()
+            parent_row[nonzeros[0]] -= 1
+            if tuple(parent_row) not in columns:
+                raise ValueError(f"polynomial features without all lower degree monomials (e.g. minimal degree above 1) not supported: {transformer}")
+            parents[k] = columns[tuple(parent_row)]
+    POLYNOMIAL_PLANS[key] = (parents, variables)
+    return parents, variables
+
+class PolynomialEngine: # precompiled counterpart of sklearn PolynomialFeatures (same columns in same order, same values): plan computed once for given input size, transforms into caller-provided outputs
+
+    def __init__(self, transformer, n_features_in):
+        self.parents_, self.variables_ = polynomial_plan(transformer, n_features_in)
+        self.n_features_in_ = n_features_in
+        self.n_output_features_ = self.parents_.size
+        self.row_ = np.empty(self.n_output_features_)
+
+    def transform_row(self, x, out=None): # features of single row x (n_features_in,) into out (n_output_features,) or new array
+        if out is None:
+            out = np.empty(self.n_output_features_)
+        polynomial_features_row_numba(x, self.parents_, self.variables_, out)
+        return out
+
+    def transform(self, X, out=None, dtype=np.float64): # features of rows of X into out (m, n_output_features) or new array of given dtype (float32 values as if rounded from float64)
+        if out is None:
+            out = np.empty((X.shape[0], self.n_output_features_), dtype=dtype)
+        polynomial_features_numba(X, self.parents_, self.variables_, self.row_, out)
+        return out
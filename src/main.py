@@ -1,17 +1,18 @@
 import defs
-from defs import Car, Obstacle, ParkPlace, Scene 
+from defs import Car, Obstacle, ParkPlace, Scene, VectorizedEnv
 import numpy as np
-import pygame
 import sys
 import time
 import itertools
 import pickle
 from copy import deepcopy
-from qapproximations import QRidgeRegressor, QMLPRegressor, QMLPRegressorShared
+from qapproximations import QRidgeRegressor, QMLPRegressor, QMLPRegressorShared, QBatchPredictor, QPolicy
+from experience import EpisodeTrajectory, ExperienceBuffer, EXPERIENCE_BUFFER_HEADER_FNAME
+from features import PolynomialEngine
 from sklearn.preprocessing import PolynomialFeatures
-import ctypes
 import zipfile as zf
 import os
+import multiprocessing
 
 # ACTIONS-, PARK PLACE-RELATED CONSTANTS
 ACCELERATION_MAGNITUDES_AHEAD = defs.CAR_ACCELERATION_MAGNITUDES_AHEAD
@@ -24,6 +25,11 @@ PARK_PLACE_WIDTH = defs.PARK_PLACE_WIDTH
 
 # MAIN SETTINGS: LEARNING OR TESTING
 LEARNING_ON = False # if False then testing mode
+ROLLOUTS_N_WORKERS = 1 # number of worker processes rolling out episodes between fits (if 1 then episodes run serially in main process), results do not depend on it
+ROLLOUTS_N_ENVS = 1 # number of episodes advanced together by vectorized environment (one batched Q.predict per steering tick) in main process or each worker, if 1 then episodes run one by one
+ASYNC_MAX_POLICY_LAG = 0 # if positive then rollouts of episodes run ahead on worker processes while Q is fitted, with Q snapshot lagging at most this many fits behind learner (fits overlap with data collection), if 0 then synchronous
+# (pipelined on fixed fit schedule, not free-running learner: still one fit per QL_FIT_GAP_EPISODES episodes, each overlapping rollouts of chunks started ahead, so fit throughput still tied to episode throughput)
+HEADLESS = False # if True then no rendering modules imported and no display initialized (animation episodes become no-ops), e.g. for batch nodes or worker processes
 TEST_MODEL_NAME = "0726961302" # string name equal to hash code e.g. "2354513149"(without "_q.bin" suffix)
 TEST_SCENE_FUNCTION_NAME = None # if None then equivalent to QL_SCENE_FUNCTION_NAME 
 TEST_RANDOM_SEED = 1
@@ -34,7 +40,18 @@ TEST_EPS = 0.0
 FOLDER_MODELS = "../models/"
 FOLDER_MODELS_ZIPPED = "../models_zipped/"
 FOLDER_EXTRAS = "../extras/"
+FOLDER_EXPERIENCE = "../experience/"
 EXPERIENCE_BUFFER_MAX_SIZE = int(5 * 10**7)
+PER_ON = False # prioritized experience replay (sum tree over Bellman errors, importance sampling weights passed to Q.fit, MLP approximators then requiring scikit-learn >= 1.7), if False then uniform replay
+PER_ALPHA = 0.6 # draws proportional to (Bellman error + PER_EPS)**PER_ALPHA
+PER_BETA = 0.4 # exponent of importance sampling weights
+PER_EPS = 1e-6
+EXPERIENCE_BUFFER_MEMMAP = False # if True then experience buffer columns memory-mapped onto files in FOLDER_EXPERIENCE + experiment hash (residency managed by OS page cache), buffer found there (restart of same experiment) reopened and continued, not overwritten
+EXPERIENCE_BUFFER_CACHE_FEATURES = False # if True then features (QL_TRANSFORMER, float32) of states and next states cached in experience buffer at append, no transforms at fits
+EXPERIENCE_BUFFER_CACHE_ORACLE_VALUES = False # if True then Q_oracle predictions for next states cached per transition in experience buffer, recomputed only for transitions new since last switch (or slow update) of Q_oracle
+# (memory cost: one float64 per action and int32 version per transition, i.e. 76 B for 9 actions, about 3.8 GB at EXPERIENCE_BUFFER_MAX_SIZE of 5e7, allocated up front if memory-mapped)
+EXPERIENCE_BUFFER_SNAPSHOT = False # if True then experience buffer saved at end of learning (FOLDER_EXPERIENCE + experiment hash + "_eb.zip", full buffer, possibly many GB) and loaded at start of incremental learning (snapshot of QL_INITIAL_MODEL_NAME, if present)
+EXPERIENCE_BUFFER_SNAPSHOT_COMPRESSED = False # if True then snapshot chunks deflated (smaller file, slower save and load)
 LEARNING_QUALITY_OBSERVATIONS_EMAS_DECAY = 0.995
 DEMO_TITLE_LINE_1 = None 
 DEMO_TITLE_LINE_2 = None 
@@ -164,9 +181,19 @@ def experiment_params():
     for key in dir(defs):
         if key.startswith("CONST_") or key.startswith("CAR_") or key.startswith("PARK_PLACE_") or key.startswith("REWARD_"):
             params["DEFS_" + key] = getattr(defs, key)        
+        if key.startswith("SIMULATION_") and getattr(defs, key): # simulation modes hashed only when on (hashes of former experiments kept)
+            params["DEFS_" + key] = getattr(defs, key)
     for key, value in globals().items():
         if key.startswith("QL_"):
             params[key] = value
+        if key.startswith("ASYNC_") and value: # asynchronous mode hashed only when on (hashes of former experiments kept)
+            params[key] = value
+        if key.startswith("PER_") and PER_ON: # prioritized experience replay hashed only when on
+            params[key] = value
+        if key == "EXPERIENCE_BUFFER_CACHE_FEATURES" and value: # (features rounded to float32)
+            params[key] = value
+        if key == "EXPERIENCE_BUFFER_SNAPSHOT" and value and QL_INITIAL_MODEL_NAME: # (incremental learning starting from former experience)
+            params[key] = value
     keys = list(params.keys())
     keys.sort()
     params_sorted = {key: params[key] for key in keys}
@@ -202,6 +229,31 @@ def unpickle_all(fname):
     print(f"UNPICKLE DONE. [time: {t2 - t1} s]")
     return some_list
 
+def save_experience(fname, eb):
+    print(f"SAVE EXPERIENCE... [{fname}, size: {eb.size_}]")
+    t1 = time.time()
+    os.makedirs(os.path.dirname(fname), exist_ok=True)
+    eb.save(fname, compressed=EXPERIENCE_BUFFER_SNAPSHOT_COMPRESSED)
+    t2 = time.time()
+    print(f"SAVE EXPERIENCE DONE. [time: {t2 - t1} s, file size: {os.path.getsize(fname) / 2**20:.1f} MB]")
+
+def load_experience(fname, eb):
+    print(f"LOAD EXPERIENCE... [{fname}]")
+    t1 = time.time()
+    eb.load(fname)
+    t2 = time.time()
+    print(f"LOAD EXPERIENCE DONE. [time: {t2 - t1} s, size: {eb.size_}]")
+
+def open_experience(folder, state_size): # memory-mapped experience buffer left by former run of same experiment reopened for continuation
+    print(f"OPEN EXPERIENCE... [{folder}]")
+    t1 = time.time()
+    eb = ExperienceBuffer.open(folder, mode="r+")
+    if eb.state_size_ != state_size:
+        raise ValueError(f"state size in experience buffer {folder}: {eb.state_size_} does not match state size: {state_size}")
+    t2 = time.time()
+    print(f"OPEN EXPERIENCE DONE. [time: {t2 - t1} s, size: {eb.size_}, capacity: {eb.capacity_}]")
+    return eb
+
 def zip_models():
     print(f"ZIP MODELS...")
     t1 = time.time()
@@ -222,6 +274,15 @@ def zip_models():
     t2 = time.time()
     print(f"ZIP MODELS DONE. [time: {t2 - t1} s]")         
 
+pygame = None # rendering module, imported on demand (see import_pygame)
+
+def import_pygame():
+    global pygame
+    if pygame is None:
+        import pygame as pygame_module
+        pygame = pygame_module
+    return pygame
+
 def draw_dashed_line(surface, color, start_pos, end_pos, dash_length=4):
     x1, y1 = start_pos
     x2, y2 = end_pos
@@ -306,7 +367,7 @@ def draw_scene(screen, scene, time_elapsed, Q_pred):
     car = scene.car_    
     # car trace (history)
     trace_seconds_back = 25.0
-    trace_back = min(int(np.round(trace_seconds_back * 1.0 / QL_DT)), len(car.x_history_))
+    trace_back = min(int(np.round(trace_seconds_back * 1.0 / QL_DT)), len(car.x_fl_history_)) # no trace if only positions memorized
     for i in range(1, trace_back):
         i_new = -i
         i_old = -(i + 1)
@@ -682,6 +743,232 @@ def scene_pp_middle_obstacles_oppdist_05_side_10_angle_pi():
     scene = Scene(car, park_place, obstacles)
     return scene 
 
+def epsilon(epi): # epsilon for epsilon-greedy policy at given episode of learning
+    return max(QL_EPS_MIN, QL_EPS_MAX - epi / (QL_EPS_MIN_AT_EPISODE - 1) * (QL_EPS_MAX - QL_EPS_MIN))
+
+def run_episode(epi_seed, scene_function, Q, eps, learning, epi_animate=False, manual_steering=False, screen=None, clock=None, policy=None): # single episode (scene and all random choices determined by epi_seed), returns: experience, outcome, observations and final state of random generator
+    np.random.seed(epi_seed)
+    scene = scene_function()
+    dt_since_action = QL_DT * QL_STEERING_GAP_STEPS
+    car = scene.car_
+    if not epi_animate:
+        car.reset_history(corners=False) # trace of corners needed only for drawing
+    state = car.get_state()
+    next_state = None
+    if policy is None and Q is not None: # (callers running many episodes pass policy built once per model)
+        policy = QPolicy(Q, QL_TRANSFORMER, state.size)
+    t1 = time.time()
+    t2 = None
+    time_elapsed = 0.0
+    frame = 0
+    rewards_total = 0.0
+    rewards_count = 0        
+    distances_total = 0.0
+    epi_trajectory = EpisodeTrajectory(int(2 * QL_EPISODE_TIME_LIMIT / QL_DT), state.size)
+    state_frame = 0
+    state_idx = -1 # index of state in episode trajectory (-1 if not stored yet)
+    collect_next_experience = False
+    collect_next_reward = False
+    antistuck_nudge_ongoing = False
+    antistuck_nudge_count = 0
+    while True: # loop (simulation) for current episode
+        time_elapsed = frame * QL_DT
+        time_remaining = QL_EPISODE_TIME_LIMIT - time_elapsed                                        
+        epi_stop_condition = car.parked_ or car.collided_ or time_elapsed >= QL_EPISODE_TIME_LIMIT                                                     
+        steering_now = frame % QL_STEERING_GAP_STEPS == 0
+        if learning:
+            if (steering_now and collect_next_experience) or epi_stop_condition:
+                next_state = car.get_state()
+                action = ACTION_PAIRS_INDEXER[tuple(action_pair)]
+                terminal = car.parked_ or car.collided_
+                if state_idx < 0:
+                    state_idx = epi_trajectory.add_state(state_frame, state)
+                next_state_idx = epi_trajectory.add_state(frame, next_state) # (same frame as state at this steering, stored once)
+                epi_trajectory.add(state_idx, action, car.reward_, next_state_idx, terminal)
+                if False and terminal: # additional experiences (currently off) for terminal states -> no matter what action taken in them, the next state and reward stay the same (for targets preparation purposes in ML)
+                    for a in range(len(ACTION_PAIRS)):
+                        epi_trajectory.add(next_state_idx, a, car.reward_, next_state_idx, terminal)
+        if (steering_now and collect_next_reward) or epi_stop_condition:                        
+            rewards_total += car.reward_
+            rewards_count += 1                
+        if epi_stop_condition:
+            if epi_animate:
+                draw_scene(screen, scene, time_elapsed, None)
+                pygame.display.flip()                     
+                time.sleep(1.0)
+                pygame.quit()
+            t2 = time.time()
+            break
+        if steering_now and not antistuck_nudge_ongoing:
+            state = car.get_state()
+            state_frame = frame
+            state_idx = -1
+            collect_next_reward = True
+            if learning:
+                collect_next_experience = np.random.rand() < QL_COLLECT_EXPERIENCE_PROBABILITY
+            if Q is None:
+                Q_pred = None
+            else:
+                Q_pred, greedy_action_index = policy.act(state)
+        if epi_animate:
+            clock.tick(QL_FPS)                                    
+            # handling UI events
+            while_break = False
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    sys.exit(0)
+                if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                    while_break = True
+            if while_break:
+                break         
+            if steering_now and manual_steering:                   
+                keys = pygame.key.get_pressed()
+                action_pair = [0, 0] # first: ahead or back, second: right or left 
+                if keys[pygame.K_UP]:
+                    action_pair[0] = 1
+                elif keys[pygame.K_DOWN]:
+                    action_pair[0] = -1
+                if keys[pygame.K_RIGHT]:
+                    action_pair[1] = 1                
+                elif keys[pygame.K_LEFT]:
+                    action_pair[1] = -1                                
+        if steering_now and not manual_steering:
+            if antistuck_nudge_ongoing:
+                antistuck_nudge_steering_steps -= 1
+                if antistuck_nudge_steering_steps == 0:
+                    antistuck_nudge_ongoing = False
+            else:   
+                action_index = np.random.choice(len(ACTION_PAIRS)) # random action
+                if Q_pred is not None and (np.random.rand() <= 1.0 - eps or epi_animate):                    
+                    action_index = greedy_action_index # greedy action
+                action_pair = ACTION_PAIRS[action_index]                                                                                                                                                              
+        # applying action (Q-driven or manual) from such last step where steering took place 
+        if action_pair[0] > 0:
+            car.accelerate_ahead(ACCELERATION_MAGNITUDES_AHEAD[action_pair[0]])
+        elif action_pair[0] < 0:
+            car.accelerate_back(ACCELERATION_MAGNITUDES_BACK[-action_pair[0]])            
+        if action_pair[1] > 0:
+            car.accelerate_right(ACCELERATION_MAGNITUDES_SIDE[action_pair[1]])
+        elif action_pair[1] < 0:
+            car.accelerate_left(ACCELERATION_MAGNITUDES_SIDE[-action_pair[1]])                
+        if epi_animate:  
+            draw_scene(screen, scene, time_elapsed, Q_pred)
+            pygame.display.flip()                                         
+        if QL_ANTISTUCK_NUDGE and steering_now and not manual_steering and not antistuck_nudge_ongoing: # random nudge (if not yet parked, and not about to move, do random acceleration ahead or back)                        
+            if car.v_magnitude_ == 0.0 and car.a_magnitude_ == 0.0 or car.is_stuck(QL_DT):
+                non_side_acceleration_indexes = np.array([ACTION_PAIRS_INDEXER[(-1, 0)], ACTION_PAIRS_INDEXER[(1, 0)]])
+                action_index = np.random.choice(non_side_acceleration_indexes)
+                action_pair = ACTION_PAIRS[action_index]
+                antistuck_nudge_ongoing = True
+                antistuck_nudge_steering_steps = QL_ANTISTUCK_NUDGE_STEERING_STEPS
+                antistuck_nudge_count += 1        
+                # print(f"[antistuck nudge: {antistuck_nudge_count}]") 
+        if epi_animate:
+            car.step(QL_DT, dt_since_action, time_remaining, scene.obstacles_, scene.park_place_)
+            distances_total += car.distance_
+            frame += 1
+        else: # all frames up to next steering in one compiled call
+            n_frames = QL_STEERING_GAP_STEPS - frame % QL_STEERING_GAP_STEPS
+            n_performed, distances, _, _, _ = car.advance(action_pair, n_frames, frame, QL_DT, dt_since_action, QL_EPISODE_TIME_LIMIT, scene.obstacles_, scene.park_place_)
+            distances_total += distances
+            frame += n_performed
+        t2 = time.time()            
+        time_elapsed = t2 - t1                           
+    epi_outcome_str = "time_exceeded"
+    if car.collided_:
+        epi_outcome_str = "collision"
+    elif car.parked_:
+        epi_outcome_str= "parked"
+    return epi_trajectory.experience(), epi_outcome_str, frame, car.reward_, rewards_total, rewards_count, distances_total, t2 - t1, np.random.get_state()
+
+def run_episodes_vectorized(epi_seeds, scene_function, Q, epss, learning, n_envs): # episodes run together in vectorized environment (one transform and one predict per steering tick for all cars steered), results as for run_episode in episode order
+    n_envs = min(n_envs, len(epi_seeds))
+    env = VectorizedEnv(scene_function, n_envs, ACTION_PAIRS, QL_DT, QL_STEERING_GAP_STEPS, QL_EPISODE_TIME_LIMIT, QL_ANTISTUCK_NUDGE_STEERING_STEPS if QL_ANTISTUCK_NUDGE else 0)
+    results = [None] * len(epi_seeds)
+    epis = np.arange(n_envs) # indexes of episodes (seeds) currently in environments
+    rewards_totals = np.zeros(n_envs)
+    rewards_counts = np.zeros(n_envs, dtype=np.int64)
+    collect_next_experience = np.zeros(n_envs, dtype=bool)
+    collect_next_reward = np.zeros(n_envs, dtype=bool)
+    states = [None] * n_envs # states at last steering (as long as no antistuck nudge ongoing)
+    state_frames = np.zeros(n_envs, dtype=np.int64)
+    state_idxs = np.full(n_envs, -1, dtype=np.int64) # indexes of states in episode trajectories (-1 if not stored yet)
+    Q_preds = np.zeros((n_envs, len(ACTION_PAIRS)))
+    t1s = np.zeros(n_envs)
+    env.reset(epi_seeds[:n_envs])
+    state_size = env.get_states([0]).shape[1]
+    epi_trajectories = [EpisodeTrajectory(int(2 * QL_EPISODE_TIME_LIMIT / QL_DT), state_size) for _ in range(n_envs)]
+    engine = PolynomialEngine(QL_TRANSFORMER, state_size) # (features as QL_TRANSFORMER)
+    t1s[:] = time.time()
+    next_epi = n_envs
+    while np.any(env.live_):
+        # experiences, rewards and finished episodes (replaced by next ones)
+        for i in np.where(env.live_)[0]:
+            car = env.scenes_[i].car_
+            epi_stop_condition = env.dones_[i]
+            if learning and (collect_next_experience[i] or epi_stop_condition):
+                if state_idxs[i] < 0:
+                    state_idxs[i] = epi_trajectories[i].add_state(state_frames[i], states[i])
+                next_state_idx = epi_trajectories[i].add_state(env.frames_[i], car.get_state())
+                epi_trajectories[i].add(state_idxs[i], env.actions_[i], car.reward_, next_state_idx, car.parked_ or car.collided_)
+            if collect_next_reward[i] or epi_stop_condition:
+                rewards_totals[i] += car.reward_
+                rewards_counts[i] += 1
+            if epi_stop_condition:
+                epi_outcome_str = "collision" if car.collided_ else ("parked" if car.parked_ else "time_exceeded")
+                results[epis[i]] = (epi_trajectories[i].experience(), epi_outcome_str, int(env.frames_[i]), car.reward_, rewards_totals[i], int(rewards_counts[i]), env.distances_[i], 
+                                    time.time() - t1s[i], env.rngs_[i].get_state())
+                if next_epi < len(epi_seeds):
+                    env.reset_env(i, epi_seeds[next_epi])
+                    epis[i] = next_epi
+                    next_epi += 1
+                    epi_trajectories[i] = EpisodeTrajectory(int(2 * QL_EPISODE_TIME_LIMIT / QL_DT), state_size)
+                    rewards_totals[i] = 0.0
+                    rewards_counts[i] = 0
+                    collect_next_experience[i] = False
+                    collect_next_reward[i] = False
+                    t1s[i] = time.time()
+                else:
+                    env.live_[i] = False
+        # steering: one transform and one predict for all cars not being nudged
+        steered = np.where(env.live_ & (env.nudge_steps_ == 0))[0]
+        for i in steered:
+            states[i] = env.scenes_[i].car_.get_state()
+            state_frames[i] = env.frames_[i]
+            state_idxs[i] = -1
+            collect_next_reward[i] = True
+            if learning:
+                collect_next_experience[i] = env.rngs_[i].rand() < QL_COLLECT_EXPERIENCE_PROBABILITY
+        if Q is not None and steered.size > 0:
+            X_states = engine.transform(np.array([states[i] for i in steered]))
+            Q_preds[steered] = Q.predict(X_states)
+        action_indexes = np.copy(env.actions_)
+        for i in steered:
+            rng = env.rngs_[i]
+            action_indexes[i] = rng.choice(len(ACTION_PAIRS)) # random action
+            if Q is not None and rng.rand() <= 1.0 - epss[epis[i]]:
+                action_indexes[i] = np.argmax(Q_preds[i]) # greedy action
+        env.step(action_indexes)
+    return results
+
+def run_episodes(epi_seeds, scene_function_name, Q, epss, learning, n_envs=1): # rollout task (e.g. for worker process): consecutive episodes against its own (read-only) copy of Q, one by one or in vectorized environment
+    scene_function = globals()["scene_" + scene_function_name]
+    if n_envs > 1:
+        return run_episodes_vectorized(epi_seeds, scene_function, Q, epss, learning, n_envs)
+    policy = QPolicy(Q, QL_TRANSFORMER) if Q is not None else None # (one per task, Q fixed meanwhile)
+    return [run_episode(epi_seed, scene_function, Q, eps, learning, policy=policy) for epi_seed, eps in zip(epi_seeds, epss)]
+
+def start_rollouts(pool, n_workers, epi_seeds, scene_function_name, Q, epss, learning, n_envs=1): # episodes split into contiguous slices over workers, returns async result (see finish_rollouts)
+    # only overlap with learner: main process keeps fitting Q on its schedule (one fit per chunk collected) while these rollouts run, i.e. at most ASYNC_MAX_POLICY_LAG fits overlap them (one fit per rollout chunk for lag 1)
+    Q = deepcopy(Q) # snapshot (tasks are pickled asynchronously, while Q may be already refitted)
+    slices = [sl for sl in np.array_split(np.arange(len(epi_seeds)), n_workers) if sl.size > 0]
+    tasks = [([epi_seeds[i] for i in sl], scene_function_name, Q, [epss[i] for i in sl], learning, n_envs) for sl in slices]
+    return pool.starmap_async(run_episodes, tasks)
+
+def finish_rollouts(async_result): # waits for rollouts, results in episode order (independent of number of workers)
+    # learner idle while waiting here (no extra fits on replay buffer meanwhile, keeping runs deterministic)
+    return [result for results in async_result.get() for result in results]
+
 # MAIN
 if __name__ == "__main__":
             
@@ -694,19 +981,20 @@ if __name__ == "__main__":
         print(f"EXPERIMENT MODE: " + ("LEARNING" if LEARNING_ON else f"TESTING [test model name: {TEST_MODEL_NAME}, test scene function name: {TEST_SCENE_FUNCTION_NAME}]"))
     print(f"EXPERIMENT PARAMETERS:\n {dict_to_str(experiment_params())}")
     
-    if SCREEN_RESOLUTION_DPI_AWARE:
+    if SCREEN_RESOLUTION_DPI_AWARE and not HEADLESS:
+        import ctypes
         ctypes.windll.user32.SetProcessDPIAware()
     
     t1_main = time.time()    
     if LEARNING_ON:
         np.random.seed(QL_RANDOM_SEED)
         n_episodes = QL_N_EPISODES        
-        animation_on = QL_ANIMATION_ON
+        animation_on = QL_ANIMATION_ON and not HEADLESS
         animation_frequency = QL_ANIMATION_FREQUENCY                
     else:
         np.random.seed(TEST_RANDOM_SEED)
         n_episodes = TEST_N_EPISODES
-        animation_on = TEST_ANIMATION_ON
+        animation_on = TEST_ANIMATION_ON and not HEADLESS
         animation_frequency = 1         
     seed_dtype = np.int32    
     epi_seeds = np.random.randint(low=0, high=np.iinfo(seed_dtype).max, dtype=seed_dtype, size=n_episodes)
@@ -735,9 +1023,6 @@ if __name__ == "__main__":
               "mse_batch_after": [], 
               "r2_batch_before": [], 
               "r2_batch_after": []} 
-    eb = np.empty((EXPERIENCE_BUFFER_MAX_SIZE, 6), dtype=object) # state, action, reward, next state, is next state terminal, Bellman error
-    eb_size = 0
-    eb_size_old = 0
     if not LEARNING_ON and TEST_MODEL_NAME:
         [Q] = unpickle_all(FOLDER_MODELS + TEST_MODEL_NAME + "_q.bin")  
     elif LEARNING_ON and QL_INITIAL_MODEL_NAME:
@@ -745,17 +1030,35 @@ if __name__ == "__main__":
         first_fit_done = True
         Q_oracle = deepcopy(Q)
 
-    eps = QL_EPS_MAX    
     scene = scene_function()
     state = scene.car_.get_state() # fake state to 'warm up' transformer
     QL_TRANSFORMER.fit_transform(np.array([state]))
     n = QL_TRANSFORMER.n_output_features_    
+    engine = PolynomialEngine(QL_TRANSFORMER, state.size) # compiled features as QL_TRANSFORMER (same columns and values), with plan computed once
+    eb_folder = FOLDER_EXPERIENCE + ehs + "/" if LEARNING_ON and EXPERIENCE_BUFFER_MEMMAP else None
+    if eb_folder is not None and os.path.exists(eb_folder + EXPERIENCE_BUFFER_HEADER_FNAME):
+        eb = open_experience(eb_folder, state.size) # (prioritization and caches below reapplied to reopened buffer)
+    else:
+        eb = ExperienceBuffer(EXPERIENCE_BUFFER_MAX_SIZE, state.size, folder=eb_folder)
+    if PER_ON:
+        eb.prioritize(PER_ALPHA, PER_EPS)
+    batch = eb.empty_batch(QL_FIT_BATCH_SIZE) if LEARNING_ON else None
+    if LEARNING_ON and EXPERIENCE_BUFFER_CACHE_FEATURES:
+        eb.cache_features(QL_TRANSFORMER, engine)
+    features_batch = (np.empty((QL_FIT_BATCH_SIZE, n)), np.empty((QL_FIT_BATCH_SIZE, n))) if LEARNING_ON else None
+    if LEARNING_ON and EXPERIENCE_BUFFER_CACHE_ORACLE_VALUES:
+        eb.cache_oracle_values(len(ACTION_PAIRS))
+    q_predictor = QBatchPredictor() if LEARNING_ON else None
+    if LEARNING_ON and QL_INITIAL_MODEL_NAME and EXPERIENCE_BUFFER_SNAPSHOT and eb.size_ == 0 and os.path.exists(FOLDER_EXPERIENCE + QL_INITIAL_MODEL_NAME + "_eb.zip"): # (reopened buffer holding snapshot already)
+        load_experience(FOLDER_EXPERIENCE + QL_INITIAL_MODEL_NAME + "_eb.zip", eb)
     print(f"FEATURES IN STATE REPRESENTATION: {n}")
     epi_disp_separator = "-" * 256
-    dt_since_action = QL_DT * QL_STEERING_GAP_STEPS
 
     # INTRO
+    screen = None
+    clock = None
     if animation_on:
+        import_pygame()
         pygame.init()
         icon = pygame.image.load("./../img/icon.png")
         pygame.display.set_icon(icon)
@@ -767,177 +1070,67 @@ if __name__ == "__main__":
         input("[press enter to start]")
     
     # LOOP OVER EPISODES
+    pool = multiprocessing.Pool(ROLLOUTS_N_WORKERS) if ROLLOUTS_N_WORKERS > 1 or ASYNC_MAX_POLICY_LAG > 0 else None
+    rollouts = {}
+    rollouts_pending = {} # first episode of chunk -> (episodes, async result) 
+    policy = None # greedy policy of Q for episodes run in this process
     for epi in range(n_episodes):        
         t1_loop_body = time.time()
         epi_seed = epi_seeds[epi]
-        np.random.seed(epi_seed)
+        eps = epsilon(epi) if LEARNING_ON else TEST_EPS
         epi_title = f"CAR PARKING Q-LEARNING, EPISODE: {epi + 1}/{n_episodes}... " + (f"[epsilon: {eps}, seed: {epi_seed}]" if LEARNING_ON else f"[seed: {epi_seed}]")             
-        epi_animate = False
-        scene = scene_function()
-        if animation_on and epi % animation_frequency == 0:
+        epi_animate = animation_on and epi % animation_frequency == 0
+        if (pool is not None or ROLLOUTS_N_ENVS > 1) and epi % QL_FIT_GAP_EPISODES == 0: # episodes up to next fit (Q fixed meanwhile), except animated ones, rolled out by worker processes and/or vectorized environments
+            for epi_chunk in range(epi, min(epi + (ASYNC_MAX_POLICY_LAG + 1) * QL_FIT_GAP_EPISODES, n_episodes), QL_FIT_GAP_EPISODES): # next chunks started ahead with current Q (policy lag)
+                if epi_chunk not in rollouts_pending:
+                    epis = [e for e in range(epi_chunk, min(epi_chunk + QL_FIT_GAP_EPISODES, n_episodes)) if not (animation_on and e % animation_frequency == 0)]
+                    epss = [epsilon(e) if LEARNING_ON else TEST_EPS for e in epis]
+                    if pool is not None:
+                        rollouts_pending[epi_chunk] = (epis, start_rollouts(pool, ROLLOUTS_N_WORKERS, epi_seeds[epis], scene_function_name, Q, epss, LEARNING_ON, ROLLOUTS_N_ENVS))
+                    else:
+                        rollouts_pending[epi_chunk] = (epis, run_episodes(epi_seeds[epis], scene_function_name, Q, epss, LEARNING_ON, ROLLOUTS_N_ENVS))
+            epis, results = rollouts_pending.pop(epi)
+            print(f"[rollouts of {len(epis)} episodes; workers: {ROLLOUTS_N_WORKERS}, environments per worker: {ROLLOUTS_N_ENVS}, max policy lag: {ASYNC_MAX_POLICY_LAG}...]")
+            t1_rollouts = time.time()
+            if pool is not None:
+                results = finish_rollouts(results)
+            rollouts = dict(zip(epis, results))
+            t2_rollouts = time.time()
+            print(f"[rollouts done; time waited: {t2_rollouts - t1_rollouts} s]")
+        if epi_animate:
             pygame.init()
             icon = pygame.image.load("./../img/icon.png")    
             pygame.display.set_icon(icon)
             screen = pygame.display.set_mode(SCREEN_RESOLUTION)    
             clock = pygame.time.Clock()            
             pygame.display.set_caption(epi_title)
-            epi_animate = True
         manual_steering = epi_animate and not (LEARNING_ON or TEST_MODEL_NAME)
         print(epi_disp_separator + "\n" + epi_title)
         if epi_animate:
             print(f"[animating this episode...]")        
-        car = scene.car_
-        state = car.get_state()
-        next_state = None
-        QL_TRANSFORMER.fit_transform(np.array([state]))
-        t1 = time.time()
-        t2 = None
-        time_elapsed = 0.0
-        frame = 0
-        rewards_total = 0.0
-        rewards_count = 0        
-        distances_total = 0.0
-        epi_eb = np.empty((int(2 * QL_EPISODE_TIME_LIMIT / QL_DT), 6), dtype=object)        
-        epi_eb_size = 0        
-        collect_next_experience = False
-        collect_next_reward = False
-        antistuck_nudge_ongoing = False
-        antistuck_nudge_count = 0
-        while True: # loop (simulation) for current episode
-            time_elapsed = frame * QL_DT
-            time_remaining = QL_EPISODE_TIME_LIMIT - time_elapsed                                        
-            epi_stop_condition = car.parked_ or car.collided_ or time_elapsed >= QL_EPISODE_TIME_LIMIT                                                     
-            steering_now = frame % QL_STEERING_GAP_STEPS == 0
-            if LEARNING_ON:
-                if (steering_now and collect_next_experience) or epi_stop_condition:
-                    next_state = car.get_state()
-                    action = ACTION_PAIRS_INDEXER[tuple(action_pair)]
-                    terminal = car.parked_ or car.collided_
-                    experience = np.empty((1, 6), dtype=object)
-                    experience[0, 0] = state
-                    experience[0, 1] = action
-                    experience[0, 2] = car.reward_
-                    experience[0, 3] = next_state                    
-                    experience[0, 4] = terminal 
-                    experience[0, 5] = 0.0 # Bellman error (for the case of prioritized experience replay, updataeble after fits)                   
-                    epi_eb[epi_eb_size] = experience
-                    epi_eb_size += 1
-                    if False and terminal: # additional experiences (currently off) for terminal states -> no matter what action taken in them, the next state and reward stay the same (for targets preparation purposes in ML)
-                        for a in range(len(ACTION_PAIRS)):
-                            experience = np.empty((1, 6), dtype=object)
-                            experience[0, 0] = next_state
-                            experience[0, 1] = a
-                            experience[0, 2] = car.reward_
-                            experience[0, 3] = next_state                    
-                            experience[0, 4] = terminal 
-                            experience[0, 5] = 0.0 # Bellman error (for the case of prioritized experience replay, updataeble after fits)                   
-                            epi_eb[epi_eb_size] = experience
-                            epi_eb_size += 1                                                    
-            if (steering_now and collect_next_reward) or epi_stop_condition:                        
-                rewards_total += car.reward_
-                rewards_count += 1                
-            if epi_stop_condition:
-                if epi_animate:
-                    draw_scene(screen, scene, time_elapsed, None)
-                    pygame.display.flip()                     
-                    time.sleep(1.0)
-                    pygame.quit()
-                t2 = time.time()
-                if car.parked_:
-                    parked_count += 1                    
-                parked_frequency = parked_count / (epi + 1)
-                break
-            if steering_now and not antistuck_nudge_ongoing:
-                state = car.get_state()
-                collect_next_reward = True
-                if LEARNING_ON:
-                    collect_next_experience = np.random.rand() < QL_COLLECT_EXPERIENCE_PROBABILITY
-                if Q is None:
-                    Q_pred = None
-                else:
-                    X_state = QL_TRANSFORMER.fit_transform(np.array([state]))
-                    Q_pred = Q.predict(X_state)[0]             
-            if epi_animate:
-                clock.tick(QL_FPS)                                    
-                # handling UI events
-                while_break = False
-                for event in pygame.event.get():
-                    if event.type == pygame.QUIT:
-                        sys.exit(0)
-                    if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
-                        while_break = True
-                if while_break:
-                    break         
-                if steering_now and manual_steering:                   
-                    keys = pygame.key.get_pressed()
-                    action_pair = [0, 0] # first: ahead or back, second: right or left 
-                    if keys[pygame.K_UP]:
-                        action_pair[0] = 1
-                    elif keys[pygame.K_DOWN]:
-                        action_pair[0] = -1
-                    if keys[pygame.K_RIGHT]:
-                        action_pair[1] = 1                
-                    elif keys[pygame.K_LEFT]:
-                        action_pair[1] = -1                                
-            if steering_now and not manual_steering:
-                if antistuck_nudge_ongoing:
-                    antistuck_nudge_steering_steps -= 1
-                    if antistuck_nudge_steering_steps == 0:
-                        antistuck_nudge_ongoing = False
-                else:   
-                    action_index = np.random.choice(len(ACTION_PAIRS)) # random action
-                    if Q_pred is not None and ((LEARNING_ON and np.random.rand() <= 1.0 - eps) or ((not LEARNING_ON and np.random.rand() <= 1.0 - TEST_EPS) or epi_animate)):                    
-                        action_index = np.argmax(Q_pred) # greedy action
-                    action_pair = ACTION_PAIRS[action_index]                                                                                                                                                              
-            # applying action (Q-driven or manual) from such last step where steering took place 
-            car.accelerations_imposed_ = []
-            if action_pair[0] > 0:
-                car.accelerate_ahead(ACCELERATION_MAGNITUDES_AHEAD[action_pair[0]])
-            elif action_pair[0] < 0:
-                car.accelerate_back(ACCELERATION_MAGNITUDES_BACK[-action_pair[0]])            
-            if action_pair[1] > 0:
-                car.accelerate_right(ACCELERATION_MAGNITUDES_SIDE[action_pair[1]])
-            elif action_pair[1] < 0:
-                car.accelerate_left(ACCELERATION_MAGNITUDES_SIDE[-action_pair[1]])                
-            if epi_animate:  
-                draw_scene(screen, scene, time_elapsed, Q_pred)
-                pygame.display.flip()                                         
-            if QL_ANTISTUCK_NUDGE and steering_now and not manual_steering and not antistuck_nudge_ongoing: # random nudge (if not yet parked, and not about to move, do random acceleration ahead or back)                        
-                if car.v_magnitude_ == 0.0 and car.a_magnitude_ == 0.0 or car.is_stuck(QL_DT):
-                    non_side_acceleration_indexes = np.array([ACTION_PAIRS_INDEXER[(-1, 0)], ACTION_PAIRS_INDEXER[(1, 0)]])
-                    action_index = np.random.choice(non_side_acceleration_indexes)
-                    action_pair = ACTION_PAIRS[action_index]
-                    antistuck_nudge_ongoing = True
-                    antistuck_nudge_steering_steps = QL_ANTISTUCK_NUDGE_STEERING_STEPS
-                    antistuck_nudge_count += 1        
-                    # print(f"[antistuck nudge: {antistuck_nudge_count}]") 
-            car.step(QL_DT, dt_since_action, time_remaining, scene.obstacles_, scene.park_place_)                                                                      
-            distances_total += car.distance_                        
-            frame += 1            
-            t2 = time.time()            
-            time_elapsed = t2 - t1                           
-        epi_outcome_str = "time_exceeded"
-        if car.collided_:
-            epi_outcome_str = "collision"
-        elif car.parked_:
-            epi_outcome_str= "parked"
+        if epi in rollouts:
+            epi_experience, epi_outcome_str, frame, last_reward, rewards_total, rewards_count, distances_total, epi_time, rng_state = rollouts.pop(epi)
+            np.random.set_state(rng_state) # as if episode was run in this process (for batch drawing)
+        else:
+            if Q is not None and (policy is None or policy.Q_ is not Q): # policy built once per model (refits in place seen by it)
+                policy = QPolicy(Q, QL_TRANSFORMER)
+            epi_experience, epi_outcome_str, frame, last_reward, rewards_total, rewards_count, distances_total, epi_time, _ = run_episode(epi_seed, scene_function, Q, eps, LEARNING_ON, epi_animate, manual_steering, screen, clock, policy)
+        parked = epi_outcome_str == "parked"
+        if parked:
+            parked_count += 1                    
+        parked_frequency = parked_count / (epi + 1)
         max_frames = QL_EPISODE_TIME_LIMIT / QL_DT
         fps_observed = 0.0
-        if t2 - t1 > 0.0:
-            fps_observed = frame / (t2 - t1) 
-        print(f"CAR PARKING Q-LEARNING, EPISODE: {epi + 1}/{n_episodes} DONE. [outcome: {epi_outcome_str}, frames performed: {frame}, last reward: {car.reward_}, mean reward: {rewards_total / rewards_count}, mean distance: {distances_total / max_frames}, time: {t2 - t1} s, fps: {fps_observed}]")
+        if epi_time > 0.0:
+            fps_observed = frame / epi_time 
+        print(f"CAR PARKING Q-LEARNING, EPISODE: {epi + 1}/{n_episodes} DONE. [outcome: {epi_outcome_str}, frames performed: {frame}, last reward: {last_reward}, mean reward: {rewards_total / rewards_count}, mean distance: {distances_total / max_frames}, time: {epi_time} s, fps: {fps_observed}]")
         # appending episode experience buffer to whole experience buffer
-        diff = eb_size + epi_eb_size - EXPERIENCE_BUFFER_MAX_SIZE
-        if diff <= 0:
-            eb[eb_size : eb_size + epi_eb_size] = epi_eb[:epi_eb_size]
-        else:            
-            eb = np.r_[eb[diff : eb_size], epi_eb[:epi_eb_size]]
-        eb_size = min(eb_size + epi_eb_size, EXPERIENCE_BUFFER_MAX_SIZE)
-        print(f"[experience size: {eb_size}]")
+        eb.append(*epi_experience)
+        print(f"[experience size: {eb.size_}]")
         # progress of some observations
         rewards_ema = rewards_ema * LEARNING_QUALITY_OBSERVATIONS_EMAS_DECAY + rewards_total / rewards_count * (1.0 - LEARNING_QUALITY_OBSERVATIONS_EMAS_DECAY)
         distances_ema = distances_ema * LEARNING_QUALITY_OBSERVATIONS_EMAS_DECAY + distances_total / max_frames * (1.0 - LEARNING_QUALITY_OBSERVATIONS_EMAS_DECAY)
-        parked_frequency_ema = parked_frequency_ema * LEARNING_QUALITY_OBSERVATIONS_EMAS_DECAY + car.parked_ * (1.0 - LEARNING_QUALITY_OBSERVATIONS_EMAS_DECAY)
+        parked_frequency_ema = parked_frequency_ema * LEARNING_QUALITY_OBSERVATIONS_EMAS_DECAY + parked * (1.0 - LEARNING_QUALITY_OBSERVATIONS_EMAS_DECAY)
         print(f"[parked frequency: {parked_frequency}]")
         print(f"[parked frequency moving average: {parked_frequency_ema}]")        
         print(f"[rewards moving average: {rewards_ema}]")
@@ -950,64 +1143,51 @@ if __name__ == "__main__":
         # learning                    
         if LEARNING_ON and (epi + 1) % QL_FIT_GAP_EPISODES == 0 and (epi + 1) >= QL_FIRST_FIT_AT_EPISODE:
             print(f"[fitting Q...]")
+            eb.flush()
             t1_fit = time.time()            
             m = QL_FIT_BATCH_SIZE                                           
-            print(f"[drawing batch...; eb_size: {eb_size}, batch size: {m}]")            
+            print(f"[drawing batch...; eb_size: {eb.size_}, batch size: {m}]")            
             t1_batch = time.time()
-            # prioritized experience replay (below, inactive now)
-            # eb_range = np.arange(eb_size)
-            # priorities = 1 + np.argsort(np.argsort(experience_buffer[eb_range, 5])) # Bellman errors' ranks as priorities
-            # priorities = eb[eb_range, 5].astype(np.float64) # Bellman errors as priorities
-            # priorities += 1e-6
-            # p = priorities / np.sum(priorities)
-            # indexes = np.random.choice(eb_range, m, p=p) # prioritized experience replay, drawing a random batch according to p distribution
-            indexes = np.random.choice(eb_size, m) # uniform experience replay            
+            weights = None
+            if PER_ON:
+                indexes, weights = eb.sample_prioritized(m, PER_BETA) # prioritized experience replay (sum tree), with importance sampling weights for fit
+            else:
+                indexes = np.random.choice(eb.size_, m) # uniform experience replay            
             t2_batch = time.time()
             print(f"[drawing batch done; time: {t2_batch - t1_batch} s]")            
             # preparing targets
             print(f"[preparing targets on batch...]")
             t1_targets = time.time()            
-            eb_batch = eb[indexes]
+            states, actions_batch, rewards_batch, next_states, terminals = eb.sample(indexes, batch)
             eb_batch_range = np.arange(m)
-            states = np.array(list(eb_batch[:, 0]))          
-            X_batch = QL_TRANSFORMER.fit_transform(states)
+            if EXPERIENCE_BUFFER_CACHE_FEATURES:
+                X_batch, X_batch_next = eb.sample_features(indexes, features_batch)
+            else:
+                X_batch = engine.transform(states, out=features_batch[0])
+                X_batch_next = engine.transform(next_states, out=features_batch[1])
             # preliminary vectors of targets for all actions - its particular positions (related to actions taken) shall be prepared using Bellman equation 
             qs = np.zeros((m, len(ACTION_PAIRS)), dtype=np.float64)            
             if False and first_fit_done: # change first condition to False for non-shared architecture of Q-model (preliminary predict unnecessary then)
                 qs = Q.predict(X_batch)                
             y_batch = np.copy(qs)                                                    
-            next_states = np.array(list(eb_batch[:, 3]))
-            X_batch_next = QL_TRANSFORMER.fit_transform(next_states)
-            qns_oracle = np.zeros((m, len(ACTION_PAIRS)))
-            if Q_oracle is not None:
-                qns_oracle = Q_oracle.predict(X_batch_next)    
-            qns = np.zeros((m, len(ACTION_PAIRS)))                        
-            if first_fit_done:
-                qns = Q.predict(X_batch_next)                                                            
-            actions_batch = eb_batch[:, 1].astype(int)
-            rewards_batch = eb_batch[:, 2].astype(np.float64)
-            terminals_batch = np.where(eb_batch[:, 4] == 1)[0]
-            rewards_on_terminals_batch = np.array([rewards_batch[terminals_batch]]).T
-            qns[terminals_batch, :] = rewards_on_terminals_batch # "virtual" next states preserve rewards of terminals until end of episode (for discounted next max in Bellman equation) 
-            qns_oracle[terminals_batch, :] = rewards_on_terminals_batch # "virtual" next states preserve rewards of terminals until end of episode (for discounted next max in Bellman equation)
-            qns_argmaxes = np.argmax(qns, axis=1)      
-            qns_maxes = qns_oracle[eb_batch_range, qns_argmaxes]                                                                        
+            qns_oracle = None
+            if Q_oracle is not None and EXPERIENCE_BUFFER_CACHE_ORACLE_VALUES:
+                qns_oracle, n_predicted = eb.sample_oracle_values(indexes, X_batch_next, lambda X: q_predictor.predict(Q_oracle, X))
+                print(f"[Q_oracle predictions: {n_predicted} new, {m - n_predicted} cached]")
+            # predictions of Q on batch (before fit) and Double DQN next maxes (argmaxes by Q, values by Q_oracle) in one chunked pass, 
+            # "virtual" next states preserve rewards of terminals until end of episode (for discounted next max in Bellman equation)
+            y_pred, qns_argmaxes, qns_maxes = q_predictor.targets(Q if first_fit_done else None, Q_oracle, X_batch, X_batch_next, rewards_batch, terminals, len(ACTION_PAIRS), qns_oracle)
+            actions_batch = actions_batch.astype(int)
             y = rewards_batch + QL_GAMMA * qns_maxes
             y_batch[eb_batch_range, actions_batch] = y                        
-            y_pred = np.zeros((m, len(ACTION_PAIRS)))
-            if first_fit_done:
-                y_pred = Q.predict(X_batch)
             maes_batch_before = np.abs(y_pred[eb_batch_range, actions_batch] - y_batch[eb_batch_range, actions_batch])            
             mse_batch_before = np.mean(maes_batch_before**2)
             sse_batch_before = np.sum(maes_batch_before**2)
             v_batch = np.sum((y_batch[eb_batch_range, actions_batch] - np.mean(y_batch[eb_batch_range, actions_batch]))**2)
             fvu_batch_before = sse_batch_before / v_batch
             r2_batch_before = 1.0 - fvu_batch_before
-            # prioritized experience replay (below, inactive now)
-            # u_indexes = np.unique(indexes)
-            # for u_index in u_indexes:
-            #     u_index_where = np.where(u_indexes == u_index)[0][0]                    
-            #     eb[u_index, 5] = maes_batch_before[u_index_where]            
+            if PER_ON:
+                eb.update_priorities(indexes, maes_batch_before) # Bellman errors as priorities
             t2_targets = time.time()
             print(f"[preparing targets on batch done; time: {t2_targets - t1_targets} s]")
             print(f"[mse on batch before fit: {mse_batch_before}]")
@@ -1018,9 +1198,9 @@ if __name__ == "__main__":
             if Q is None and Q_oracle is None:                    
                 Q = QL_APPROXIMATOR
                 Q_oracle = None
-            Q.fit(X_batch, y_batch, actions_batch)                        
+            Q.fit(X_batch, y_batch, actions_batch, sample_weight=weights)                        
             first_fit_done = True            
-            y_pred = Q.predict(X_batch)
+            y_pred = q_predictor.predict(Q, X_batch)
             maes_batch_after = np.abs(y_pred[eb_batch_range, actions_batch] - y_batch[eb_batch_range, actions_batch])                                
             mse_batch_after = np.mean(maes_batch_after**2)
             sse_batch_after = np.sum(maes_batch_after**2)            
@@ -1039,18 +1219,25 @@ if __name__ == "__main__":
             if QL_ORACLE_SLOW_UPDATES_DECAY < 1.0 and Q_oracle is not None:
                 print("[slow Q_target update...]") 
                 Q_oracle.average_with_other(Q, 1.0 - QL_ORACLE_SLOW_UPDATES_DECAY)
+                eb.invalidate_oracle_values()
                 print("[slow Q_target update done.]")
         if LEARNING_ON and QL_ORACLE_SWITCHING and (epi + 1)  % QL_ORACLE_SWITCH_GAP_EPISODES == 0 and (epi + 1) >= QL_ORACLE_FIRST_SWITCH_AFTER_EPISODE:
             if Q_oracle is None or not QL_ORACLE_SLOW_UPDATES_DECAY < 1.0:
                 print("[switching Q_target...]")         
                 Q_oracle = deepcopy(Q)
+                eb.invalidate_oracle_values()
                 print("[switching Q_target done.]")
-        eps = max(QL_EPS_MIN, QL_EPS_MAX - (epi + 1) / (QL_EPS_MIN_AT_EPISODE - 1) * (QL_EPS_MAX - QL_EPS_MIN)) 
         t2_loop_body = time.time()            
         print(f"[whole loop body time: {t2_loop_body - t1_loop_body} s]")
+    if pool is not None:
+        pool.close()
+        pool.join()
     if LEARNING_ON:    
         pickle_all(FOLDER_MODELS + f"{ehs}_q.bin", [Q])
         Q.json_dump(FOLDER_MODELS + f"{ehs}_q.json")
-        pickle_all(FOLDER_EXTRAS + f"{ehs}_extras.bin", [extras])           
+        pickle_all(FOLDER_EXTRAS + f"{ehs}_extras.bin", [extras])
+        eb.flush()           
+        if EXPERIENCE_BUFFER_SNAPSHOT:
+            save_experience(FOLDER_EXPERIENCE + f"{ehs}_eb.zip", eb)
     t2_main = time.time()
     print(f"CAR PARKING EXPERIMENT DONE. [time: {t2_main - t1_main} s]")
\ No newline at end of file
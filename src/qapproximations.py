@@ -3,10 +3,170 @@ from numba import jit
 from numba import int32, float64, boolean
 from sklearn.base import BaseEstimator, RegressorMixin
 from sklearn.neural_network import MLPRegressor
+from sklearn.neural_network._base import ACTIVATIONS
 from sklearn.exceptions import ConvergenceWarning
 import warnings
 import json
 import sys
+from features import PolynomialEngine
+
+# Q APPROXIMATIONS CONSTANTS
+Q_PREDICT_CHUNK_SIZE = 16384 # max rows per chunk in batched evaluations (see QBatchPredictor)
+Q_PREDICT_CHUNK_BYTES = 64 * 2**20 # bound on widest activation buffer per chunk (float64, all heads), rows per chunk reduced accordingly (see predict_chunk_rows)
+
+def predict_chunk_rows(Q, chunk_size=Q_PREDICT_CHUNK_SIZE): # rows per chunk for Q such that its widest activation buffer (activations_per_row floats per row) fits in Q_PREDICT_CHUNK_BYTES
+    # (buffers of all layers kept, hence temporaries bounded by number of layers times Q_PREDICT_CHUNK_BYTES)
+    return max(min(chunk_size, Q_PREDICT_CHUNK_BYTES // (8 * Q.activations_per_row())), 1)
+
+def allocate_scratch(key, shape): # scratch function allocating new arrays (for calls without QBatchPredictor)
+    return np.empty(shape)
+
+def mlp_forward(mlp, X, scratch): # forward pass of fitted sklearn MLP (as in its predict, without input validation), activations of layers kept in scratch arrays (see QBatchPredictor.scratch)
+    activation = X
+    hidden_activation = ACTIVATIONS[mlp.activation]
+    n_layers = len(mlp.coefs_)
+    for l in range(n_layers):
+        buffer = scratch(l, (X.shape[0], mlp.coefs_[l].shape[1]))
+        np.dot(activation, mlp.coefs_[l], out=buffer)
+        buffer += mlp.intercepts_[l]
+        if l < n_layers - 1:
+            hidden_activation(buffer)
+        activation = buffer
+    return activation
+
+def mlp_heads_forward(coefs, intercepts, activation_name, X, scratch): # fused forward pass of several MLPs of same architecture (heads) on same input, with weights stacked along heads axis: 
+    # coefs[l] (n_heads, n_in, n_out), intercepts[l] (n_heads, 1, n_out), batched matmuls over heads axis, returns last activations (n_heads, m, n_out)
+    activation = X
+    hidden_activation = ACTIVATIONS[activation_name]
+    n_layers = len(coefs)
+    for l in range(n_layers):
+        buffer = scratch(("heads", l), (coefs[l].shape[0], X.shape[0], coefs[l].shape[2]))
+        np.matmul(activation, coefs[l], out=buffer)
+        buffer += intercepts[l]
+        if l < n_layers - 1:
+            hidden_activation(buffer)
+        activation = buffer
+    return activation
+
+MLP_ACTIVATION_CODES = {"identity": 0, "relu": 1, "tanh": 2, "logistic": 3} # (as in sklearn ACTIVATIONS, for compiled forward pass)
+
+@jit(nopython=True, cache=True)
+def mlp_heads_forward_row_numba(weights, layers, activation, x, buffer_a, buffer_b, out): # forward pass of several MLPs (heads) on single input row x, weights packed flat layer by layer (see QMLPRegressor.stack_weights):
+    # coefs (n_heads, n_in, n_out) followed by intercepts (n_heads, n_out), layers (n_layers, 2): n_in, n_out, buffers (n_heads, max n_out), last activations written into out (n_heads, n_out of last layer)
+    n_heads = out.shape[0]
+    n_layers = layers.shape[0]
+    offset = 0
+    activation_in = buffer_a
+    activation_out = buffer_b
+    for l in range(n_layers):
+        n_in, n_out = layers[l, 0], layers[l, 1]
+        coefs = weights[offset : offset + n_heads * n_in * n_out].reshape((n_heads, n_in, n_out))
+        offset += n_heads * n_in * n_out
+        intercepts = weights[offset : offset + n_heads * n_out].reshape((n_heads, n_out))
+        offset += n_heads * n_out
+        if l == n_layers - 1:
+            activation_out = out
+        for h in range(n_heads):
+            for j in range(n_out):
+                activation_out[h, j] = 0.0
+            for k in range(n_in):
+                a = x[k] if l == 0 else activation_in[h, k]
+                for j in range(n_out):
+                    activation_out[h, j] += a * coefs[h, k, j]
+            for j in range(n_out):
+                v = activation_out[h, j] + intercepts[h, j]
+                if l < n_layers - 1:
+                    if activation == 1:
+                        v = max(v, 0.0)
+                    elif activation == 2:
+                        v = np.tanh(v)
+                    elif activation == 3:
+                        v = 1.0 / (1.0 + np.exp(-v))
+                activation_out[h, j] = v
+        activation_in, activation_out = activation_out, activation_in
+
+class QBatchPredictor: # fused evaluation of Q-models over large batches: chunks of rows (bounded memory), activation buffers allocated once and reused across chunks and calls
+
+    def __init__(self, chunk_size=Q_PREDICT_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self.buffers_ = {}
+        
+    def scratch(self, key, shape): # buffer of given shape for given key (e.g. layer index), as view of flat array reallocated only when too small
+        size = int(np.prod(shape))
+        buffer = self.buffers_.get(key)
+        if buffer is None or buffer.size < size:
+            buffer = np.empty(size)
+            self.buffers_[key] = buffer
+        return buffer[:size].reshape(shape)
+
+    def predict(self, Q, X, out=None): # as Q.predict(X), chunk by chunk into out or new array
+        m = X.shape[0]
+        if out is None:
+            out = np.empty((m, Q.n_actions))
+        chunk_size = predict_chunk_rows(Q, self.chunk_size)
+        for i in range(0, m, chunk_size):
+            Q.predict_into(X[i : i + chunk_size], out[i : i + chunk_size], self.scratch)
+        return out
+    
+    def targets(self, Q, Q_oracle, X, X_next, rewards, terminals, n_actions, qns_oracle=None): # in one pass over chunks: predictions of Q for states (before fit) and Double DQN quantities for next states
+        # argmaxes from Q, maxes as values of Q_oracle (or of given qns_oracle, e.g. cached) at them, terminal next states valued by their rewards, models equal to None treated as zero
+        # returns: y_pred, qns_argmaxes, qns_maxes
+        m = X.shape[0]
+        y_pred = np.zeros((m, n_actions))
+        qns_argmaxes = np.zeros(m, dtype=np.int64)
+        qns_maxes = np.zeros(m)
+        chunk_size = min([predict_chunk_rows(model, self.chunk_size) for model in [Q, Q_oracle] if model is not None], default=self.chunk_size)
+        for i in range(0, m, chunk_size):
+            j = min(i + chunk_size, m)
+            rows = np.arange(j - i)
+            if Q is not None:
+                Q.predict_into(X[i : j], y_pred[i : j], self.scratch)
+                qns = self.scratch("qns", (j - i, n_actions))
+                Q.predict_into(X_next[i : j], qns, self.scratch)
+                qns_argmaxes[i : j] = np.argmax(qns, axis=1)
+            if qns_oracle is not None:
+                qns_maxes[i : j] = qns_oracle[i : j][rows, qns_argmaxes[i : j]]
+            elif Q_oracle is not None:
+                qns_oracle_chunk = self.scratch("qns_oracle", (j - i, n_actions))
+                Q_oracle.predict_into(X_next[i : j], qns_oracle_chunk, self.scratch)
+                qns_maxes[i : j] = qns_oracle_chunk[rows, qns_argmaxes[i : j]]
+        qns_argmaxes[terminals] = 0 # ("virtual" next states preserve rewards of terminals for all actions)
+        qns_maxes[terminals] = rewards[terminals]
+        return y_pred, qns_argmaxes, qns_maxes
+
+class QPolicy: # greedy policy for single states with low latency (e.g. steering loop): compiled polynomial features and forward pass of Q into preallocated buffers (Q refitted in place seen by policy)
+    # to be built once per model (not per episode), per-action MLPs (QMLPRegressor) evaluated by one compiled call on their packed weights, other models by predict_into
+
+    def __init__(self, Q, transformer, state_size=None): # state_size: None meaning taken from first state acted on
+        self.Q_ = Q
+        self.transformer_ = transformer
+        self.engine_ = None
+        if state_size is not None:
+            self._build_engine(state_size)
+        self.q_values_ = np.empty((1, Q.n_actions))
+        self.predictor_ = QBatchPredictor(chunk_size=1)
+        self.compiled_ = isinstance(Q, QMLPRegressor) and hasattr(Q, "mlps_")
+        if self.compiled_:
+            if not hasattr(Q, "weights_packed_"): # (e.g. models pickled before packing)
+                Q.stack_weights()
+            width = int(np.max(Q.layers_packed_[:, 1]))
+            self.buffer_a_ = np.empty((Q.n_actions, width))
+            self.buffer_b_ = np.empty((Q.n_actions, width))
+            self.activation_ = MLP_ACTIVATION_CODES[Q.mlps_[0].activation]
+
+    def _build_engine(self, state_size):
+        self.engine_ = PolynomialEngine(self.transformer_, state_size)
+        self.features_ = np.empty((1, self.engine_.n_output_features_))
+
+    def act(self, state): # returns: Q-values (view of buffer, valid until next call) and greedy action index
+        if self.engine_ is None:
+            self._build_engine(state.size)
+        self.engine_.transform_row(state, self.features_[0])
+        if self.compiled_:
+            mlp_heads_forward_row_numba(self.Q_.weights_packed_, self.Q_.layers_packed_, self.activation_, self.features_[0], self.buffer_a_, self.buffer_b_, self.q_values_.reshape(-1, 1))
+        else:
+            self.Q_.predict_into(self.features_, self.q_values_, self.predictor_.scratch)
+        return self.q_values_[0], int(np.argmax(self.q_values_[0]))
 
 class QMLPRegressor(BaseEstimator, RegressorMixin):
 
@@ -35,7 +195,7 @@ class QMLPRegressor(BaseEstimator, RegressorMixin):
     def __repr__(self):
         return self.__str__()      
         
-    def fit(self, X, y, actions_taken=None):
+    def fit(self, X, y, actions_taken=None, sample_weight=None):
         if self.ema_decay > 0.0:
             last_coefs = []
             last_intercepts = []
@@ -61,7 +221,10 @@ class QMLPRegressor(BaseEstimator, RegressorMixin):
             if indexes.size > 0:
                 X_sub = X[indexes]
                 y_sub = y[indexes, a]                
-                self.mlps_[a].fit(X_sub, y_sub)
+                if sample_weight is None:
+                    self.mlps_[a].fit(X_sub, y_sub)
+                else:
+                    self.mlps_[a].fit(X_sub, y_sub, sample_weight=sample_weight[indexes]) # (MLPRegressor accepting sample_weight from scikit-learn 1.7 on)
             else:
                 self.mlps_[a].coefs_ = last_coefs[a]
                 self.mlps_[a].intercepts_ = last_intercepts[a]
@@ -70,19 +233,37 @@ class QMLPRegressor(BaseEstimator, RegressorMixin):
                 for l in range(len(self.hidden_layer_sizes)):                            
                     self.mlps_[a].coefs_[l] = self.ema_decay * last_coefs[a][l] + (1.0 - self.ema_decay) * self.mlps_[a].coefs_[l]
                     self.mlps_[a].intercepts_[l] = self.ema_decay * last_intercepts[a][l] + (1.0 - self.ema_decay) * self.mlps_[a].intercepts_[l]             
+        self.stack_weights()
+    
+    def activations_per_row(self): # floats per row in widest activation buffer of forward pass (all heads)
+        return self.n_actions * max(self.hidden_layer_sizes)
+
+    def stack_weights(self): # weights of per-action MLPs stacked along heads axis for fused forward pass (refreshed after fit and average_with_other)
+        n_layers = len(self.mlps_[0].coefs_)
+        self.coefs_stacked_ = [np.stack([mlp.coefs_[l] for mlp in self.mlps_]) for l in range(n_layers)]
+        self.intercepts_stacked_ = [np.stack([mlp.intercepts_[l] for mlp in self.mlps_])[:, np.newaxis, :] for l in range(n_layers)]
+        # flat copy of stacked weights for compiled single-row forward pass (see mlp_heads_forward_row_numba)
+        self.weights_packed_ = np.concatenate([a.ravel() for l in range(n_layers) for a in (self.coefs_stacked_[l], self.intercepts_stacked_[l])])
+        self.layers_packed_ = np.array([self.coefs_stacked_[l].shape[1:] for l in range(n_layers)], dtype=np.int64)
                                     
-    def predict(self, X):  
-        m = X.shape[0]
-        y = np.zeros((m, self.n_actions))
-        for a in range(self.n_actions):
-            y[:, a] = self.mlps_[a].predict(X)
+    def predict(self, X): # all heads at once, chunk by chunk (bounded memory, see predict_chunk_rows)
+        y = np.empty((X.shape[0], self.n_actions))
+        chunk_size = predict_chunk_rows(self)
+        for i in range(0, X.shape[0], chunk_size):
+            self.predict_into(X[i : i + chunk_size], y[i : i + chunk_size], allocate_scratch)
         return y
     
+    def predict_into(self, X, out, scratch): # as predict, but written into out (m, n_actions) with activations in scratch arrays (see QBatchPredictor), all heads evaluated at once
+        if not hasattr(self, "coefs_stacked_"): # (e.g. models pickled before stacking)
+            self.stack_weights()
+        out[:] = mlp_heads_forward(self.coefs_stacked_, self.intercepts_stacked_, self.mlps_[0].activation, X, scratch)[:, :, 0].T
+    
     def average_with_other(self, other, fraction_other):
         for a  in range(self.n_actions):
             for l in range(len(self.hidden_layer_sizes)):                            
                 self.mlps_[a].coefs_[l] = (1.0 - fraction_other) * self.mlps_[a].coefs_[l] + fraction_other * other.mlps_[a].coefs_[l]
                 self.mlps_[a].intercepts_[l] = (1.0 - fraction_other) * self.mlps_[a].intercepts_[l] + fraction_other * other.mlps_[a].intercepts_[l]
+        self.stack_weights()
                
     def json_dump(self, fname):
         d = {}
@@ -158,7 +339,7 @@ class QMLPRegressorShared(BaseEstimator, RegressorMixin):
     def __repr__(self):
         return self.__str__()      
         
-    def fit(self, X, y, actions_taken=None):
+    def fit(self, X, y, actions_taken=None, sample_weight=None):
         if self.ema_decay > 0.0:
             last_coefs = []
             last_intercepts = []
@@ -167,7 +348,10 @@ class QMLPRegressorShared(BaseEstimator, RegressorMixin):
                 last_intercepts.append(np.copy(self.mlp_.intercepts_[l]))                
         if not hasattr(self, "mlp_"):
             self.mlp_ = MLPRegressor(hidden_layer_sizes=self.hidden_layer_sizes, max_iter=self.n_steps, batch_size=self.batch_size, learning_rate_init=self.learning_rate, random_state=self.random_state, warm_start=True)                    
-        self.mlp_.fit(X, y)
+        if sample_weight is None:
+            self.mlp_.fit(X, y)
+        else:
+            self.mlp_.fit(X, y, sample_weight=sample_weight) # (MLPRegressor accepting sample_weight from scikit-learn 1.7 on)
         if self.ema_decay > 0.0 and len(last_coefs) > 0:
             for l in range(len(self.hidden_layer_sizes)):                            
                 self.mlp_.coefs_[l] = self.ema_decay * last_coefs[l] + (1.0 - self.ema_decay) * self.mlp_.coefs_[l]
@@ -175,6 +359,12 @@ class QMLPRegressorShared(BaseEstimator, RegressorMixin):
                                     
     def predict(self, X):         
         return self.mlp_.predict(X)
+
+    def activations_per_row(self): # floats per row in widest activation buffer of forward pass
+        return max(max(self.hidden_layer_sizes), self.n_actions)
+    
+    def predict_into(self, X, out, scratch): # as predict, but written into out (m, n_actions) with activations in scratch arrays (see QBatchPredictor)
+        out[:] = mlp_forward(self.mlp_, X, scratch)
     
     def average_with_other(self, other, fraction_other):
         for l in range(len(self.hidden_layer_sizes)):                            
@@ -245,7 +435,7 @@ class QRidgeRegressor(BaseEstimator, RegressorMixin):
         s += f"ema_decay: {self.ema_decay})"
         return s        
         
-    def fit(self, X, y, actions_taken=None):
+    def fit(self, X, y, actions_taken=None, sample_weight=None):
         m, n = X.shape
         if hasattr(self, "coefs_"):
             last_coefs = self.coefs_
@@ -256,6 +446,10 @@ class QRidgeRegressor(BaseEstimator, RegressorMixin):
         self.coefs_ = np.zeros((self.n_actions, n))
         self.intercepts_ = np.zeros(self.n_actions)        
         X_ext = np.copy(np.c_[np.ones((m, 1)), X]) if self.fit_intercept else X        
+        if sample_weight is not None: # weighted least squares via rows scaled by square roots of weights
+            sqrt_weights = np.sqrt(sample_weight)[:, np.newaxis]
+            X_ext = X_ext * sqrt_weights
+            y = y * sqrt_weights
         if self.use_numba:
             result = QRidgeRegressor.fit_numba(X_ext, y, actions_taken, last_coefs, last_intercepts, self.n_actions, self.l2_penalty, self.fit_intercept, self.sample_size_factor)
             if self.fit_intercept:
@@ -271,7 +465,7 @@ class QRidgeRegressor(BaseEstimator, RegressorMixin):
             self.intercepts_ = self.ema_decay * last_intercepts + (1.0 - self.ema_decay) * self.intercepts_ 
 
     @staticmethod
-    @jit(float64[:, :](float64[:, :], float64[:, :], int32[:], float64[:, :], float64[:], int32, float64, boolean, boolean), nopython=True)
+    @jit(float64[:, :](float64[:, :], float64[:, :], int32[:], float64[:, :], float64[:], int32, float64, boolean, boolean), nopython=True, cache=True)
     def fit_numba(X_ext, y, actions_taken, last_coefs, last_intercepts, self_n_actions, self_l2_penalty, self_fit_intercept, self_sample_size_factor):
         m, n = X_ext.shape
         penalty_matrix = self_l2_penalty * np.identity(n)
@@ -338,6 +532,14 @@ class QRidgeRegressor(BaseEstimator, RegressorMixin):
             y_pred += self.intercepts_
         return y_pred
     
+    def predict_into(self, X, out, scratch=None): # as predict, but written into out (m, n_actions)
+        np.dot(X, self.coefs_.T, out=out)
+        if self.fit_intercept:
+            out += self.intercepts_
+
+    def activations_per_row(self): # (no activation buffers, only outputs)
+        return self.n_actions
+    
     def average_with_other(self, other, fraction_other):
         self.coefs_ = (1.0 - fraction_other) * self.coefs_ + fraction_other * other.coefs_
         self.intercepts_ = (1.0 - fraction_other) * self.intercepts_ + fraction_other * other.intercepts_    
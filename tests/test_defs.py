@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+import main
+from defs import CarBatch, CAR_ACCELERATION_MAGNITUDES_AHEAD, CAR_ACCELERATION_MAGNITUDES_BACK, CAR_ACCELERATION_MAGNITUDES_SIDE
+
+SCENE_NAMES = ["pp_west_side_10_angle_pi", "obstacles_1", "pp_middle_obstacles_oppdist_1_side_10_angle_pi", "pp_random_car_random_side_20"]
+DT = main.QL_DT
+DT_SINCE_ACTION = main.QL_DT * main.QL_STEERING_GAP_STEPS
+TIME_LIMIT = 10.0
+
+def scene(name, seed):
+    np.random.seed(seed)
+    return getattr(main, "scene_" + name)()
+
+def accelerate(car, action_pair):
+    if action_pair[0] > 0:
+        car.accelerate_ahead(CAR_ACCELERATION_MAGNITUDES_AHEAD[action_pair[0]])
+    elif action_pair[0] < 0:
+        car.accelerate_back(CAR_ACCELERATION_MAGNITUDES_BACK[-action_pair[0]])
+    if action_pair[1] > 0:
+        car.accelerate_right(CAR_ACCELERATION_MAGNITUDES_SIDE[action_pair[1]])
+    elif action_pair[1] < 0:
+        car.accelerate_left(CAR_ACCELERATION_MAGNITUDES_SIDE[-action_pair[1]])
+
+def test_car_batch_step_equals_car_step():
+    scenes = [scene(name, seed) for name in SCENE_NAMES for seed in [0, 1]]
+    batch = CarBatch(scenes)
+    rng = np.random.RandomState(0)
+    n_frames = 300
+    for frame in range(n_frames):
+        if frame % 20 == 0: # actions held for a while, mostly ahead (to reach obstacles)
+            action_pairs = [(1 if rng.rand() < 0.8 else -1, rng.randint(-1, 2)) for _ in scenes]
+        aheads = np.zeros(len(scenes))
+        backs = np.zeros(len(scenes))
+        rights = np.zeros(len(scenes))
+        lefts = np.zeros(len(scenes))
+        for i, (s, action_pair) in enumerate(zip(scenes, action_pairs)):
+            accelerate(s.car_, action_pair)
+            aheads[i] = CAR_ACCELERATION_MAGNITUDES_AHEAD[action_pair[0]] if action_pair[0] > 0 else 0.0
+            backs[i] = CAR_ACCELERATION_MAGNITUDES_BACK[-action_pair[0]] if action_pair[0] < 0 else 0.0
+            rights[i] = CAR_ACCELERATION_MAGNITUDES_SIDE[action_pair[1]] if action_pair[1] > 0 else 0.0
+            lefts[i] = CAR_ACCELERATION_MAGNITUDES_SIDE[-action_pair[1]] if action_pair[1] < 0 else 0.0
+        batch.accelerate_ahead(aheads)
+        batch.accelerate_back(backs)
+        batch.accelerate_right(rights)
+        batch.accelerate_left(lefts)
+        time_remaining = TIME_LIMIT - frame * DT
+        for s in scenes:
+            s.car_.step(DT, DT_SINCE_ACTION, time_remaining, s.obstacles_, s.park_place_)
+        batch.step(DT, DT_SINCE_ACTION, time_remaining)
+        for i, s in enumerate(scenes):
+            assert np.array_equal(batch.states_[i], s.car_.state_, equal_nan=True), f"car {i} differs at frame {frame}"
+            assert (batch.collided_[i], batch.parked_[i], batch.time_exceeded_[i]) == (s.car_.collided_, s.car_.parked_, s.car_.time_exceeded_)
+    assert np.any(batch.collided_) # (some collision covered)
+    
+@pytest.mark.parametrize("name", SCENE_NAMES)
+def test_car_advance_equals_stepping_frame_by_frame(name):
+    scene_stepped = scene(name, 3)
+    scene_advanced = scene(name, 3)
+    car_stepped, car_advanced = scene_stepped.car_, scene_advanced.car_
+    rng = np.random.RandomState(1)
+    gap = main.QL_STEERING_GAP_STEPS
+    frame = 0
+    while frame * DT < TIME_LIMIT and not (car_advanced.collided_ or car_advanced.parked_):
+        action_pair = main.ACTION_PAIRS[rng.randint(len(main.ACTION_PAIRS))]
+        accelerate(car_stepped, action_pair)
+        accelerate(car_advanced, action_pair)
+        n_performed, distances, _, _, _ = car_advanced.advance(action_pair, gap, frame, DT, DT_SINCE_ACTION, TIME_LIMIT, scene_advanced.obstacles_, scene_advanced.park_place_)
+        distances_stepped = 0.0
+        for j in range(n_performed):
+            if j > 0:
+                accelerate(car_stepped, action_pair)
+            car_stepped.step(DT, DT_SINCE_ACTION, TIME_LIMIT - (frame + j) * DT, scene_stepped.obstacles_, scene_stepped.park_place_)
+            distances_stepped += car_stepped.distance_
+        assert n_performed == gap or car_stepped.collided_ or car_stepped.parked_ or (frame + n_performed) * DT >= TIME_LIMIT
+        assert distances == distances_stepped
+        assert np.array_equal(car_advanced.state_, car_stepped.state_, equal_nan=True)
+        assert (car_advanced.collided_, car_advanced.parked_) == (car_stepped.collided_, car_stepped.parked_)
+        frame += n_performed
+    assert car_advanced.history_.size_ == car_stepped.history_.size_
+    assert np.array_equal(np.array(car_advanced.x_history_), np.array(car_stepped.x_history_))
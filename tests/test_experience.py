@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from experience import ExperienceBuffer
+
+STATE_SIZE = 5
+
+def episode(rng, n, separate_states=False): # trajectory of n transitions as from EpisodeTrajectory (separate_states: each transition with its own state and next state)
+    n_states = 2 * n if separate_states else n + 1
+    states = rng.randn(n_states, STATE_SIZE)
+    state_idxs = np.arange(0, n_states - 1, 2 if separate_states else 1)
+    next_state_idxs = state_idxs + 1
+    actions = rng.randint(9, size=n).astype(np.int8)
+    rewards = rng.randn(n)
+    terminals = np.zeros(n, dtype=bool)
+    terminals[-1] = True
+    return states, state_idxs, next_state_idxs, actions, rewards, terminals
+
+def fill(eb, rng, n_episodes, separate_states=False): # returns expected live window (states, actions, rewards, next states, terminals), oldest transition first
+    expected = []
+    for _ in range(n_episodes):
+        states, state_idxs, next_state_idxs, actions, rewards, terminals = episode(rng, rng.randint(5, 40), separate_states)
+        eb.append(states, state_idxs, next_state_idxs, actions, rewards, terminals)
+        expected += list(zip(states[state_idxs], actions, rewards, states[next_state_idxs], terminals))
+    expected = expected[len(expected) - eb.size_:]
+    return [np.array(column) for column in zip(*expected)]
+
+def assert_window_equal(eb, expected):
+    assert eb.size_ == expected[0].shape[0]
+    for a, b in zip(eb.sample(np.arange(eb.size_)), expected):
+        assert np.array_equal(a, b)
+
+@pytest.mark.parametrize("separate_states", [False, True])
+def test_sample_returns_live_window(separate_states):
+    eb = ExperienceBuffer(300, STATE_SIZE)
+    expected = fill(eb, np.random.RandomState(0), 40, separate_states) # (wrapped around several times)
+    assert_window_equal(eb, expected)
+
+def test_prioritized_sampling_proportional_to_priorities():
+    eb = ExperienceBuffer(1000, STATE_SIZE)
+    fill(eb, np.random.RandomState(1), 60)
+    eb.prioritize(alpha=1.0, eps=0.0)
+    high = np.arange(eb.size_) % 4 == 0
+    eb.update_priorities(np.arange(eb.size_), np.where(high, 3.0, 1.0))
+    np.random.seed(0)
+    indexes, weights = eb.sample_prioritized(20000)
+    assert np.all((indexes >= 0) & (indexes < eb.size_))
+    expected_fraction = 3.0 * np.sum(high) / (3.0 * np.sum(high) + np.sum(~high))
+    assert abs(np.mean(high[indexes]) - expected_fraction) < 0.01
+    assert np.max(weights) == 1.0
+    assert np.all(weights[high[indexes]] < weights[~high[indexes]][0]) # (importance sampling weights smaller for frequently drawn transitions)
+    eb.update_priorities(np.arange(eb.size_), np.where(high, 1.0, 0.0))
+    indexes, _ = eb.sample_prioritized(5000)
+    assert np.all(high[indexes])
+
+@pytest.mark.parametrize("compressed", [False, True])
+def test_snapshot_round_trip(tmp_path, compressed):
+    eb = ExperienceBuffer(500, STATE_SIZE)
+    expected = fill(eb, np.random.RandomState(2), 50)
+    eb.update_priorities(np.arange(eb.size_), np.arange(eb.size_, dtype=np.float64))
+    fname = str(tmp_path / "snapshot.zip")
+    eb.save(fname, compressed=compressed, chunk_size=64) # (several chunks)
+    eb_loaded = ExperienceBuffer(500, STATE_SIZE)
+    eb_loaded.load(fname)
+    assert_window_equal(eb_loaded, expected)
+    assert np.array_equal(eb_loaded.priorities_[eb_loaded.slots(np.arange(eb_loaded.size_))], np.arange(eb.size_))
+    eb_smaller = ExperienceBuffer(200, STATE_SIZE) # (oldest transitions dropped)
+    eb_smaller.load(fname)
+    assert_window_equal(eb_smaller, [column[-200:] for column in expected])
+
+def test_snapshot_state_size_mismatch(tmp_path):
+    eb = ExperienceBuffer(100, STATE_SIZE)
+    fill(eb, np.random.RandomState(3), 3)
+    fname = str(tmp_path / "snapshot.zip")
+    eb.save(fname)
+    with pytest.raises(ValueError):
+        ExperienceBuffer(100, STATE_SIZE + 1).load(fname)
+
+@pytest.mark.parametrize("separate_states", [False, True])
+def test_memmap_reopened_and_continued(tmp_path, separate_states):
+    folder = str(tmp_path) + "/"
+    rng = np.random.RandomState(4)
+    eb = ExperienceBuffer(400, STATE_SIZE, folder=folder)
+    expected = fill(eb, rng, 10, separate_states)
+    del eb # (no flush, as after crash: header written with each append)
+    eb = ExperienceBuffer.open(folder, mode="r+")
+    assert_window_equal(eb, expected)
+    expected_more = fill(eb, rng, 30, separate_states) # (wrapped around, states ring grown on demand if separate states)
+    expected = [np.concatenate((a, b))[-eb.size_:] for a, b in zip(expected, expected_more)]
+    assert (eb.states_capacity_ > 500) == separate_states
+    assert_window_equal(eb, expected)
+    assert_window_equal(ExperienceBuffer.open(folder, mode="r"), expected)
+
+def test_memmap_header_consistent_with_every_append(tmp_path):
+    folder = str(tmp_path) + "/"
+    rng = np.random.RandomState(5)
+    eb = ExperienceBuffer(200, STATE_SIZE, folder=folder)
+    expected = None
+    for _ in range(30):
+        states, state_idxs, next_state_idxs, actions, rewards, terminals = episode(rng, rng.randint(5, 40), True)
+        eb.append(states, state_idxs, next_state_idxs, actions, rewards, terminals)
+        new = [states[state_idxs], actions, rewards, states[next_state_idxs], terminals]
+        expected = new if expected is None else [np.concatenate((a, b)) for a, b in zip(expected, new)]
+        reader = ExperienceBuffer.open(folder, mode="r") # (as seen by restart at this moment)
+        assert reader.size_ == eb.size_
+        assert_window_equal(reader, [column[-reader.size_:] for column in expected])
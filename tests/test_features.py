@@ -0,0 +1,18 @@
+import numpy as np
+import pytest
+from sklearn.preprocessing import PolynomialFeatures
+from features import PolynomialEngine
+
+@pytest.mark.parametrize("params", [dict(degree=1, include_bias=False), dict(degree=2, include_bias=False), dict(degree=3, include_bias=True), dict(degree=3, interaction_only=True, include_bias=False)])
+def test_polynomial_engine_equals_polynomial_features(params):
+    X = np.random.RandomState(0).randn(50, 7)
+    transformer = PolynomialFeatures(**params)
+    expected = transformer.fit_transform(X)
+    engine = PolynomialEngine(transformer, X.shape[1])
+    assert np.array_equal(engine.transform(X), expected)
+    assert np.array_equal(np.array([engine.transform_row(x) for x in X]), expected)
+    assert np.array_equal(engine.transform(X, dtype=np.float32), expected.astype(np.float32))
+
+def test_polynomial_engine_rejects_minimal_degree_above_one():
+    with pytest.raises(ValueError):
+        PolynomialEngine(PolynomialFeatures(degree=(2, 3)), 3)
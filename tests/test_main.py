@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+import main
+
+class StateHashQ: # stand-in for Q model: deterministic (pseudo-random) greedy action per state, ahead favoured so that episodes end in collisions too
+    n_actions = len(main.ACTION_PAIRS)
+
+    def predict(self, X):
+        y = np.zeros((X.shape[0], self.n_actions))
+        y[np.arange(X.shape[0]), (np.abs(X[:, 1] * 7919.0).astype(np.int64) // 3) % self.n_actions] = 1.0
+        y[:, main.ACTION_PAIRS.index((1, 0))] += 0.5 * (X[:, 2] > 0)
+        return y
+
+    def predict_into(self, X, out, scratch=None):
+        out[:] = self.predict(X)
+
+def assert_results_equal(results_serial, results_vectorized):
+    assert len(results_serial) == len(results_vectorized)
+    for r1, r2 in zip(results_serial, results_vectorized):
+        for a, b in zip(r1[0], r2[0]): # experience
+            assert np.array_equal(a, b)
+        assert r1[1:7] == r2[1:7] # outcome, frames, last reward, rewards total and count, distances total
+        for a, b in zip(r1[8], r2[8]): # state of random generator
+            assert np.array_equal(a, b) if isinstance(a, np.ndarray) else a == b
+
+@pytest.mark.parametrize("name, Q", [("obstacles_1", None), ("pp_middle_obstacles_oppdist_1_side_10_angle_pi", StateHashQ())])
+def test_vectorized_episodes_equal_serial_ones(name, Q):
+    seeds = list(range(100, 110))
+    epss = [0.3] * len(seeds)
+    results_serial = main.run_episodes(seeds, name, Q, epss, True, n_envs=1)
+    results_vectorized = main.run_episodes(seeds, name, Q, epss, True, n_envs=4) # (fewer environments than episodes: recycled ones covered)
+    assert_results_equal(results_serial, results_vectorized)
+    if Q is not None:
+        assert any(r[1] == "collision" for r in results_serial)
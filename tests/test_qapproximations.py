@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from sklearn.preprocessing import PolynomialFeatures
+import qapproximations
+from qapproximations import QMLPRegressor, QMLPRegressorShared, QRidgeRegressor, QPolicy
+
+N_ACTIONS = 9
+STATE_SIZE = 6
+
+def fitted(Q, seed=0):
+    rng = np.random.RandomState(seed)
+    X = PolynomialFeatures(degree=2, include_bias=False).fit_transform(rng.randn(400, STATE_SIZE))
+    Q.fit(X, rng.randn(400, N_ACTIONS), rng.randint(N_ACTIONS, size=400).astype(np.int32))
+    return Q
+
+@pytest.mark.parametrize("activation", ["relu", "tanh", "logistic"])
+def test_mlp_predict_chunked_equals_per_action_mlps(monkeypatch, activation):
+    Q = fitted(QMLPRegressor(N_ACTIONS, (16, 8), n_steps=2, batch_size=64))
+    for mlp in Q.mlps_:
+        mlp.activation = activation
+    X = PolynomialFeatures(degree=2, include_bias=False).fit_transform(np.random.RandomState(1).randn(100, STATE_SIZE))
+    expected = np.array([mlp.predict(X) for mlp in Q.mlps_]).T
+    monkeypatch.setattr(qapproximations, "Q_PREDICT_CHUNK_BYTES", 8 * Q.activations_per_row() * 7) # (7 rows per chunk)
+    assert qapproximations.predict_chunk_rows(Q) == 7
+    assert np.allclose(Q.predict(X), expected, rtol=1e-12, atol=1e-12)
+
+@pytest.mark.parametrize("Q", [QMLPRegressor(N_ACTIONS, (16, 8), n_steps=2, batch_size=64), QMLPRegressorShared(N_ACTIONS, (16,), n_steps=2, batch_size=64), QRidgeRegressor(N_ACTIONS, use_numba=True)])
+def test_policy_act_equals_predict(Q):
+    Q = fitted(Q)
+    transformer = PolynomialFeatures(degree=2, include_bias=False)
+    states = np.random.RandomState(2).randn(50, STATE_SIZE)
+    expected = Q.predict(transformer.fit_transform(states))
+    policy = QPolicy(Q, transformer)
+    for state, y in zip(states, expected):
+        q_values, action = policy.act(state)
+        assert np.allclose(q_values, y, rtol=1e-12, atol=1e-12)
+        assert action == np.argmax(y)
+    Q = fitted(Q, seed=1) # (refitted in place, seen by same policy)
+    assert np.allclose(policy.act(states[0])[0], Q.predict(transformer.transform(states[:1]))[0], rtol=1e-12, atol=1e-12)